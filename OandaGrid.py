@@ -1,5 +1,4 @@
 from oandapyV20 import API
-import oandapyV20.endpoints.orders as orders
 import oandapyV20.endpoints.instruments as instruments
 import oandapyV20.endpoints.positions as positions
 import oandapyV20.endpoints.accounts as accounts
@@ -9,6 +8,9 @@ import pandas as pd
 import pandas_ta as ta
 import logging
 from database_functions import get_instrument_value, get_instrument_list, fetch_historical_data, set_instruments_table
+from scheduler import BarCloseTrigger
+from grid_reconciler import GridReconciler, tagged_orders
+from state_store import StateStore
 
 logging.basicConfig(
     #filename="logs/algo.log",
@@ -29,9 +31,8 @@ class OandaGrid:
         self.tp_pct = 0.01 # Take profit percentage
         self.sl_pct = 0.01 # Stop loss percentage
         self.order_size_percent = 3 # Order size as a percentage of the account balance
-        self.timer = datetime.utcnow() - timedelta(days=1)  # Ensure the first run is immediate
         self.is_running_grid = False
-        self.grid_setup_time = datetime.utcnow() - timedelta(days=8)  # Ensure grid setup on the first run
+        self.grid_setup_time = None
         self.access_token = access_token
 
         #self.reset_grid()
@@ -46,6 +47,32 @@ class OandaGrid:
         self.chop_length = 14
         self.chop_atr_length = 1
 
+        self.state_store = StateStore(f"data/oanda_grid_state_{self.account_id}.json")
+        self.restore_state()
+
+    def checkpoint(self):
+        self.state_store.set('grid', {
+            "instrument": self.instrument,
+            "is_running_grid": self.is_running_grid,
+            "grid_setup_time": self.grid_setup_time.isoformat() if self.grid_setup_time else None,
+        })
+
+    def restore_state(self):
+        """Pick up a running grid from the checkpoint if the account (one AccountDetails request) still has it."""
+        state = self.state_store.load().get('grid')
+        if not state or not state['is_running_grid']:
+            return
+        account = self.api.request(accounts.AccountDetails(self.account_id))['account']
+        held = {position['instrument'] for position in account.get('positions', [])
+                if float(position['long']['units']) or float(position['short']['units'])}
+        if state['instrument'] not in held and state['instrument'] not in tagged_orders(account.get('orders', [])):
+            logging.info(f"Checkpointed grid for {state['instrument']} has no orders or positions left")
+            return
+        self.instrument = state['instrument']
+        self.is_running_grid = True
+        self.grid_setup_time = datetime.fromisoformat(state['grid_setup_time'])
+        logging.info(f"Resumed grid for {self.instrument} set up at {self.grid_setup_time}")
+
     def set_conversion_factor(self):
         r = pricing.PricingInfo(accountID=self.account_id, params={"instruments": self.instrument})
         quoteHomeConversionFactors = self.api.request(r)['prices'][0]['quoteHomeConversionFactors']
@@ -132,7 +159,15 @@ class OandaGrid:
         # Finally, adjust the price to the correct pip location
         return adjusted_price
 
-    def place_grid_orders(self, current_price, is_buy):
+    def place_grid_orders(self, current_price):
+        # Both sides in one pass, so re-centering only replaces the levels that moved
+        reconciler = GridReconciler(self.api, self.account_id, self.instrument)
+        desired = {**self.grid_orders(reconciler, current_price, is_buy=True),
+                   **self.grid_orders(reconciler, current_price, is_buy=False)}
+        reconciler.reconcile(desired)
+
+    def grid_orders(self, reconciler, current_price, is_buy):
+        desired = {}
         for i in range(1, self.grid_num + 1):
             price_adjustment = i * self.grid_size_pct * current_price
             price = current_price - price_adjustment if is_buy else current_price + price_adjustment
@@ -143,7 +178,11 @@ class OandaGrid:
                 price * (1 - self.sl_pct)) if is_buy else self.adjust_price_to_pip_location(price * (1 + self.sl_pct))
             units = self.trade_size if is_buy else -self.trade_size
 
-            self.create_order(units, price, take_profit, stop_loss)
+            level = f"{'buy' if is_buy else 'sell'}{i}"
+            desired[level] = reconciler.order_spec(level, units, price,
+                                                   takeProfitOnFill={"price": str(take_profit)},
+                                                   stopLossOnFill={"price": str(stop_loss)})
+        return desired
 
     def set_pip_location(self):
         """Retrieve the pip location for the instrument."""
@@ -153,22 +192,6 @@ class OandaGrid:
             logging.error(f"Could not retrieve pip location for {self.instrument}. Setting default value.")
             self.pip_location = -4  # Default pip location for most pairs, change as needed
 
-    def create_order(self, units, price, take_profit, stop_loss):
-        data = {
-            "order": {
-                "instrument": self.instrument,
-                "units": str(units),
-                "type": "LIMIT",
-                "price": str(price),
-                "takeProfitOnFill": {"price": str(take_profit)},
-                "stopLossOnFill": {"price": str(stop_loss)},
-                "positionFill": "DEFAULT"
-            }
-        }
-        r = orders.OrderCreate(self.account_id, data=data)
-        logging.info(f"Placing order: {data}")
-        self.api.request(r)
-
     def reset_grid(self):
         # Close all positions to reset the grid
         self.close_all_positions()
@@ -176,8 +199,8 @@ class OandaGrid:
         self.pip_location = None
         self.cancel_all_orders()
         self.close_all_positions()
-        self.timer = datetime.utcnow()  # Reset the timer
         self.instrument = None  # Reset the instrument
+        self.checkpoint()
         logging.info(f"Reset grid.")
 
     def close_all_positions(self):
@@ -189,42 +212,43 @@ class OandaGrid:
         r = positions.OpenPositions(self.account_id)
         return self.api.request(r)['positions']
     def cancel_all_orders(self):
-        r = orders.OrdersPending(self.account_id)
-        open_orders = self.api.request(r)['orders']
-        for order in open_orders:
-            r = orders.OrderCancel(self.account_id, order['id'])
-            self.api.request(r)
+        # Grid-tagged orders only, anything else on the account is left alone
+        GridReconciler(self.api, self.account_id, self.instrument).reconcile({})
 
 
-    def run_strategy(self):
+    def schedule_jobs(self, scheduler):
+        """Run the strategy on every chop bar close and reset grids that are a week old."""
+        scheduler.add_job('oanda_grid_strategy', self.run_strategy, BarCloseTrigger(self.chop_granularity))
+        scheduler.add_job('oanda_grid_reset', self.reset_expired_grid, BarCloseTrigger('D', delay_seconds=30),
+                          misfire_grace=3600)
 
-        if datetime.utcnow() >= self.timer + timedelta(hours=24):
-            self.set_instrument_by_chop()
-            self.timer = datetime.utcnow()
-            data = fetch_historical_data(count=self.chop_count, instrument=self.instrument,
-                                         granularity=self.chop_granularity,
-                                         access_token=self.access_token)  # Fetch historical data for the given instrument
-            chop_series = self.compute_chop(data)
+    def reset_expired_grid(self):
+        if self.is_running_grid and datetime.utcnow() > self.grid_setup_time + timedelta(days=7):
+            self.reset_grid()
 
-            is_ranging = True
+    def run_strategy(self):
+        self.set_instrument_by_chop()
+        data = fetch_historical_data(count=self.chop_count, instrument=self.instrument,
+                                     granularity=self.chop_granularity,
+                                     access_token=self.access_token)  # Fetch historical data for the given instrument
+        chop_series = self.compute_chop(data)
 
-            if chop_series[-1] > 50 and chop_series[-2] <= 50:
-                is_ranging = False
+        is_ranging = True
 
-            if not self.is_running_grid and is_ranging:
-                self.is_running_grid = True
-                self.grid_setup_time = datetime.utcnow()
+        if chop_series[-1] > 50 and chop_series[-2] <= 50:
+            is_ranging = False
 
-                data = fetch_historical_data(count=1, instrument=self.instrument, granularity='D',
-                                             access_token=self.access_token)  # Fetch historical data for the given instrument
-                current_price = float(data[0]['mid']['c'])
+        if not self.is_running_grid and is_ranging:
+            self.is_running_grid = True
+            self.grid_setup_time = datetime.utcnow()
 
-                # Setup buy and sell grids
-                self.place_grid_orders(current_price, is_buy=True)
-                self.place_grid_orders(current_price, is_buy=False)
+            data = fetch_historical_data(count=1, instrument=self.instrument, granularity='D',
+                                         access_token=self.access_token, include_forming=True)
+            current_price = float(data['close'].iloc[-1])  # Close of the forming daily bar
 
-            if datetime.utcnow() > self.grid_setup_time + timedelta(days=7):
-                self.reset_grid()
+            self.checkpoint()
+            # Setup buy and sell grids
+            self.place_grid_orders(current_price)
 
     def get_account_instruments(self):#account_id, access_token):
         client = API(access_token=self.access_token)
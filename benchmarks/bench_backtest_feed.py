@@ -0,0 +1,80 @@
+"""
+Peak RSS of a backtest against history length: run_backtest over a query_bars_range batch (the whole
+history as a DataFrame in memory) against run_store_backtest paging the bars table through store_feed.
+
+Every run is a fresh subprocess, so its peak RSS is that of the run alone. The bars (M1, bid/ask)
+are stored once in a temporary working directory; each run backtests the first count of them.
+
+    python -m benchmarks.bench_backtest_feed [count ...]
+"""
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import backtrader as bt
+
+from benchmarks.synthetic import make_v20_candles
+
+
+class AtrStrategy(bt.Strategy):
+    """Just an ATR, so the run measures the feed and cerebro rather than order handling."""
+
+    def __init__(self):
+        self.atr = bt.indicators.AverageTrueRange(period=14)
+
+
+def peak_rss_mb():
+    # VmHWM is this process' own peak; ru_maxrss also counts the parent's peak inherited through fork
+    try:
+        with open('/proc/self/status') as status:
+            return next(int(line.split()[1]) for line in status if line.startswith('VmHWM')) / 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # ru_maxrss is in KiB on Linux
+
+
+def child(mode, end):
+    import src.database_functions as db
+    from src.backtrade_grid import run_backtest, run_store_backtest
+    logging.disable(logging.INFO)
+    start = time.perf_counter()
+    if mode == 'dataframe':
+        run_backtest(db.query_bars_range('EUR_USD', 'M1', end=end, bid_ask=True), strategy=AtrStrategy)
+    else:
+        run_store_backtest('EUR_USD', 'M1', end=end, strategy=AtrStrategy)
+    elapsed = time.perf_counter() - start
+    print(elapsed, peak_rss_mb())
+
+
+def main(*counts):
+    counts = counts or (50_000, 200_000, 800_000)
+    workdir = tempfile.mkdtemp(prefix='bench_backtest_feed_')
+    os.makedirs(os.path.join(workdir, 'data'))
+    os.chdir(workdir)
+    import src.database_functions as db
+    logging.disable(logging.INFO)
+    candles = make_v20_candles(max(counts) + 1, components='mid,bid,ask')
+    for offset in range(0, len(candles), 100_000):
+        db.save_historical_data(candles[offset:offset + 100_000], 'EUR_USD', 'M1')
+    del candles
+    times = db.query_bars_range('EUR_USD', 'M1').time
+    print(f"{'feed':<12} {'bars':>10} {'peak RSS':>12} {'bars/s':>12}")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                       os.environ.get('PYTHONPATH', '')]))
+    for count in counts:
+        for mode in ('dataframe', 'store'):
+            command = [sys.executable, '-m', 'benchmarks.bench_backtest_feed', '--child', mode, str(times[count - 1] + 1)]
+            output = subprocess.run(command, capture_output=True, text=True, env=env, check=True).stdout
+            elapsed, peak_mb = (float(value) for value in output.split()[-2:])
+            print(f"{mode:<12} {count:>10,} {peak_mb:>9.0f} MB {count / elapsed:>12,.0f}")
+    print(f"\nDatabase left in {workdir}")
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        child(sys.argv[2], int(sys.argv[3]))
+    else:
+        main(*(int(arg) for arg in sys.argv[1:]))
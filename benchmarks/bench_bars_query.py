@@ -0,0 +1,117 @@
+"""
+Last-N and range scans on the bars table: the old ISO TEXT time schema and its string queries
+against the epoch-ns WITHOUT ROWID schema and query_last_bars / query_bars_range.
+
+Both databases are built in a temporary directory (1.4GB and 0.7GB for 10M rows), which also
+becomes the working directory so the query API finds its data/oanda_data.db there.
+
+    python -m benchmarks.bench_bars_query [rows] [instruments]
+"""
+from datetime import datetime, timedelta
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from src.database_functions import BARS_TABLE_QUERY, query_bars_range, query_last_bars
+from src.records import datetime_to_epoch_ns
+
+LEGACY_BARS_TABLE_QUERY = '''
+    CREATE TABLE bars (
+        instrument_name TEXT NOT NULL,
+        granularity_name TEXT NOT NULL,
+        time TEXT NOT NULL,
+        open REAL, high REAL, low REAL, close REAL, volume INTEGER, complete BOOLEAN,
+        PRIMARY KEY (instrument_name, granularity_name, time)
+    )
+'''
+START = datetime(2010, 1, 4)
+
+
+def make_rows(instrument, count, iso):
+    times = datetime_to_epoch_ns(START) + np.arange(count, dtype=np.int64) * 60_000_000_000
+    close = 1.1 + np.cumsum(np.random.default_rng(len(instrument)).normal(0, 0.0005, count))
+    times = np.char.add(np.datetime_as_string(times.astype('datetime64[ns]'), unit='ns'), 'Z').tolist() \
+        if iso else times.tolist()
+    close = close.tolist()
+    return ((instrument, 'M1', t, c, c + 0.0002, c - 0.0002, c, 100, 1) for t, c in zip(times, close))
+
+
+def build(path, table_query, instruments, per_instrument, iso):
+    connection = sqlite3.connect(path)
+    connection.execute(table_query)
+    for instrument in instruments:
+        connection.executemany('INSERT INTO bars (instrument_name, granularity_name, time, open, high, low, close, '
+                               'volume, complete) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               make_rows(instrument, per_instrument, iso))
+        connection.commit()
+    connection.close()
+
+
+def timed(func, repeat):
+    func()  # Warm the page cache
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def legacy_last_n(path, instrument, count):
+    # What fetch_historical_data did: latest time, string start date, DESC scan, sorted DataFrame
+    import pandas as pd
+    with sqlite3.connect(path) as connection:
+        latest = connection.execute('SELECT time FROM bars WHERE instrument_name = ? AND granularity_name = ? '
+                                    'ORDER BY time DESC LIMIT 1', (instrument, 'M1')).fetchone()[0]
+        start = datetime.strptime(latest.split('.')[0], '%Y-%m-%dT%H:%M:%S') - timedelta(minutes=count)
+        rows = connection.execute('SELECT time, open, high, low, close, volume, complete FROM bars '
+                                  'WHERE instrument_name = ? AND granularity_name = ? AND time >= ? '
+                                  'ORDER BY time DESC', (instrument, 'M1', start.isoformat())).fetchall()
+    return pd.DataFrame(rows, columns=['time', 'open', 'high', 'low', 'close', 'volume', 'complete']) \
+        .sort_values(by='time').reset_index(drop=True)
+
+
+def legacy_range(path, instrument, start, end):
+    import pandas as pd
+    with sqlite3.connect(path) as connection:
+        rows = connection.execute('SELECT time, open, high, low, close, volume, complete FROM bars '
+                                  'WHERE instrument_name = ? AND granularity_name = ? AND time >= ? AND time < ? '
+                                  'ORDER BY time', (instrument, 'M1', start.isoformat(), end.isoformat())).fetchall()
+    return pd.DataFrame(rows, columns=['time', 'open', 'high', 'low', 'close', 'volume', 'complete'])
+
+
+def main(rows=10_000_000, instrument_count=20):
+    instruments = [f"I{i:02d}_USD" for i in range(instrument_count)]
+    per_instrument = rows // instrument_count
+    workdir = tempfile.mkdtemp(prefix='bench_bars_')
+    os.makedirs(os.path.join(workdir, 'data'))
+    os.chdir(workdir)
+    legacy_path, new_path = 'data/legacy.db', 'data/oanda_data.db'
+
+    for label, path, query, iso in (('text time', legacy_path, LEGACY_BARS_TABLE_QUERY, True),
+                                    ('epoch ns', new_path, BARS_TABLE_QUERY, False)):
+        start = time.perf_counter()
+        build(path, query, instruments, per_instrument, iso)
+        print(f"built {label:<10} {rows:,} rows in {time.perf_counter() - start:6.1f}s, "
+              f"{os.path.getsize(path) / 2 ** 20:,.0f}MB")
+
+    instrument = instruments[instrument_count // 2]
+    range_start = START + timedelta(minutes=per_instrument // 2)
+    print(f"\n{'query':<24} {'text time':>12} {'epoch ns':>12} {'speedup':>9}")
+    for name, count in (('last 500', 500), ('last 5000', 5000), ('last 50000', 50000)):
+        legacy = timed(lambda: legacy_last_n(legacy_path, instrument, count), 20)
+        new = timed(lambda: query_last_bars(instrument, 'M1', count), 20)
+        print(f"{name:<24} {legacy * 1e3:>10.2f}ms {new * 1e3:>10.2f}ms {legacy / new:>8.1f}x")
+    for name, minutes in (('range 1 day', 1440), ('range 1 month', 43200), ('range 6 months', 259200)):
+        range_end = range_start + timedelta(minutes=minutes)
+        legacy = timed(lambda: legacy_range(legacy_path, instrument, range_start, range_end), 5)
+        new = timed(lambda: query_bars_range(instrument, 'M1', datetime_to_epoch_ns(range_start),
+                                             datetime_to_epoch_ns(range_end)), 5)
+        print(f"{name:<24} {legacy * 1e3:>10.2f}ms {new * 1e3:>10.2f}ms {legacy / new:>8.1f}x")
+    print(f"\nDatabases left in {workdir}")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
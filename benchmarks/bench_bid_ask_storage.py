@@ -0,0 +1,90 @@
+"""
+Storage cost of bid/ask bars: mid-only rows against mid rows with the bid/ask OHLC as integer offsets
+(the bars table layout), and against a plain layout with 8 more REAL columns for comparison.
+
+Database size per bar, save_historical_data and range query rates, and CandleBatch memory per bar.
+The databases are built in a temporary working directory.
+
+    python -m benchmarks.bench_bid_ask_storage [bars]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic import make_v20_candles
+from src.records import BID_ASK_COLUMNS, CandleBatch
+import src.database_functions as db
+
+REAL_BARS_TABLE_QUERY = f'''
+    CREATE TABLE bars (
+        instrument_name TEXT NOT NULL, granularity_name TEXT NOT NULL, time INTEGER NOT NULL,
+        open REAL, high REAL, low REAL, close REAL, volume INTEGER, complete BOOLEAN,
+        {', '.join(f'{column} REAL' for column in BID_ASK_COLUMNS)},
+        PRIMARY KEY (instrument_name, granularity_name, time)
+    ) WITHOUT ROWID
+'''
+
+
+def make_batch(count, components):
+    candles = make_v20_candles(count + 1, components=components)
+    return CandleBatch.from_v20(candles, price='bam' if 'bid' in components else 'mid')[:count]
+
+
+def save_to(path, batch, chunk=5000):
+    db.bar_cache.clear()
+    db._bars_schema_checked = False
+    if os.path.exists(path):
+        os.remove(path)
+    start = time.perf_counter()
+    for offset in range(0, len(batch), chunk):
+        db.save_historical_data(batch[offset:offset + chunk], 'EUR_USD', 'M1')
+    return time.perf_counter() - start
+
+
+def save_real_columns(path, batch):
+    connection = sqlite3.connect(path)
+    connection.execute(REAL_BARS_TABLE_QUERY)
+    columns = [batch.time.tolist(), batch.open.tolist(), batch.high.tolist(), batch.low.tolist(),
+               batch.close.tolist(), batch.volume.tolist(), batch.complete.tolist()]
+    columns += [batch[column].tolist() for column in BID_ASK_COLUMNS]
+    connection.executemany(f"INSERT INTO bars VALUES ('EUR_USD', 'M1', {', '.join('?' * len(columns))})",
+                           zip(*columns))
+    connection.commit()
+    connection.close()
+
+
+def main(count=1_000_000):
+    workdir = tempfile.mkdtemp(prefix='bench_bid_ask_')
+    os.makedirs(os.path.join(workdir, 'data'))
+    os.chdir(workdir)
+    import logging
+    logging.disable(logging.INFO)
+
+    mid_batch = make_batch(count, 'mid')
+    bam_batch = make_batch(count, 'mid,bid,ask')
+    print(f"{'layout':<26} {'DB bytes/bar':>13} {'save':>14} {'range query':>14} {'memory/bar':>11}")
+    sizes = {}
+    for label, batch, bid_ask in (('mid only', mid_batch, False), ('bid/ask offsets', bam_batch, True)):
+        # Both go through the bars table as data/oanda_data.db, one after the other
+        path = 'data/oanda_data.db'
+        elapsed = save_to(path, batch)
+        sizes[label] = os.path.getsize(path)
+        start = time.perf_counter()
+        result = db.query_bars_range('EUR_USD', 'M1', bid_ask=bid_ask)
+        query = time.perf_counter() - start
+        print(f"{label:<26} {sizes[label] / count:>13.1f} {count / elapsed:>9,.0f} b/s {len(result) / query:>9,.0f} b/s "
+              f"{result.nbytes() / count:>10.1f}B")
+        os.replace(path, f"data/{label.replace(' ', '_').replace('/', '_')}.db")
+
+    save_real_columns('data/real_columns.db', bam_batch)
+    sizes['bid/ask REAL columns'] = os.path.getsize('data/real_columns.db')
+    print(f"{'bid/ask REAL columns':<26} {sizes['bid/ask REAL columns'] / count:>13.1f}")
+    for label in ('bid/ask offsets', 'bid/ask REAL columns'):
+        print(f"{label} overhead over mid only: {sizes[label] / sizes['mid only'] - 1:+.0%}")
+    print(f"\nDatabases left in {workdir}")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,64 @@
+"""
+Decode rate of InstrumentsCandles responses and pricing stream lines, stdlib json vs the fast backend.
+
+    python -m benchmarks.bench_decode [--candles recorded_candles.json] [--stream recorded_stream.jsonl]
+
+Without recordings, synthetic payloads with the same shape are used.
+"""
+import argparse
+import json
+import time
+
+from benchmarks.synthetic import make_v20_candles, make_price_messages
+from src.records import CandleBatch, Quote
+from src import v20_decode
+
+
+def rate(func, payloads, count):
+    start = time.perf_counter()
+    for payload in payloads:
+        func(payload)
+    return count / (time.perf_counter() - start)
+
+
+def stdlib_candles(payload):
+    # The previous path: oandapyV20 json.loads then a per-candle walk
+    return CandleBatch.from_v20(json.loads(payload.decode('utf-8'))['candles'])
+
+
+def stdlib_stream_line(line):
+    msg = json.loads(line.decode('utf-8'))
+    return Quote.from_v20(msg) if msg.get('type') == 'PRICE' else msg
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--candles', help='recorded InstrumentsCandles response body')
+    parser.add_argument('--stream', help='recorded pricing stream, one message per line')
+    parser.add_argument('--responses', type=int, default=20, help='synthetic candle responses of 5000 candles')
+    parser.add_argument('--lines', type=int, default=200_000, help='synthetic stream lines')
+    args = parser.parse_args()
+
+    if args.candles:
+        with open(args.candles, 'rb') as f:
+            candle_payloads = [f.read()]
+    else:
+        candle_payloads = [json.dumps({"instrument": "EUR_USD", "granularity": "M1",
+                                       "candles": make_v20_candles(5000, seed=seed)}).encode()
+                           for seed in range(args.responses)]
+    if args.stream:
+        with open(args.stream, 'rb') as f:
+            stream_lines = [line for line in f.read().splitlines() if line]
+    else:
+        stream_lines = [json.dumps(msg).encode() for msg in make_price_messages(args.lines)]
+
+    candle_count = sum(len(json.loads(payload)['candles']) for payload in candle_payloads)
+    print(f"backend: {v20_decode.JSON_BACKEND}")
+    print(f"candles  stdlib json: {rate(stdlib_candles, candle_payloads, candle_count):>12,.0f} candles/s")
+    print(f"candles  {v20_decode.JSON_BACKEND:<11}: {rate(v20_decode.decode_candles, candle_payloads, candle_count):>12,.0f} candles/s")
+    print(f"stream   stdlib json: {rate(stdlib_stream_line, stream_lines, len(stream_lines)):>12,.0f} lines/s")
+    print(f"stream   {v20_decode.JSON_BACKEND:<11}: {rate(v20_decode.decode_stream_line, stream_lines, len(stream_lines)):>12,.0f} lines/s")
+
+
+if __name__ == '__main__':
+    main()
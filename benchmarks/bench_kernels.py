@@ -0,0 +1,145 @@
+"""
+Parity and speed of the array kernels (src/kernels.py) per backend.
+
+Parity: atr, chop and bbands of every backend, including the uncompiled loops numba would compile,
+against pandas_ta (or, when it is not installed, the same pandas expressions pandas_ta evaluates), and
+the grid leg events of every backend against the uncompiled loops. Speed: median time per call of each backend, and of pandas_ta when installed.
+
+    python -m benchmarks.bench_kernels [bars]
+
+Exits with status 1 on a parity mismatch; tests/test_kernels.py asserts the same parity on every run.
+"""
+import importlib.util
+import logging
+import statistics
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import make_v20_candles
+from src.records import CandleBatch
+import src.kernels as kernels
+
+TOLERANCE = {'atr': 1e-12, 'chop': 1e-12, 'bbands': 1e-6}  # pandas' rolling variance drifts by ~1e-9
+
+
+# -----------------pandas_ta reference-----------------#
+
+def reference_atr(high, low, close, length):
+    high_low = high - low
+    if high_low.eq(0).any():
+        high_low = high_low + np.finfo(float).eps
+    previous = close.shift(1)
+    true_range = pd.concat([high_low, high - previous, previous - low], axis=1).abs().max(axis=1)
+    true_range.iloc[:1] = np.nan
+    return true_range.ewm(alpha=1 / length, min_periods=length).mean()
+
+
+def reference_indicators(data):
+    high, low, close = (pd.Series(data[column]) for column in ('high', 'low', 'close'))
+    if importlib.util.find_spec('pandas_ta'):
+        import pandas_ta as ta
+        return {'atr': ta.atr(high, low, close, length=14).to_numpy(),
+                'chop': ta.chop(high, low, close, length=14).to_numpy(),
+                'bbands': ta.bbands(close, length=20, std=2).to_numpy()}, 'pandas_ta'
+    price_range = high.rolling(14).max() - low.rolling(14).min()
+    chop = 100 * (np.log10(reference_atr(high, low, close, 1).rolling(14).sum()) - np.log10(price_range)) / np.log10(14)
+    mid = close.rolling(20).mean()
+    deviation = close.rolling(20).var(0).apply(np.sqrt)
+    lower, upper = mid - 2 * deviation, mid + 2 * deviation
+    bbands = np.column_stack((lower, mid, upper, 100 * (upper - lower) / mid, (close - lower) / (upper - lower)))
+    return {'atr': reference_atr(high, low, close, 14).to_numpy(), 'chop': chop.to_numpy(), 'bbands': bbands}, 'pandas'
+
+
+def indicators(data):
+    return {'atr': kernels.atr(data.high, data.low, data.close, 14),
+            'chop': kernels.chop(data.high, data.low, data.close, 14),
+            'bbands': kernels.bbands(data.close, 20, 2)}
+
+
+def relative_error(values, expected):
+    if not (np.isnan(values) == np.isnan(expected)).all():
+        return np.inf
+    # Relative to the magnitude of each output column, as %B crosses zero
+    scale = np.nanmax(np.abs(expected), axis=0)
+    return float(np.nanmax(np.abs(values - expected) / scale))
+
+
+# -----------------Grid paths-----------------#
+
+def paths(count=2_000, steps=168, seed=1):
+    rng = np.random.default_rng(seed)
+    close = 1.1 * np.exp(np.cumsum(rng.normal(0, 0.001, (count, steps)), axis=1))
+    spread = np.abs(rng.normal(0, 0.0005, (count, steps)))
+    return close + spread, close - spread
+
+
+def leg_cases(high, low):
+    atr = 0.003
+    for direction in (1, -1):
+        entry = 1.1 - direction * atr
+        yield entry, entry - direction * 1.5 * atr, entry + direction * 1.5 * atr, direction
+
+
+def median_time(function, repeats=20):
+    function()  # Warm-up, and the JIT compilation for numba
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main(count=5_000):
+    logging.disable(logging.INFO)
+    data = CandleBatch.from_v20(make_v20_candles(count, granularity_minutes=60))
+    expected, reference = reference_indicators(data)
+    high, low = paths()
+    expected_legs = [kernels._leg_events_loop(high, low, *case) for case in leg_cases(high, low)]
+    backends = ['numpy'] + (['numba'] if importlib.util.find_spec('numba') else [])
+
+    print(f"Parity against {reference} ({count} bars) and the Python loops (grid legs)")
+    mismatches = []
+    for backend in ['python'] + backends:
+        kernels.set_kernel_backend(backend)
+        errors = {name: relative_error(values, expected[name]) for name, values in indicators(data).items()}
+        legs_match = all(all((got == want).all() for got, want in zip(kernels.leg_events(high, low, *case), legs))
+                         for case, legs in zip(leg_cases(high, low), expected_legs))
+        status = 'ok' if legs_match and all(errors[name] <= TOLERANCE[name] for name in errors) else 'MISMATCH'
+        if status != 'ok':
+            mismatches.append(backend)
+        print(f"  {backend:<8} {'  '.join(f'{name} {error:.1e}' for name, error in errors.items())}  "
+              f"legs {'equal' if legs_match else 'differ'}  {status}")
+
+    print(f"\n{'kernel':<12} " + ' '.join(f"{backend:>12}" for backend in backends + [reference]))
+    timings = {}
+    for backend in backends:
+        kernels.set_kernel_backend(backend)
+        timings[backend] = {
+            'atr': median_time(lambda: kernels.atr(data.high, data.low, data.close, 14)),
+            'chop': median_time(lambda: kernels.chop(data.high, data.low, data.close, 14)),
+            'bbands': median_time(lambda: kernels.bbands(data.close, 20, 2)),
+            'leg_events': median_time(lambda: [kernels.leg_events(high, low, *case) for case in leg_cases(high, low)]),
+        }
+    series = {column: pd.Series(data[column]) for column in ('high', 'low', 'close')}
+    if reference == 'pandas_ta':
+        import pandas_ta as ta
+        timings[reference] = {
+            'atr': median_time(lambda: ta.atr(series['high'], series['low'], series['close'], length=14)),
+            'chop': median_time(lambda: ta.chop(series['high'], series['low'], series['close'], length=14)),
+            'bbands': median_time(lambda: ta.bbands(series['close'], length=20, std=2)),
+        }
+    else:
+        timings[reference] = {'atr': median_time(lambda: reference_atr(series['high'], series['low'],
+                                                                       series['close'], 14))}
+    for name in ('atr', 'chop', 'bbands', 'leg_events'):
+        cells = [timings[backend].get(name) for backend in backends + [reference]]
+        print(f"{name:<12} " + ' '.join(f"{cell * 1000:>10.3f}ms" if cell else f"{'-':>12}" for cell in cells))
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*(int(arg) for arg in sys.argv[1:])))
@@ -0,0 +1,56 @@
+"""
+Memory per million records and parse rate of the candle/tick record types.
+
+    python -m benchmarks.bench_records [count]
+"""
+import sys
+import time
+import tracemalloc
+
+from benchmarks.synthetic import make_v20_candles, make_price_messages
+from src.records import Candle, CandleBatch, Tick, Quote
+from src.database_functions import extract_bar_data
+
+
+def measure(build, source):
+    # Timed without tracemalloc, which slows allocation-heavy code down several times
+    start = time.perf_counter()
+    build(source)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    result = build(source)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, size
+
+
+def report(name, count, elapsed, size):
+    print(f"{name:<28} {count / elapsed:>14,.0f} rec/s {size / count * 1_000_000 / 2 ** 20:>12,.1f} MiB per 1M")
+
+
+def main(count=200_000):
+    candles = make_v20_candles(count)
+    messages = [msg for msg in make_price_messages(count) if msg['type'] == 'PRICE']
+
+    print(f"{'candles':<28} {'parse rate':>20} {'memory':>21}")
+    _, _, raw_size = measure(lambda data: make_v20_candles(count), None)
+    print(f"{'v20 dicts (raw JSON)':<28} {'-':>20} {raw_size / count * 1_000_000 / 2 ** 20:>12,.1f} MiB per 1M")
+    for name, build in (
+            ('extract_bar_data (DataFrame)', extract_bar_data),
+            ('list[Candle]', lambda data: [Candle.from_v20(entry) for entry in data]),
+            ('CandleBatch', CandleBatch.from_v20),
+    ):
+        _, elapsed, size = measure(build, candles)
+        report(name, count, elapsed, size)
+
+    print(f"\n{'ticks':<28}")
+    for name, build in (
+            ('list[Tick]', lambda data: [Tick.from_v20(msg) for msg in data]),
+            ('list[Quote]', lambda data: [Quote.from_v20(msg) for msg in data]),
+    ):
+        _, elapsed, size = measure(build, messages)
+        report(name, len(messages), elapsed, size)
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,78 @@
+"""
+Writer-to-reader latency of the shared-memory market data bus.
+
+A writer process publishes quotes stamped with time.monotonic_ns() (system-wide on Linux), a reader
+process spins on the seqlock and records how long each new quote took to become visible. Readers
+only see the latest quote, so on a machine with fewer than two cores most quotes are overwritten
+before the reader is scheduled and the latency is dominated by the OS scheduler.
+
+    python -m benchmarks.bench_shm_bus [quotes] [interval_us]
+"""
+import multiprocessing
+import sys
+import time
+
+import numpy as np
+
+from src.shm_bus import MarketDataBus
+
+
+def reader(name, quotes, results):
+    bus = MarketDataBus.attach(name, untrack=False)  # Forked from the writer, shares its resource tracker
+    latencies = np.empty(quotes, dtype=np.int64)
+    last_seen, received = 0, 0
+    deadline = time.monotonic() + 30
+    while received < quotes and time.monotonic() < deadline:
+        quote = bus.read_quote('EUR_USD')
+        if quote is None or quote[0] == last_seen:
+            continue
+        if quote[1] < 0:
+            break  # Writer done
+        latencies[received] = time.monotonic_ns() - quote[0]
+        last_seen = quote[0]
+        received += 1
+    results.put(latencies[:received])
+    bus.close()
+
+
+def main(quotes=20000, interval_us=50):
+    bus = MarketDataBus.create(['EUR_USD', 'GBP_USD'], bar_capacity=1024)
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=reader, args=(bus.name, quotes, results))
+    process.start()
+    time.sleep(0.5)
+
+    interval_ns = interval_us * 1000
+    publish_start = time.perf_counter()
+    for i in range(quotes):
+        next_publish = time.monotonic_ns() + interval_ns
+        bus.publish_quote('EUR_USD', time.monotonic_ns(), 1.1 + i * 1e-6, 1.1001 + i * 1e-6)
+        while time.monotonic_ns() < next_publish:
+            pass
+    publish_rate = quotes / (time.perf_counter() - publish_start)
+    bus.publish_quote('EUR_USD', time.monotonic_ns(), -1.0, -1.0)
+
+    latencies = results.get(timeout=60)
+    process.join()
+    bus.close()
+    if len(latencies):
+        print(f"published {quotes} quotes ({publish_rate:,.0f}/s paced), reader saw {len(latencies)}")
+        print(f"latency p50 {np.percentile(latencies, 50) / 1000:.1f}us, p99 {np.percentile(latencies, 99) / 1000:.1f}us,"
+              f" max {latencies.max() / 1000:.1f}us")
+
+    # Raw publish cost without pacing
+    bus = MarketDataBus.create(['EUR_USD'], bar_capacity=1024)
+    start = time.perf_counter()
+    for i in range(100000):
+        bus.publish_quote('EUR_USD', i, 1.1, 1.1001)
+    quote_ns = (time.perf_counter() - start) / 100000 * 1e9
+    start = time.perf_counter()
+    for i in range(100000):
+        bus.publish_bar('EUR_USD', i, 1.1, 1.2, 1.0, 1.1, 10)
+    bar_ns = (time.perf_counter() - start) / 100000 * 1e9
+    print(f"publish_quote {quote_ns:.0f}ns, publish_bar {bar_ns:.0f}ns")
+    bus.close()
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,499 @@
+"""
+Benchmark suite over the hot paths, with JSON results and regression checks between commits.
+
+Every case builds its own synthetic data in a temporary working directory (so the bars database is
+data/oanda_data.db there) and times one operation; the median of the repeats is reported. Cases
+whose dependencies are missing (pandas_ta, backtrader) are recorded as errors and skipped.
+
+    python -m benchmarks.run_suite --output before.json
+    python -m benchmarks.run_suite --baseline before.json --output after.json   # exit 1 on regressions
+    python -m benchmarks.run_suite --only parse,stream
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic import make_v20_candles, make_price_messages
+
+DEFAULT_THRESHOLD = 0.25  # Fractional slowdown of the median that counts as a regression
+
+CASES = {}
+
+
+def case(name, repeats=5, threshold=DEFAULT_THRESHOLD, ops=1):
+    """Register a case: the decorated function does the setup and returns the operation to time."""
+    def register(setup):
+        CASES[name] = SimpleNamespace(name=name, setup=setup, repeats=repeats, threshold=threshold, ops=ops)
+        return setup
+    return register
+
+
+EUR_USD_SPECS = {"displayPrecision": 5, "tradeUnitsPrecision": 0, "minimumTradeSize": "1",
+                 "maximumOrderUnits": "100000000", "minimumTrailingStopDistance": "0.00050",
+                 "maximumTrailingStopDistance": "1.00000"}
+
+
+def recent_candles(count, granularity_minutes=60):
+    # Ends with a forming bar that has not closed yet, so reads are served locally without API refreshes
+    now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    return make_v20_candles(count, granularity_minutes, start=now - timedelta(minutes=granularity_minutes * (count - 1)))
+
+
+def fresh_database():
+    import src.database_functions as db
+    if os.path.exists('data/oanda_data.db'):
+        os.remove('data/oanda_data.db')
+    db._bars_schema_checked = False
+    db.bar_cache.clear()
+    return db
+
+
+# -----------------Cases-----------------#
+
+@case('parse.extract_bar_data', ops=10_000)
+def parse_extract_bar_data():
+    from src.database_functions import extract_bar_data
+    candles = make_v20_candles(10_000)
+    return lambda: extract_bar_data(candles)
+
+
+@case('parse.candle_batch', ops=10_000)
+def parse_candle_batch():
+    from src.records import CandleBatch
+    candles = make_v20_candles(10_000)
+    return lambda: CandleBatch.from_v20(candles)
+
+
+@case('ingest.save_historical_data', ops=10_000)
+def ingest_save_historical_data():
+    from src.records import CandleBatch
+    db = fresh_database()
+    batch = CandleBatch.from_v20(recent_candles(10_000))
+
+    def run():
+        fresh_database()
+        db.save_historical_data(batch, 'EUR_USD', 'H1')
+    return run
+
+
+@case('ingest.save_unchanged', ops=10_000)
+def ingest_save_unchanged():
+    # Re-saving bars that are already stored, which the upsert skips
+    from src.records import CandleBatch
+    db = fresh_database()
+    batch = CandleBatch.from_v20(recent_candles(10_000))
+    db.save_historical_data(batch, 'EUR_USD', 'H1')
+    return lambda: db.save_historical_data(batch, 'EUR_USD', 'H1')
+
+
+@case('read.fetch_historical_data_cached', repeats=200)
+def read_cached():
+    db = fresh_database()
+    db.save_historical_data(recent_candles(5_000), 'EUR_USD', 'H1')
+    db.fetch_historical_data('EUR_USD', 'H1', 30, None)
+    return lambda: db.fetch_historical_data('EUR_USD', 'H1', 30, None)
+
+
+@case('read.fetch_historical_data_cold', repeats=50)
+def read_cold():
+    db = fresh_database()
+    db.save_historical_data(recent_candles(5_000), 'EUR_USD', 'H1')
+
+    def run():
+        db.bar_cache.clear()
+        db.fetch_historical_data('EUR_USD', 'H1', 30, None)
+    return run
+
+
+@case('read.query_last_bars_5000', repeats=20, ops=5_000)
+def read_last_bars():
+    db = fresh_database()
+    db.save_historical_data(recent_candles(20_000), 'EUR_USD', 'H1')
+    return lambda: db.query_last_bars('EUR_USD', 'H1', 5_000)
+
+
+def indicator_case(indicator, **params):
+    def setup():
+        import pandas_ta as ta
+        from src.records import CandleBatch
+        from tools.my_tools import compute_indicator
+        data = CandleBatch.from_v20(make_v20_candles(5_000)).to_dataframe()
+        func = getattr(ta, indicator)
+        return lambda: compute_indicator(data=data, indicator_func=func, **params)
+    return setup
+
+
+case('indicator.chop', ops=5_000)(indicator_case('chop', length=14))
+case('indicator.bbands', ops=5_000)(indicator_case('bbands', length=20, std=2))
+case('indicator.atr', ops=5_000)(indicator_case('atr', length=14))
+
+
+def kernel_case(indicator, **params):
+    # The same indicators through src/kernels.py, on whichever backend is installed
+    def setup():
+        from src.kernels import compute_kernel_indicator
+        from src.records import CandleBatch
+        data = CandleBatch.from_v20(make_v20_candles(5_000))
+        compute_kernel_indicator(indicator, data, **params)  # Numba compiles on the first call
+        return lambda: compute_kernel_indicator(indicator, data, **params)
+    return setup
+
+
+case('kernel.chop', ops=5_000)(kernel_case('chop', length=14))
+case('kernel.bbands', ops=5_000)(kernel_case('bbands', length=20, std=2))
+case('kernel.atr', ops=5_000)(kernel_case('atr', length=14))
+
+
+def scan_bot():
+    import pandas_ta  # noqa: F401, the scan computes chop and bbands
+    from src.indicator_store import IndicatorStore
+    from src.main_bot import MainBot
+    from src.screener import InstrumentScreener
+    from src.correlation import CorrelationEngine
+    from src.state_store import StateStore
+    db = fresh_database()
+    instruments = [f"I{i:02d}_USD" for i in range(20)]
+    db.set_instruments_table([dict(EUR_USD_SPECS, name=instrument, type='CURRENCY', displayName=instrument,
+                                   pipLocation=-4, maximumPositionSize='0', marginRate='0.0333',
+                                   guaranteedStopLossOrderMode='DISABLED') for instrument in instruments])
+    candles = recent_candles(500)
+    for instrument in instruments:
+        db.save_historical_data(candles, instrument, 'H1')
+    # A MainBot without the account round trips of __init__
+    main_bot = MainBot.__new__(MainBot)
+    main_bot.market_data = None
+    main_bot.access_token = None
+    main_bot.indicator_store = IndicatorStore()
+    main_bot.fetch_settings = {"granularity": 'H1', "count": 30}
+    main_bot.chop_settings = {"length": 14, "atr_length": 1}
+    main_bot.bb_settings = {"length": 20, "std_dev": 2}
+    main_bot.chop_filters = {"high": 61.8, "low": 38.2}
+    main_bot.bb_filters = {"high": 0.8, "low": 0.2}
+
+    main_bot.correlation = CorrelationEngine('H1', 500)
+    main_bot.state_store = StateStore('data/state.json')
+
+    def reset():
+        main_bot.screener = InstrumentScreener(main_bot.chop_filters, main_bot.bb_filters)
+        main_bot.viable_instruments_for_grid = main_bot.screener.grid
+        main_bot.viable_instruments_for_trending = main_bot.screener.trending
+    reset()
+    return main_bot, reset
+
+
+@case('scan.evaluate_instruments', repeats=3)
+def scan_evaluate_instruments():
+    main_bot, reset = scan_bot()
+
+    def run():
+        reset()  # A fresh screener, so every instrument is evaluated
+        main_bot.evaluate_instruments()
+    return run
+
+
+@case('scan.evaluate_instruments_unchanged', repeats=20)
+def scan_unchanged():
+    # A rescan without new bars, which the screener skips per instrument
+    main_bot, _ = scan_bot()
+    main_bot.evaluate_instruments()
+    return main_bot.evaluate_instruments
+
+
+def correlation_returns(instruments=70, bars=1_500, seed=1):
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    common = rng.normal(0, 0.001, (bars, 1))
+    return common + rng.normal(0, 0.001, (bars, instruments))
+
+
+@case('correlation.push', ops=1_000)
+def correlation_push():
+    # Rank-1 updates of a 70-instrument, 500-bar window; ops are bars
+    from src.correlation import RollingCorrelation
+    returns = correlation_returns()
+    rolling = RollingCorrelation(range(returns.shape[1]), 500)
+    for row in returns[:500]:
+        rolling.push(row)
+
+    def run():
+        for row in returns[500:]:
+            rolling.push(row)
+    return run
+
+
+@case('correlation.full_recompute', ops=1_000)
+def correlation_full_recompute():
+    # What push replaces: the correlation matrix recomputed over the window on every bar
+    import numpy as np
+    returns = correlation_returns()
+
+    def run():
+        for end in range(501, 1_501):
+            np.corrcoef(returns[end - 500:end].T)
+    return run
+
+
+@case('correlation.next_pick', ops=5)
+def correlation_next_pick():
+    # Five picks out of 70 ranked candidates
+    from src.correlation import RollingCorrelation
+    returns = correlation_returns()
+    rolling = RollingCorrelation(range(returns.shape[1]), 500)
+    for row in returns[:500]:
+        rolling.push(row)
+
+    def run():
+        candidates, picks = list(range(returns.shape[1])), []
+        for _ in range(5):
+            pick = rolling.next_pick(candidates, picks, 0.3)
+            candidates.remove(pick)
+            picks.append(pick)
+    return run
+
+
+@case('grid.place_atr_based_orders', repeats=200)
+def grid_order_construction():
+    from src.bot_utils import BotUtils
+    from src.grid_bot import GridBot
+    from src.grid_reconciler import GridReconciler
+    from src.order_validator import order_validator, InstrumentConstraints
+    from src.state_store import StateStore
+    grid_settings = {"order_limit": 5, "sl_atr_factor": 1.5, "tp_atr_factor": 1.5, "entry_atr_factor": 0.25,
+                     "order_size_percent": 3}
+    main_bot = SimpleNamespace(api=None, access_token=None, account_id='bench', grid_settings=grid_settings)
+    orders = []
+    utils = BotUtils(main_bot)
+    utils.instrument = 'EUR_USD'
+    # Build the order requests without sending them, against an empty live grid
+    api = SimpleNamespace(request=lambda request: orders.append(request) or {})
+    bot = GridBot.__new__(GridBot)
+    bot.reconciler = GridReconciler(api, 'bench', 'EUR_USD')
+    order_validator.constraints['EUR_USD'] = InstrumentConstraints(EUR_USD_SPECS)
+    bot.utils, bot.instrument, bot.grid_settings = utils, 'EUR_USD', grid_settings
+    bot.grid_simulation = {"enabled": False}
+    bot.get_current_price = lambda: 1.10512
+    bot.get_recent_atr = lambda: 0.00123
+    bot.long_available_units = bot.short_available_units = 1000
+    bot.available_funds, bot.is_grid_active, bot.grid_setup_time = 5000.0, True, None
+    bot.state_store = StateStore('data/state.json')  # Checkpointed before the orders go out
+
+    def run():
+        orders.clear()
+        bot.place_atr_based_orders()
+    return run
+
+
+def grid_states(count):
+    return {f"I{i:02d}_USD": {"is_grid_active": True, "grid_setup_time": '2024-01-05T21:00:00',
+                              "grid_levels": {"atr": 0.00123, "long_entry": 1.1039, "short_entry": 1.1063,
+                                              "sl_distance": 0.0018, "tp_distance": 0.0018},
+                              "placing": False, "available_funds": 5000.0, "long_available_units": 1000,
+                              "short_available_units": 1000} for i in range(count)}
+
+
+@case('state.checkpoint', repeats=50)
+def state_checkpoint():
+    # One grid's durable checkpoint (write, fsync, rename) next to 19 others and 70 screener results
+    from src.state_store import StateStore
+    store = StateStore('data/state.json')
+    store.set('screener', {f"I{i:02d}_USD": [1704495600, 65.0, 0.1 + i / 100] for i in range(70)})
+    store.set('grids', grid_states(20))
+    state = grid_states(1)['I00_USD']
+    return lambda: store.set_item('grids', 'I00_USD', state)
+
+
+@case('state.restore', repeats=50)
+def state_restore():
+    # What a restart does instead of a rescan: load the checkpoint and rebuild the screener
+    from src.screener import InstrumentScreener
+    from src.state_store import StateStore
+    store = StateStore('data/state.json')
+    store.set('screener', {f"I{i:02d}_USD": [1704495600, 65.0, 0.1 + i / 100] for i in range(70)})
+    store.set('grids', grid_states(20))
+
+    def run():
+        state = StateStore('data/state.json').load()
+        InstrumentScreener({"high": 61.8, "low": 38.2}, {"high": 0.8, "low": 0.2}).restore(state['screener'])
+    return run
+
+
+@case('order.validate', ops=10_000)
+def order_validate():
+    from src.order_validator import OrderValidator, InstrumentConstraints
+    validator = OrderValidator()
+    validator.constraints['EUR_USD'] = InstrumentConstraints(EUR_USD_SPECS)
+    order = {"instrument": 'EUR_USD', "units": '1000', "type": 'LIMIT', "price": '1.105123456',
+             "positionFill": 'DEFAULT', "takeProfitOnFill": {"price": '1.11'},
+             "trailingStopLossOnFill": {"distance": '0.0015'}}
+
+    def run():
+        for _ in range(10_000):
+            validator.validate(order)
+    return run
+
+
+@case('stream.handle_message', ops=20_000)
+def stream_handle_message():
+    from src.market_cache import MarketDataCache
+    from src.stream_handler import StreamHandler
+    from src.v20_decode import loads
+    lines = [json.dumps(msg).encode() for msg in make_price_messages(20_000)]
+    handler = StreamHandler.__new__(StreamHandler)  # No API or stream endpoint needed to dispatch
+    handler.subscribers = defaultdict(list)
+    cache = MarketDataCache(None, None)
+    handler.subscribe('*', cache.update_from_price)
+
+    def run():
+        for line in lines:
+            handler.handle_message(loads(line))
+    return run
+
+
+@case('stream.handle_message_traced', ops=20_000)
+def stream_handle_message_traced():
+    # stream.handle_message with a trace per message, as StreamHandler.start_stream does when tracing is on
+    from src import tracing
+    from src.market_cache import MarketDataCache
+    from src.stream_handler import StreamHandler
+    from src.v20_decode import loads
+    lines = [json.dumps(msg).encode() for msg in make_price_messages(20_000)]
+    handler = StreamHandler.__new__(StreamHandler)
+    handler.subscribers = defaultdict(list)
+    cache = MarketDataCache(None, None)
+    handler.subscribe('*', cache.update_from_price)
+
+    def run():
+        tracing.start_tracing(capacity=20_000)
+        try:
+            for line in lines:
+                tracing.begin('pricing')
+                msg = loads(line)
+                tracing.mark('decode', msg.get('instrument'))
+                handler.handle_message(msg)
+                tracing.mark('quote')
+                tracing.end()
+        finally:
+            tracing.stop_tracing(export=False)
+    return run
+
+
+@case('backtest.advanced_grid_strategy', repeats=3, ops=5_000)
+def backtest_advanced_grid():
+    from src.backtrade_grid import run_backtest
+    from src.records import CandleBatch
+    data = CandleBatch.from_v20(make_v20_candles(5_000, granularity_minutes=60))
+    return lambda: run_backtest(data)
+
+
+@case('backtest.portfolio', repeats=3, ops=20 * 5_000)
+def backtest_portfolio():
+    # 20 instruments of 5000 H1 bid/ask bars from the bars store; ops are instrument-bars
+    from src.portfolio_backtest import PortfolioBacktest
+    db = fresh_database()
+    instruments = [f"I{i:02d}_USD" for i in range(20)]
+    for seed, instrument in enumerate(instruments):
+        candles = make_v20_candles(5_000, granularity_minutes=60, seed=seed, components='mid,bid,ask')
+        db.save_historical_data(candles, instrument, 'H1')
+    settings = {"order_limit": 5, "sl_atr_factor": 1.5, "tp_atr_factor": 1.5, "entry_atr_factor": 1.0}
+    backtest = PortfolioBacktest.from_store(instruments, 'H1', grid_settings=settings, margin_rates={})
+    return backtest.run
+
+
+# -----------------Runner-----------------#
+
+def run_case(bench):
+    try:
+        operation = bench.setup()
+        operation()  # Warm-up: imports, caches, page cache
+        timings = []
+        for _ in range(bench.repeats):
+            start = time.perf_counter()
+            operation()
+            timings.append(time.perf_counter() - start)
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+    median = statistics.median(timings)
+    return {
+        "median_s": median,
+        "min_s": min(timings),
+        "repeats": bench.repeats,
+        "ops": bench.ops,
+        "ops_per_s": bench.ops / median if median else None,
+        "threshold": bench.threshold,
+    }
+
+
+def compare(results, baseline):
+    """Cases whose median got slower than the baseline by more than their threshold."""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get('results', {}).get(name, {})
+        if 'median_s' not in result or 'median_s' not in before:
+            continue
+        ratio = result['median_s'] / before['median_s']
+        result['baseline_ratio'] = ratio
+        if ratio > 1 + result['threshold']:
+            regressions.append((name, ratio))
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--output', help='write the JSON results to this file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to check for regressions')
+    parser.add_argument('--only', help='comma separated case name prefixes')
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    names = [name for name in CASES if not args.only or name.startswith(tuple(args.only.split(',')))]
+    report = {"commit": git_commit(), "time": datetime.utcnow().isoformat(), "python": sys.version.split()[0],
+              "machine": platform.machine(), "cpus": os.cpu_count(), "results": {}}
+
+    workdir = tempfile.mkdtemp(prefix='bench_suite_')
+    os.makedirs(os.path.join(workdir, 'data'))
+    os.chdir(workdir)
+    import logging
+    logging.disable(logging.INFO)  # Per-call info logs would dominate the timings
+
+    for name in names:
+        result = report['results'][name] = run_case(CASES[name])
+        if 'error' in result:
+            print(f"{name:<38} error: {result['error']}")
+        else:
+            print(f"{name:<38} {result['median_s'] * 1e3:>10.3f}ms {result['ops_per_s']:>14,.0f} ops/s")
+
+    regressions = compare(report['results'], baseline) if baseline else []
+    for name, ratio in regressions:
+        print(f"REGRESSION {name}: {ratio:.2f}x the baseline median")
+
+    if output:
+        with open(output, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f"Results written to {output}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
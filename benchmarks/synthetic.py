@@ -0,0 +1,47 @@
+import random
+from datetime import datetime, timedelta
+
+
+def make_v20_candles(count, granularity_minutes=1, start=datetime(2023, 1, 2), price=1.1, seed=1, components='mid'):
+    """Candles shaped like an InstrumentsCandles response, following a random walk."""
+    rng = random.Random(seed)
+    candles = []
+    for i in range(count):
+        open_price = price
+        close_price = open_price + rng.gauss(0, 0.0005)
+        high_price = max(open_price, close_price) + abs(rng.gauss(0, 0.0002))
+        low_price = min(open_price, close_price) - abs(rng.gauss(0, 0.0002))
+        time = start + timedelta(minutes=i * granularity_minutes)
+        candle = {"complete": True, "volume": rng.randint(1, 500),
+                  "time": time.strftime('%Y-%m-%dT%H:%M:%S.000000000Z')}
+        for component, offset in (('mid', 0.0), ('bid', -0.00005), ('ask', 0.00005)):
+            if component in components:
+                candle[component] = {"o": f"{open_price + offset:.5f}", "h": f"{high_price + offset:.5f}",
+                                     "l": f"{low_price + offset:.5f}", "c": f"{close_price + offset:.5f}"}
+        candles.append(candle)
+        price = close_price
+    candles[-1]["complete"] = False
+    return candles
+
+
+def make_price_messages(count, instruments=("EUR_USD", "GBP_USD", "USD_JPY"), start=datetime(2023, 1, 2), seed=1):
+    """PRICE messages shaped like the pricing stream, with a heartbeat every 50 messages."""
+    rng = random.Random(seed)
+    prices = {instrument: 1.1 if 'JPY' not in instrument else 140.0 for instrument in instruments}
+    messages = []
+    for i in range(count):
+        time = (start + timedelta(milliseconds=250 * i)).strftime('%Y-%m-%dT%H:%M:%S.%f000Z')
+        if i % 50 == 49:
+            messages.append({"type": "HEARTBEAT", "time": time})
+            continue
+        instrument = instruments[i % len(instruments)]
+        prices[instrument] *= 1 + rng.gauss(0, 0.00005)
+        mid = prices[instrument]
+        bid, ask = f"{mid - 0.00005:.5f}", f"{mid + 0.00005:.5f}"
+        messages.append({
+            "type": "PRICE", "instrument": instrument, "time": time, "tradeable": True,
+            "bids": [{"price": bid, "liquidity": 10000000}], "asks": [{"price": ask, "liquidity": 10000000}],
+            "closeoutBid": bid, "closeoutAsk": ask,
+            "quoteHomeConversionFactors": {"positiveUnits": "1.00000000", "negativeUnits": "1.00000000"},
+        })
+    return messages
@@ -1,12 +1,17 @@
+import time
+import_start = time.perf_counter()
+
 from src.main_bot import MainBot
 import logging
 
+import json
 import os
 from dotenv import load_dotenv
 
-from tools.my_tools import get_historical_data
-
-import time
+from src.scheduler import Scheduler, OnceTrigger
+from src.supervisor import Supervisor
+from src.profiler import stop_profiling
+from src.tracing import stop_tracing
 
 
 
@@ -22,20 +27,40 @@ logging.basicConfig(
 
 
 if __name__ == '__main__':
+    logging.info(f"Imports took {(time.perf_counter() - import_start) * 1000:.1f}ms")
     load_dotenv()
     access_token = os.getenv('DEMO_ACCESS_TOKEN')
 
     environment = 'practice'
 
-    main_bot = MainBot(access_token, environment)
-
-    while True:
-        try:
-            main_bot.get_backtesting_data()
-        except Exception as e:
-            logging.error(f"Error: {e} traceback: {e.__traceback__}")
-            raise e
-        break
+    # Several sub-accounts: one worker process per account sharing a single market-data service
+    accounts_config = os.getenv('ACCOUNTS_CONFIG')
+    if accounts_config:
+        with open(accounts_config) as f:
+            Supervisor(access_token, environment, json.load(f)).run()
+        raise SystemExit(0)
+
+    # PROFILE=1 samples the bot's threads, profiles go to data/profiles on SIGUSR1, 'dump' in data/profile.cmd or exit
+    profile = os.getenv('PROFILE', '').lower() in ('1', 'true', 'yes')
+    # TRACE=1 records tick-to-order latencies, exported to data/traces on SIGUSR2, 'dump' in data/trace.cmd or exit
+    trace = os.getenv('TRACE', '').lower() in ('1', 'true', 'yes')
+    main_bot = MainBot(access_token, environment, fast_start=True, profile=profile, trace=trace)
+
+    scheduler = Scheduler(max_workers=4)
+    scheduler.add_job('backtesting_data', main_bot.get_backtesting_data, OnceTrigger())
+    scheduler.add_job('restore_state', main_bot.restore_state, OnceTrigger())
+    main_bot.schedule_jobs(scheduler)
+    scheduler.start()
+
+    try:
+        scheduler.join()
+    except KeyboardInterrupt:
+        logging.info("Shutting down")
+    finally:
+        scheduler.stop()
+        logging.info(f"Scheduler stats: {scheduler.get_stats()}")
+        stop_profiling()
+        stop_tracing()
 
 
 
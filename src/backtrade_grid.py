@@ -1,8 +1,13 @@
-from src.database_functions import get_instrument_value, fetch_historical_data
+from src.database_functions import get_instrument_value, fetch_historical_data, iter_bars_range
+from src.kernels import grid_entries
+from src.records import CandleBatch, BID_ASK_COLUMNS
 
 import backtrader as bt
+from datetime import datetime
 import logging
 
+from src.profiler import get_profiler, span, start_profiling, stop_profiling
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s : %(message)s')
 
 class AdvancedGridStrategy(bt.Strategy):
@@ -14,11 +19,13 @@ class AdvancedGridStrategy(bt.Strategy):
         ('funds_percentage', 0.1),  # Percentage of funds to use for each grid level
         ('grid_levels', 5),  # Number of levels in the grid
         ('rebalance_freq', 10),  # Frequency of rebalance in terms of bars
+        ('resize_tolerance', 0.05),  # Relative size change below which a level's order is kept on rebalance
     )
 
     def __init__(self):
         self.atr = bt.indicators.AverageTrueRange(period=14)
         self.order_dict = {}  # To keep track of orders at each grid level
+        self._targets, self._targets_bar = None, None
         self.grid_setup()
 
     def grid_setup(self):
@@ -61,29 +68,30 @@ class AdvancedGridStrategy(bt.Strategy):
                 # Place new orders if there are no pending orders for the grid level
                 self.place_grid_orders(level)
 
-    def place_grid_orders(self, level):
-        current_price = self.data.close[0]
-        atr_value = self.atr[0]
-
-        # Calculate the funds available for this trade
-        account_value = self.broker.getvalue()
-        funds_for_trade = account_value * self.params.funds_percentage
-
-        # Adjust for the number of grid levels
-        funds_for_trade /= self.params.grid_levels
-
-        # Calculate the entry price for this grid level
-        entry_price = current_price + (atr_value * self.params.entry_atr_factor * (level - self.params.grid_levels / 2))
-        entry_price = round(entry_price, self.params.pip_location)
+    def level_target(self, level):
+        """Entry price, size and side the order of a grid level should have at the current bar."""
+        entries, sizes, is_buy = self.grid_targets()
+        return float(entries[level]), float(sizes[level]), bool(is_buy[level])
 
-        # Calculate position size based on the funds allocated for this trade
-        position_size = self.calculate_position_size(funds_for_trade, entry_price)
+    def grid_targets(self):
+        # The targets of all levels at once, computed on the first call of each bar (the account value and
+        # the ATR don't change while next() places and rebalances orders)
+        if self._targets_bar != len(self):
+            # Calculate the funds available for each trade, adjusted for the number of grid levels
+            funds_for_trade = self.broker.getvalue() * self.params.funds_percentage / self.params.grid_levels
+            entries, is_buy = grid_entries(self.data.close[0], self.atr[0], self.params.grid_levels,
+                                           self.params.entry_atr_factor, self.params.pip_location)
+            # Calculate position size based on the funds allocated for this trade
+            self._targets = entries, self.calculate_position_size(funds_for_trade, entries), is_buy
+            self._targets_bar = len(self)
+        return self._targets
 
-        # Determine the direction based on the level relative to the current price
-        if level < self.params.grid_levels / 2:
-            self.grid_levels[level]['order'] = self.sell(size=position_size, price=entry_price, exectype=bt.Order.Limit)
-        else:
+    def place_grid_orders(self, level):
+        entry_price, position_size, is_buy = self.level_target(level)
+        if is_buy:
             self.grid_levels[level]['order'] = self.buy(size=position_size, price=entry_price, exectype=bt.Order.Limit)
+        else:
+            self.grid_levels[level]['order'] = self.sell(size=position_size, price=entry_price, exectype=bt.Order.Limit)
 
         self.log(f'Grid Level {level}: Order placed at {entry_price} for size {position_size}')
 
@@ -95,11 +103,176 @@ class AdvancedGridStrategy(bt.Strategy):
     def rebalance_grid(self):
         # Rebalance the grid based on new market conditions
         self.log('Rebalancing grid')
-        # Cancel all existing orders
+        # Only levels whose order moved are cancelled and placed again, like GridReconciler does live
         for level, info in self.grid_levels.items():
-            if info['order']:
-                self.cancel(info['order'])
-                info['order'] = None
+            order = info['order']
+            if not order:
+                continue
+            entry_price, position_size, is_buy = self.level_target(level)
+            if (order.isbuy() == is_buy and order.created.price == entry_price
+                    and abs(abs(order.created.size) - position_size) <= self.params.resize_tolerance * position_size):
+                continue
+            self.cancel(order)
+            self.place_grid_orders(level)
 
-        # Recalculate grid levels based on current price and ATR
-        self.grid_setup()
+
+class BidAskPandasData(bt.feeds.PandasData):
+    """PandasData with the bid and ask OHLC of CandleBatch.to_dataframe as extra lines."""
+    lines = BID_ASK_COLUMNS
+    params = tuple((column, -1) for column in BID_ASK_COLUMNS)
+
+
+class SpreadBroker(bt.brokers.BackBroker):
+    """
+    BackBroker that fills buys against the ask and sells against the bid: a buy limit fills once the
+    ask low reaches it, a sell limit once the bid high does, market orders at the ask/bid open.
+    """
+
+    def _try_exec(self, order):
+        data = order.data
+        side = 'ask' if order.isbuy() else 'bid'
+        if not hasattr(data.lines, f'{side}_open'):
+            return super()._try_exec(order)
+        # The base class reads the bar through the tick_* prices, swap in the side's OHLC for this order.
+        # Like the base class, fall back to the lines when the ticks were reset (the last bar of a feed)
+        fields = ('open', 'high', 'low', 'close')
+        saved = [getattr(data, f'tick_{field}', None) for field in fields]
+        for field in fields:
+            price = getattr(data, f'tick_{side}_{field}', None)
+            setattr(data, f'tick_{field}', getattr(data.lines, f'{side}_{field}')[0] if price is None else price)
+        try:
+            super()._try_exec(order)
+        finally:
+            for field, value in zip(fields, saved):
+                setattr(data, f'tick_{field}', value)
+
+
+# backtrader's float dates are days since 0001-01-01, plus one
+_EPOCH_NUM = bt.date2num(datetime(1970, 1, 1))
+_NS_PER_DAY = 86_400 * 1_000_000_000
+
+
+def granularity_timeframe(granularity):
+    """OANDA granularity ('S5', 'M1', 'H4', 'D', 'W', 'M') as a backtrader (timeframe, compression)."""
+    if len(granularity) == 1:
+        return {'D': bt.TimeFrame.Days, 'W': bt.TimeFrame.Weeks, 'M': bt.TimeFrame.Months}[granularity], 1
+    unit, count = granularity[0], int(granularity[1:])
+    return {'S': (bt.TimeFrame.Seconds, count), 'M': (bt.TimeFrame.Minutes, count),
+            'H': (bt.TimeFrame.Minutes, 60 * count)}[unit]
+
+
+class BarStoreData(bt.feed.DataBase):
+    """
+    Feed that pages bars out of the bars table with iter_bars_range while cerebro consumes them, so
+    only one chunk of the history is in memory. Use it through store_feed.
+    """
+    params = (
+        ('instrument', None),
+        ('granularity', 'M1'),
+        ('start', None),  # epoch ns, inclusive
+        ('end', None),  # epoch ns, exclusive
+        ('chunk_size', 10_000),
+    )
+    bid_ask = False
+
+    def start(self):
+        super().start()
+        self._chunks = iter_bars_range(self.p.instrument, self.p.granularity, self.p.start, self.p.end,
+                                       bid_ask=self.bid_ask, chunk_size=self.p.chunk_size)
+        self._rows = iter(())
+
+    def stop(self):
+        super().stop()
+        self._chunks.close()
+
+    def chunk_rows(self, chunk):
+        times = (chunk.time / _NS_PER_DAY + _EPOCH_NUM).tolist()
+        return zip(times, chunk.open.tolist(), chunk.high.tolist(), chunk.low.tolist(), chunk.close.tolist(),
+                   chunk.volume.tolist())
+
+    def _load(self):
+        row = next(self._rows, None)
+        if row is None:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return False
+            self._rows = self.chunk_rows(chunk)
+            row = next(self._rows)
+        self.fill_lines(row)
+        return True
+
+    def fill_lines(self, row):
+        lines = self.lines
+        lines.datetime[0], lines.open[0], lines.high[0], lines.low[0], lines.close[0], lines.volume[0] = row
+        lines.openinterest[0] = 0
+
+
+class BidAskBarStoreData(BarStoreData):
+    """BarStoreData with the bid and ask OHLC lines of BidAskPandasData, for the SpreadBroker."""
+    lines = BID_ASK_COLUMNS
+    bid_ask = True
+
+    def chunk_rows(self, chunk):
+        return zip(super().chunk_rows(chunk), *(chunk[column].tolist() for column in BID_ASK_COLUMNS))
+
+    def fill_lines(self, row):
+        super().fill_lines(row[0])
+        for column, value in zip(BID_ASK_COLUMNS, row[1:]):
+            getattr(self.lines, column)[0] = value
+
+
+def store_feed(instrument, granularity='M1', start=None, end=None, bid_ask=False, chunk_size=10_000):
+    timeframe, compression = granularity_timeframe(granularity)
+    feed = BidAskBarStoreData if bid_ask else BarStoreData
+    return feed(instrument=instrument, granularity=granularity, start=start, end=end, chunk_size=chunk_size,
+                timeframe=timeframe, compression=compression)
+
+
+def run_store_backtest(instrument, granularity='M1', start=None, end=None, cash=10000, strategy=AdvancedGridStrategy,
+                       bid_ask=True, chunk_size=10_000, profile=False, **strategy_params):
+    """
+    run_backtest straight from the bars table (start/end in epoch ns), with memory flat in the length of
+    the history: bars are paged in by store_feed and cerebro keeps only the bars its lines need
+    (exactbars=1). Bars stored mid-only have a zero spread when bid_ask is set.
+    """
+    cerebro = bt.Cerebro(exactbars=1, stdstats=False)
+    if bid_ask:
+        cerebro.broker = SpreadBroker()
+    cerebro.adddata(store_feed(instrument, granularity, start, end, bid_ask, chunk_size))
+    final_value = _run_cerebro(cerebro, cash, strategy, profile, strategy_params)
+    logging.info(f"Backtest of {instrument} {granularity} from the bars store finished, final value: {final_value}")
+    return final_value
+
+
+def _run_cerebro(cerebro, cash, strategy, profile, strategy_params):
+    cerebro.addstrategy(strategy, **strategy_params)
+    cerebro.broker.setcash(cash)
+    own_profiler = profile and get_profiler() is None
+    if own_profiler:
+        start_profiling()
+    try:
+        with span('backtest'):
+            cerebro.run()
+    finally:
+        if own_profiler:
+            stop_profiling()
+    return cerebro.broker.getvalue()
+
+
+def run_backtest(data, cash=10000, strategy=AdvancedGridStrategy, profile=False, **strategy_params):
+    """
+    Run a strategy over a CandleBatch or a fetch_historical_data DataFrame and return the final value.
+    Bars with bid/ask (query_bars_range(..., bid_ask=True)) are filled at the side an order trades on,
+    mid-only bars at mid. With profile=True the run is sampled and the profile written to data/profiles.
+    """
+    if not isinstance(data, CandleBatch):
+        data = CandleBatch.from_dataframe(data)
+    cerebro = bt.Cerebro()
+    if data.has_bid_ask:
+        cerebro.broker = SpreadBroker()
+        cerebro.adddata(BidAskPandasData(dataname=data.to_dataframe(datetime_index=True)))
+    else:
+        cerebro.adddata(bt.feeds.PandasData(dataname=data.to_dataframe(datetime_index=True)))
+    final_value = _run_cerebro(cerebro, cash, strategy, profile, strategy_params)
+    logging.info(f"Backtest finished over {len(data)} bars, final value: {final_value}")
+    return final_value
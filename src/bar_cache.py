@@ -0,0 +1,149 @@
+"""
+In-process cache of the latest bars per (instrument, granularity).
+
+Every series is one set of growing NumPy columns holding a suffix of the bars table. Windows of
+the last N bars are served as read-only slices of it, and save_historical_data writes new and
+corrected bars through, so a cached series never needs re-reading. Least recently used series are
+evicted once the cache holds more than max_bytes.
+"""
+from collections import OrderedDict
+import logging
+import threading
+
+import numpy as np
+
+from src.records import CandleBatch
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s : %(message)s')
+
+
+class BarSeries:
+    def __init__(self, batch):
+        self._reset(batch)
+
+    def _reset(self, batch):
+        self.length = 0
+        self.columns = {column: np.empty(max(len(batch), 64), dtype=batch[column].dtype)
+                        for column in CandleBatch.columns}
+        self.append(batch)
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values())
+
+    @property
+    def first_time(self):
+        return int(self.columns['time'][0])
+
+    @property
+    def last_time(self):
+        return int(self.columns['time'][self.length - 1])
+
+    def append(self, batch):
+        # Rows past length are never part of a served window, so appending leaves earlier views untouched
+        needed = self.length + len(batch)
+        if needed > len(self.columns['time']):
+            capacity = max(needed, 2 * len(self.columns['time']))
+            for column, values in self.columns.items():
+                grown = np.empty(capacity, dtype=values.dtype)
+                grown[:self.length] = values[:self.length]
+                self.columns[column] = grown
+        for column, values in self.columns.items():
+            values[self.length:needed] = batch[column]
+        self.length = needed
+
+    def merge(self, batch):
+        """Insert or replace bars inside the cached range. Rebuilds the columns, served views keep the old ones."""
+        merged = CandleBatch(*(np.concatenate((self.columns[column][:self.length], batch[column]))
+                               for column in CandleBatch.columns))
+        # The last occurrence of a time wins: stable sort, then keep the final row of every run of equal times
+        merged = merged[merged.time.argsort(kind='stable')]
+        keep = np.append(merged.time[1:] != merged.time[:-1], True)
+        self._reset(merged[keep])
+
+    def window(self, count):
+        start = max(0, self.length - count)
+        views = []
+        for column in CandleBatch.columns:
+            view = self.columns[column][start:self.length]
+            view.flags.writeable = False
+            views.append(view)
+        return CandleBatch(*views)
+
+
+class BarWindowCache:
+    def __init__(self, max_bytes=64 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.series = OrderedDict()  # (instrument, granularity) -> BarSeries, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, instrument, granularity, count):
+        """The last count bars as a read-only CandleBatch, or None when fewer are cached."""
+        key = (instrument, granularity)
+        with self._lock:
+            series = self.series.get(key)
+            if series is None or series.length < count:
+                self.misses += 1
+                return None
+            self.series.move_to_end(key)
+            self.hits += 1
+            return series.window(count)
+
+    def last_time(self, instrument, granularity):
+        series = self.series.get((instrument, granularity))
+        return series.last_time if series else None
+
+    def load(self, instrument, granularity, batch):
+        """Cache bars just read from the bars table, replacing the cached series if it is shorter."""
+        if not len(batch):
+            return
+        key = (instrument, granularity)
+        with self._lock:
+            series = self.series.get(key)
+            if series is None or len(batch) > series.length:
+                self.series[key] = BarSeries(batch)
+            elif batch.time[-1] > series.last_time:
+                series.merge(batch[batch.time >= series.first_time])
+            self.series.move_to_end(key)
+            self._evict()
+
+    def write(self, instrument, granularity, batch):
+        """Write-through of saved complete bars (sorted by time) into a cached series."""
+        key = (instrument, granularity)
+        with self._lock:
+            series = self.series.get(key)
+            if series is None or not len(batch):
+                return
+            # Bars older than the cached suffix are not needed to keep it contiguous with the table
+            batch = batch[batch.time >= series.first_time]
+            if not len(batch):
+                return
+            if batch.time[0] > series.last_time:
+                series.append(batch)
+            else:
+                series.merge(batch)
+            self._evict()
+
+    def _evict(self):
+        total = sum(series.nbytes for series in self.series.values())
+        while total > self.max_bytes and len(self.series) > 1:
+            key, series = self.series.popitem(last=False)
+            total -= series.nbytes
+            self.evictions += 1
+            logging.info(f"Bar cache evicted {key[0]} {key[1]} ({series.nbytes / 2 ** 20:.1f}MB)")
+
+    def clear(self):
+        with self._lock:
+            self.series.clear()
+
+    def get_stats(self):
+        return {
+            "series": len(self.series),
+            "bytes": sum(series.nbytes for series in self.series.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -1,12 +1,20 @@
 from oandapyV20.endpoints import pricing, orders, positions, instruments
 
-from tools.my_tools import compute_indicator
+from tools.my_tools import compute_indicator, LazyModule
 
-from src.database_functions import fetch_historical_data, get_instrument_value
+from src.database_functions import fetch_historical_batch, get_instrument_value
+
+from src.indicator_store import IndicatorSpec
+
+from src.order_validator import order_validator
+
+from src.profiler import spanned
+
+from src import tracing
 
 import logging
 
-import pandas_ta as ta
+ta = LazyModule('pandas_ta')
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s : %(message)s')
 
@@ -34,11 +42,21 @@ class BotUtils:
         self.account_id = main_bot.account_id
         self.instrument = None  # Ensure this is set per instance
         self.grid_settings = main_bot.grid_settings
+        # Shared quote/spec cache, when the bot is run by a GridOrchestrator
+        self.market_cache = getattr(main_bot, 'market_cache', None)
+        # Shared market-data service, when the bot runs in a Supervisor account worker
+        self.market_data = getattr(main_bot, 'market_data', None)
+        self.indicator_store = getattr(main_bot, 'indicator_store', None)
+        self.risk_engine = getattr(main_bot, 'risk_engine', None)
         # Initialize these as instance attributes to avoid sharing between instances
         self.pip_location = None
         self.available_units = None
 
     def get_conversion_factors(self):
+        if self.market_cache is not None:
+            conversion_factor_pos, conversion_factor_neg = self.market_cache.get_conversion_factors(self.instrument)
+            logging.info(f"Conversion factors for {self.instrument}: {conversion_factor_pos, conversion_factor_neg}")
+            return conversion_factor_pos, conversion_factor_neg
         response = self.api.request(
             pricing.PricingInfo(accountID=self.account_id, params={"instruments": self.instrument}))
         factors = response['prices'][0]['quoteHomeConversionFactors']
@@ -48,13 +66,18 @@ class BotUtils:
 
 
     def get_current_price(self):
+        if self.market_cache is not None:
+            return self.market_cache.get_mid(self.instrument)
         response = self.api.request(
             instruments.InstrumentsCandles(instrument=self.instrument, params={"count": 1, "granularity": "S5"}))
         logging.info(f"Current price for {self.instrument}: {response['candles'][0]['mid']['c']}")
         return float(response['candles'][0]['mid']['c'])
 
     def get_pip_location(self):
-        self.pip_location = get_instrument_value(self.instrument, 'pipLocation')
+        if self.market_cache is not None:
+            self.pip_location = self.market_cache.get_instrument_value(self.instrument, 'pipLocation')
+        else:
+            self.pip_location = get_instrument_value(self.instrument, 'pipLocation')
         logging.info(f"Pip location for {self.instrument}: {self.pip_location}")
         return self.pip_location
 
@@ -77,22 +100,21 @@ class BotUtils:
         self.execute_order(order_data)
 
     def get_trailing_stop_loss(self, distance):
-        self.minimum_trailing_stop = get_instrument_value(self.instrument, 'trailingStop')
-        self.maximum_trailing_stop = get_instrument_value(self.instrument, 'maximumTrailingStop')
-
-        if distance < self.minimum_trailing_stop:
-            raise ValueError(f"Trailing stop loss distance too low: {distance}")
-            #distance = self.minimum_trailing_stop
-        elif distance > self.maximum_trailing_stop:
-            raise ValueError(f"Trailing stop loss distance too High: {distance}")
-            #distance = self.maximum_trailing_stop
-        else:
-            logging.info(f"Trailing stop loss distance fine: {distance}")
-            distance = distance
+        # Bounds are minimumTrailingStopDistance/maximumTrailingStopDistance of the cached instrument specs
+        distance = order_validator.check_trailing_distance(self.instrument, distance)
+        logging.info(f"Trailing stop loss distance fine: {distance}")
+        return {"trailingStopLossOnFill": {"distance": distance}}
 
-        return {"trailingStopLossOnFill": {"distance": str(distance)}}
     def get_recent_atr(self):
-        data = fetch_historical_data(self.instrument, 'H1', 15, self.access_token)
+        if self.market_data is not None:
+            atr = self.market_data.compute_indicator(self.instrument, 'H1', 15, 'atr', length=14)[-1]
+            logging.info(f"Recent ATR for {self.instrument}: {atr}")
+            return atr
+        if self.indicator_store is not None:
+            atr = self.indicator_store.get_series(self.instrument, 'H1', IndicatorSpec('atr', length=14), 15)[-1]
+            logging.info(f"Recent ATR for {self.instrument}: {atr}")
+            return atr
+        data = fetch_historical_batch(self.instrument, 'H1', 15, self.access_token)
         # Compute the most recent ATR value based on the fetched data
         atr = compute_indicator(
             data=data,
@@ -113,25 +135,30 @@ class BotUtils:
         return self.adjust_price_to_pip_location(adjusted_take_profit), self.adjust_price_to_pip_location(
             sl_distance)
 
+    @spanned('order')
     def execute_order(self, order_data):
+        try:
+            # Rounded to the instrument's precisions, or rejected here instead of by a round trip
+            order_data = order_validator.validate(order_data)
+        except ValueError as e:
+            logging.error(f"Order rejected locally: {e}")
+            raise
+        if self.risk_engine is not None:
+            # In-memory pre-trade check against account-wide margin and exposure
+            reason = self.risk_engine.check_order(order_data['instrument'], float(order_data['units']),
+                                                  float(order_data['price']) if 'price' in order_data else None)
+            if reason:
+                logging.error(f"Order rejected by pre-trade check: {reason}")
+                raise ValueError(f"Pre-trade check failed: {reason}")
+        tracing.mark('pretrade')
         try:
             response = self.api.request(orders.OrderCreate(self.account_id, data={"order": order_data}))
+            tracing.mark('order')
             logging.info(f"Order created: {response}")
+            if self.risk_engine is not None:
+                self.risk_engine.on_order_response(order_data, response)
         except Exception as e:
-            if "insufficient" in str(e):
-                logging.error(f"Insufficient funds to create order: {e}")
-            elif "minimum" in str(e):
-                logging.error(f"Minimum order size not met: {e}")
-            elif "units" in str(e):
-                logging.error(f"Invalid units: {e}")
-            elif "price" in str(e):
-                logging.error(f"Invalid price: {e}")
-            elif "takeProfit" in str(e):
-                logging.error(f"Invalid take profit: {e}")
-            elif "trailingStopLoss" in str(e):
-                logging.error(f"Invalid trailing stop loss: {e}")
-            elif "instrument" in str(e):
-                logging.error(f"Invalid instrument: {e}")
+            # Precision, size and trailing stop problems are caught by the validator, what is left is account state
             logging.error(f"Failed to create order: {e}")
             raise e
 
@@ -0,0 +1,154 @@
+"""
+Rolling correlation of bar returns across the instrument universe.
+
+RollingCorrelation keeps the last window log returns of every instrument in a ring buffer together with
+their sums and cross-products, so a new bar is two rank-1 updates of the cross-product matrix (the new
+returns in, the returns leaving the window out), O(n^2) instead of recomputing the window. The
+products are rebuilt from the buffer once per window to keep rounding from accumulating.
+CorrelationEngine feeds it from the bars store, aligning the instruments on their bar times.
+"""
+import logging
+
+import numpy as np
+
+from src.database_functions import query_bars_range, query_last_bars
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s : %(message)s')
+
+
+class RollingCorrelation:
+    def __init__(self, instruments, window=500):
+        self.instruments = list(instruments)
+        self.index = {instrument: i for i, instrument in enumerate(self.instruments)}
+        self.window = window
+        self.returns = np.zeros((window, len(self.instruments)))
+        self.position = 0  # Next row of the ring buffer
+        self.count = 0
+        self.sums = np.zeros(len(self.instruments))
+        self.products = np.zeros((len(self.instruments), len(self.instruments)))
+        self.pushes_since_rebuild = 0
+
+    def push(self, returns):
+        """Add one bar of returns (one per instrument, 0 for an instrument without a bar)."""
+        returns = np.asarray(returns, dtype=np.float64)
+        if self.count == self.window:
+            leaving = self.returns[self.position]
+            self.sums -= leaving
+            self.products -= np.multiply.outer(leaving, leaving)
+        else:
+            self.count += 1
+        self.sums += returns
+        self.products += np.multiply.outer(returns, returns)
+        self.returns[self.position] = returns
+        self.position = (self.position + 1) % self.window
+        self.pushes_since_rebuild += 1
+        if self.pushes_since_rebuild >= self.window:
+            self.rebuild()
+
+    def rebuild(self):
+        rows = self.returns if self.count == self.window else self.returns[:self.count]
+        self.sums = rows.sum(axis=0)
+        self.products = rows.T @ rows
+        self.pushes_since_rebuild = 0
+
+    def _block(self, rows, columns):
+        # Correlations between two index lists; 0 where an instrument has no variance (yet)
+        count = max(self.count, 1)
+        mean = self.sums / count
+        variance = np.maximum(np.diag(self.products) / count - mean * mean, 0.0)
+        covariance = self.products[np.ix_(rows, columns)] / count - np.multiply.outer(mean[rows], mean[columns])
+        scale = np.sqrt(np.multiply.outer(variance[rows], variance[columns]))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(scale > 0, np.clip(covariance / scale, -1.0, 1.0), 0.0)
+
+    def matrix(self):
+        everything = np.arange(len(self.instruments))
+        correlation = self._block(everything, everything)
+        np.fill_diagonal(correlation, 1.0)
+        return correlation
+
+    def correlation(self, first, second):
+        if first == second:
+            return 1.0
+        return float(self._block([self.index[first]], [self.index[second]])[0, 0])
+
+    def next_pick(self, candidates, chosen, max_correlation=None):
+        """
+        The first of candidates (in the caller's order, e.g. by BB %B) whose largest absolute correlation
+        to the chosen instruments is at most max_correlation, or the least correlated candidate when none
+        is (or max_correlation is None). Instruments outside the universe count as uncorrelated.
+        """
+        if not candidates:
+            return None
+        chosen = [self.index[instrument] for instrument in chosen if instrument in self.index]
+        if not chosen:
+            return candidates[0]
+        known = [i for i, instrument in enumerate(candidates) if instrument in self.index]
+        largest = np.zeros(len(candidates))
+        if known:
+            block = self._block([self.index[candidates[i]] for i in known], chosen)
+            largest[known] = np.abs(block).max(axis=1)
+        if max_correlation is not None:
+            below = np.flatnonzero(largest <= max_correlation)
+            if len(below):
+                return candidates[below[0]]
+        return candidates[int(largest.argmin())]
+
+
+class CorrelationEngine:
+    """RollingCorrelation over the complete bars of the bars store, for a changing instrument universe."""
+
+    def __init__(self, granularity='H1', window=500):
+        self.granularity = granularity
+        self.window = window
+        self.rolling = None
+        self.last_time = None  # Time of the last bar pushed
+        self.closes = None  # Last close per instrument, NaN before an instrument's first bar
+
+    def refresh(self, instruments, latest_time=None):
+        """
+        Push the bars completed since the last refresh; a changed universe is rebuilt from the store.
+        latest_time, the newest bar time of the instruments when the caller knows it, skips the store reads
+        when nothing is new.
+        """
+        if self.rolling is None or set(instruments) != set(self.rolling.instruments):
+            return self._rebuild(instruments)
+        if latest_time is not None and latest_time <= self.last_time:
+            return 0
+        batches = [query_bars_range(instrument, self.granularity, start=self.last_time + 1)
+                   for instrument in self.rolling.instruments]
+        return self._push_batches(batches)
+
+    def _rebuild(self, instruments):
+        self.rolling = RollingCorrelation(sorted(instruments), self.window)
+        self.closes = np.full(len(self.rolling.instruments), np.nan)
+        self.last_time = -2 ** 63
+        batches = [query_last_bars(instrument, self.granularity, self.window + 1)
+                   for instrument in self.rolling.instruments]
+        pushed = self._push_batches(batches)
+        logging.info(f"Correlation of {len(self.rolling.instruments)} instruments rebuilt from {pushed} bars")
+        return pushed
+
+    def _push_batches(self, batches):
+        # One push per bar time in the union of the batches, instruments without a bar at it return 0. A bar
+        # stored after a later bar of another instrument was pushed is skipped.
+        times = np.unique(np.concatenate([batch.time for batch in batches])) if batches else np.array([])
+        if not len(times):
+            return 0
+        closes = np.full((len(times), len(batches)), np.nan)
+        for i, batch in enumerate(batches):
+            closes[np.searchsorted(times, batch.time), i] = batch.close
+        for row in closes:
+            observed = ~np.isnan(row)
+            returns = np.zeros(len(row))
+            previous = observed & ~np.isnan(self.closes)
+            returns[previous] = np.log(row[previous] / self.closes[previous])
+            self.closes[observed] = row[observed]
+            self.rolling.push(returns)
+        self.last_time = int(times[-1])
+        return len(times)
+
+    def next_pick(self, candidates, chosen, max_correlation=None):
+        if self.rolling is None:
+            return candidates[0] if candidates else None
+        return self.rolling.next_pick(candidates, chosen, max_correlation)
@@ -1,13 +1,60 @@
 import sqlite3
 import logging
-from tools.my_tools import get_account_instruments, get_historical_data
-import pandas as pd
+from tools.my_tools import get_account_instruments, LazyModule
+from src.bar_cache import BarWindowCache
+from src.profiler import spanned
+from src.records import CandleBatch, epoch_ns_to_datetime, BID_ASK_COLUMNS
+from src.v20_decode import get_historical_batch
 from datetime import datetime, timedelta
 from contextlib import contextmanager
+import threading
+import time
+
+import numpy as np
+
+pd = LazyModule('pandas')  # Not needed until bars are read, keeps startup fast
 
 # Setup basic logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Bar lifecycle: the forming (complete=False) bar of each instrument/granularity is only kept in memory,
+# a bar reaches the bars table once, when the API reports it complete.
+_forming_bars = {}  # (instrument, granularity) -> Candle
+_next_refresh = {}  # (instrument, granularity) -> epoch ns from which the API may have a newly completed bar
+_lifecycle_lock = threading.Lock()
+_bars_schema_checked = False
+
+bar_cache = BarWindowCache()  # Latest bars per instrument/granularity, kept fresh by save_historical_data
+MAX_CANDLES_PER_REQUEST = 5000  # InstrumentsCandles limit
+
+# Row layout of bar queries, read straight from the cursor into one structured array
+BAR_ROW_DTYPE = np.dtype([('time', 'i8'), ('open', 'f8'), ('high', 'f8'), ('low', 'f8'), ('close', 'f8'),
+                          ('volume', 'i8'), ('complete', '?')])
+# Bid/ask OHLC as offsets from mid (see records.SPREAD_SCALE), NULL for bars stored from mid-only candles
+SPREAD_OFFSET_COLUMNS = tuple(f"{column}_offset" for column in BID_ASK_COLUMNS)
+BID_ASK_ROW_DTYPE = np.dtype(BAR_ROW_DTYPE.descr + [(column, 'i4') for column in SPREAD_OFFSET_COLUMNS])
+
+# time is epoch nanoseconds. WITHOUT ROWID clusters the rows on the primary key, so the key is a
+# covering index: range and last-N scans read consecutive pages and never go back to a rowid table.
+BARS_TABLE_QUERY = '''
+    CREATE TABLE IF NOT EXISTS bars (
+        instrument_name TEXT NOT NULL,
+        granularity_name TEXT NOT NULL,
+        time INTEGER NOT NULL,
+        open REAL,
+        high REAL,
+        low REAL,
+        close REAL,
+        volume INTEGER,
+        complete BOOLEAN,
+        bid_open_offset INTEGER, bid_high_offset INTEGER, bid_low_offset INTEGER, bid_close_offset INTEGER,
+        ask_open_offset INTEGER, ask_high_offset INTEGER, ask_low_offset INTEGER, ask_close_offset INTEGER,
+        PRIMARY KEY (instrument_name, granularity_name, time),
+        FOREIGN KEY(instrument_name) REFERENCES instruments(name),
+        FOREIGN KEY(granularity_name) REFERENCES granularities(name)
+    ) WITHOUT ROWID
+'''
+
 
 @contextmanager
 def connect_to_db(db_path='data/oanda_data.db'):
@@ -86,25 +133,56 @@ def set_instruments_table(data):
             ))
 
 
-def extract_bar_data(data):
-    # Create a DataFrame from the list of dictionaries
-    df = pd.DataFrame(data)
+def set_accounts_table(account_ids):
+    """Cache the account list so a restart does not have to wait for AccountList."""
+    with connect_to_db() as connection:
+        execute_db_query(connection, '''
+            CREATE TABLE IF NOT EXISTS accounts (
+                id TEXT PRIMARY KEY,
+                position INTEGER,
+                last_updated TIMESTAMP
+            )
+        ''')
+        for position, account_id in enumerate(account_ids):
+            execute_db_query(connection, '''
+                INSERT INTO accounts (id, position, last_updated) VALUES (?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET position = excluded.position, last_updated = excluded.last_updated
+            ''', (account_id, position, datetime.now()))
+
 
-    # Extract the 'mid' column into separate 'open', 'high', 'low', and 'close' columns
-    df[['open', 'high', 'low', 'close']] = df['mid'].apply(
-        lambda x: pd.Series([x['o'], x['h'], x['l'], x['c']]).astype(float))
+def get_cached_account_ids():
+    """Return the cached account ids in AccountList order, or an empty list if nothing is cached."""
+    with connect_to_db() as connection:
+        try:
+            result = execute_db_query(connection, "SELECT id FROM accounts ORDER BY position", fetch_all=True)
+        except sqlite3.OperationalError:
+            return []
+        return [row[0] for row in result]
 
-    # Drop the 'mid' column as it's no longer needed
-    df.drop(columns=['mid'], inplace=True)
 
-    # Reorder the columns as per your desired order
-    df = df[['time', 'open', 'high', 'low', 'close', 'volume', 'complete']]
+def has_cached_instruments():
+    with connect_to_db() as connection:
+        try:
+            result = execute_db_query(connection, "SELECT COUNT(*) FROM instruments WHERE last_updated IS NOT NULL",
+                                      fetch_one=True)
+        except sqlite3.OperationalError:
+            return False
+        return bool(result and result[0])
 
-    return df
+
+def extract_bar_data(data):
+    # Parse the v20 candles into columns once and lay them out as time, open, high, low, close, volume, complete
+    return CandleBatch.from_v20(data).to_dataframe()
 
 
 def ensure_bars_tables_exists():
+    global _bars_schema_checked
     with connect_to_db() as connection:
+        if not _bars_schema_checked:
+            migrate_bars_time_to_epoch_ns(connection)
+            migrate_bars_add_spread_offsets(connection)
+            _bars_schema_checked = True
+
         # Create the necessary tables if they don't exist
         create_tables_queries = [
             '''
@@ -118,21 +196,16 @@ def ensure_bars_tables_exists():
                 )
             ''',
             '''
-                CREATE TABLE IF NOT EXISTS bars (
+                CREATE TABLE IF NOT EXISTS indicator_values (
                     instrument_name TEXT NOT NULL,
                     granularity_name TEXT NOT NULL,
-                    time TEXT NOT NULL,
-                    open REAL,
-                    high REAL,
-                    low REAL,
-                    close REAL,
-                    volume INTEGER,
-                    complete BOOLEAN,
-                    PRIMARY KEY (instrument_name, granularity_name, time),
-                    FOREIGN KEY(instrument_name) REFERENCES instruments(name),
-                    FOREIGN KEY(granularity_name) REFERENCES granularities(name)
-                )
-            '''
+                    spec TEXT NOT NULL,
+                    time INTEGER NOT NULL,
+                    v0 REAL, v1 REAL, v2 REAL, v3 REAL, v4 REAL,
+                    PRIMARY KEY (instrument_name, granularity_name, spec, time)
+                ) WITHOUT ROWID
+            ''',
+            BARS_TABLE_QUERY
         ]
 
         for query in create_tables_queries:
@@ -141,34 +214,242 @@ def ensure_bars_tables_exists():
         # logging.info("History tables created.")
 
 
-def save_historical_data(historical_data, instrument, granularity):
+def migrate_bars_time_to_epoch_ns(connection):
+    """Rewrite a bars table with ISO TEXT times ('2024-01-02T10:00:00.000000000Z') to epoch-ns INTEGER times."""
+    columns = {row[1]: row[2] for row in execute_db_query(connection, "PRAGMA table_info(bars)", fetch_all=True)}
+    if columns.get('time', 'INTEGER') == 'INTEGER':
+        return False
+    logging.info("Migrating bars.time from ISO text to epoch nanoseconds...")
+    # One explicit transaction: sqlite3 does not open one for DDL, and a crash between the rename and
+    # the copy would otherwise leave no bars table behind
+    if connection.in_transaction:
+        connection.commit()
+    execute_db_query(connection, "BEGIN")
+    try:
+        execute_db_query(connection, "ALTER TABLE bars RENAME TO bars_iso")
+        execute_db_query(connection, BARS_TABLE_QUERY)
+        # Whole seconds through strftime, then the 9 fraction digits after the '.'
+        execute_db_query(connection, '''
+            INSERT OR REPLACE INTO bars (instrument_name, granularity_name, time, open, high, low, close, volume, complete)
+            SELECT instrument_name, granularity_name,
+                   CAST(strftime('%s', substr(time, 1, 19)) AS INTEGER) * 1000000000
+                   + CAST(substr(substr(time, 21, 9) || '000000000', 1, 9) AS INTEGER),
+                   open, high, low, close, volume, complete
+            FROM bars_iso
+        ''')
+        execute_db_query(connection, "DROP TABLE bars_iso")
+        # Materialized indicators are keyed by the old times; they are rebuilt from the bars on the next read
+        execute_db_query(connection, "DROP TABLE IF EXISTS indicator_values")
+        execute_db_query(connection, "COMMIT")
+    except Exception:
+        execute_db_query(connection, "ROLLBACK")
+        raise
+    logging.info("bars.time migration complete.")
+    return True
+
+
+def migrate_bars_add_spread_offsets(connection):
+    """Add the bid/ask offset columns to a bars table created before they existed; old rows keep NULLs."""
+    columns = {row[1] for row in execute_db_query(connection, "PRAGMA table_info(bars)", fetch_all=True)}
+    if not columns or SPREAD_OFFSET_COLUMNS[0] in columns:
+        return False
+    for column in SPREAD_OFFSET_COLUMNS:
+        execute_db_query(connection, f"ALTER TABLE bars ADD COLUMN {column} INTEGER")
+    logging.info("Added bid/ask offset columns to bars.")
+    return True
+
+
+def _bar_select(bid_ask):
+    # Bars stored from mid-only candles read back with a zero spread
+    offsets = ''.join(f", IFNULL({column}, 0)" for column in SPREAD_OFFSET_COLUMNS) if bid_ask else ''
+    return f"SELECT time, open, high, low, close, volume, complete{offsets} FROM bars"
+
+
+def _fetch_bar_batch(connection, query, parameters, bid_ask=False):
+    cursor = connection.cursor()
+    cursor.execute(query, parameters)
+    rows = np.fromiter(cursor, dtype=BID_ASK_ROW_DTYPE if bid_ask else BAR_ROW_DTYPE)
+    spread_offsets = np.column_stack([rows[column] for column in SPREAD_OFFSET_COLUMNS]) if bid_ask else None
+    return CandleBatch(*(rows[column] for column in CandleBatch.columns), spread_offsets)
+
+
+def query_bars_range(instrument, granularity, start=None, end=None, complete_only=True, bid_ask=False):
+    """
+    Bars with start <= time < end (epoch ns, either bound optional) as a CandleBatch, oldest first,
+    with the bid/ask spread offsets when bid_ask is set.
+    Bounds are passed as Python ints: sqlite3 binds NumPy integers as blobs, which never match.
+    """
+    ensure_bars_tables_exists()
+    with connect_to_db() as connection:
+        return _fetch_bar_batch(connection, f'''
+            {_bar_select(bid_ask)}
+            WHERE instrument_name = ? AND granularity_name = ? AND time >= ? AND time < ?
+            {'AND complete = 1' if complete_only else ''}
+            ORDER BY time
+        ''', (instrument, granularity, -2 ** 63 if start is None else int(start), 2 ** 63 - 1 if end is None else int(end)),
+            bid_ask)
+
+
+def iter_bars_range(instrument, granularity, start=None, end=None, complete_only=True, bid_ask=False,
+                    chunk_size=10_000):
+    """
+    query_bars_range paged into CandleBatches of at most chunk_size bars, oldest first, so a long history
+    is never held in memory at once. Each page is its own keyset query on the primary key (time after
+    the previous page), which keeps no read transaction open between pages.
+    """
+    ensure_bars_tables_exists()
+    query = f'''
+        {_bar_select(bid_ask)}
+        WHERE instrument_name = ? AND granularity_name = ? AND time >= ? AND time < ?
+        {'AND complete = 1' if complete_only else ''}
+        ORDER BY time
+        LIMIT ?
+    '''
+    start = -2 ** 63 if start is None else int(start)
+    end = 2 ** 63 - 1 if end is None else int(end)
+    with connect_to_db() as connection:
+        while True:
+            batch = _fetch_bar_batch(connection, query, (instrument, granularity, start, end, int(chunk_size)),
+                                     bid_ask)
+            if len(batch):
+                yield batch
+            if len(batch) < chunk_size:
+                return
+            start = int(batch.time[-1]) + 1
+
+
+def query_last_bars(instrument, granularity, count, complete_only=True, bid_ask=False):
+    """The last count bars as a CandleBatch, oldest first."""
+    ensure_bars_tables_exists()
+    with connect_to_db() as connection:
+        batch = _fetch_bar_batch(connection, f'''
+            {_bar_select(bid_ask)}
+            WHERE instrument_name = ? AND granularity_name = ? {'AND complete = 1' if complete_only else ''}
+            ORDER BY time DESC
+            LIMIT ?
+        ''', (instrument, granularity, int(count)), bid_ask)
+    return batch[::-1]
+
+
+def find_first_corrected_bar(connection, instrument, granularity, batch):
+    """Time of the earliest bar in the batch that changes a stored bar (OHLC or complete flag), or None."""
+    if not len(batch):
+        return None
+    times = batch.time.tolist()
+    stored = {row[0]: row[1:] for row in execute_db_query(connection, '''
+        SELECT time, open, high, low, close, complete
+        FROM bars
+        WHERE instrument_name = ? AND granularity_name = ? AND time >= ? AND time <= ?
+    ''', (instrument, granularity, min(times), max(times)), fetch_all=True)}
+    if not stored:
+        return None
+    for bar_time, open_price, high_price, low_price, close_price, is_complete in zip(
+            times, batch.open.tolist(), batch.high.tolist(), batch.low.tolist(), batch.close.tolist(),
+            batch.complete.tolist()):
+        previous = stored.get(bar_time)
+        if previous is not None and previous != (open_price, high_price, low_price, close_price, int(is_complete)):
+            return bar_time
+    return None
+
+
+def invalidate_indicator_values(connection, instrument, granularity, from_time):
+    """Drop materialized indicator values from a corrected bar onwards, they are recomputed on next read."""
+    execute_db_query(connection, '''
+        DELETE FROM indicator_values WHERE instrument_name = ? AND granularity_name = ? AND time >= ?
+    ''', (instrument, granularity, from_time))
+    logging.info(f"Indicator values for {instrument} {granularity} invalidated from {from_time}")
+
+
+# Unchanged bars are skipped by the WHERE clause instead of being rewritten on every fetch.
+# A row left incomplete by older versions is updated once, when its bar completes.
+# Mid-only candles leave the stored bid/ask offsets of a bar alone.
+INSERT_BAR_QUERY = '''
+    INSERT INTO bars (instrument_name, granularity_name, time, open, high, low, close, volume, complete)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(instrument_name, granularity_name, time) DO UPDATE SET
+    open=excluded.open, high=excluded.high, low=excluded.low, close=excluded.close, volume=excluded.volume, complete=excluded.complete
+    WHERE open IS NOT excluded.open OR high IS NOT excluded.high OR low IS NOT excluded.low
+    OR close IS NOT excluded.close OR volume IS NOT excluded.volume OR complete IS NOT excluded.complete
+'''
+INSERT_BID_ASK_BAR_QUERY = f'''
+    INSERT INTO bars (instrument_name, granularity_name, time, open, high, low, close, volume, complete,
+    {', '.join(SPREAD_OFFSET_COLUMNS)})
+    VALUES ({', '.join('?' * (9 + len(SPREAD_OFFSET_COLUMNS)))})
+    ON CONFLICT(instrument_name, granularity_name, time) DO UPDATE SET
+    open=excluded.open, high=excluded.high, low=excluded.low, close=excluded.close, volume=excluded.volume, complete=excluded.complete,
+    {', '.join(f"{column}=excluded.{column}" for column in SPREAD_OFFSET_COLUMNS)}
+    WHERE open IS NOT excluded.open OR high IS NOT excluded.high OR low IS NOT excluded.low
+    OR close IS NOT excluded.close OR volume IS NOT excluded.volume OR complete IS NOT excluded.complete
+    OR {' OR '.join(f"{column} IS NOT excluded.{column}" for column in SPREAD_OFFSET_COLUMNS)}
+'''
+
+
+def save_historical_data(historical_data, instrument, granularity, reaches_present=True):
+    """
+    Save v20 candle dicts or a CandleBatch. Complete bars go to the bars table, a stored bar is only
+    rewritten when the API corrects it; the forming bar is kept in memory (see get_forming_bar).
+    Pass reaches_present=False for a batch that ends in the past (a backfill with an end date, a full
+    page), which must not touch the forming bar state.
+    """
+    if not isinstance(historical_data, CandleBatch):
+        # v20 candles fetched with price=BAM keep their bid/ask
+        bid_ask = len(historical_data) and 'bid' in historical_data[0] and 'ask' in historical_data[0]
+        historical_data = CandleBatch.from_v20(historical_data, price='bam' if bid_ask else 'mid')
+    historical_data = historical_data[historical_data.time.argsort(kind='stable')]
+    if reaches_present:
+        track_forming_bar(instrument, granularity, historical_data)
+    historical_data = historical_data[historical_data.complete]
+    if not len(historical_data):
+        return
+
     ensure_bars_tables_exists()
     with connect_to_db() as connection:
         # Ensure the instrument and granularity exist in their respective tables
         execute_db_query(connection, 'INSERT OR IGNORE INTO instruments (name) VALUES (?)', (instrument,))
         execute_db_query(connection, 'INSERT OR IGNORE INTO granularities (name) VALUES (?)', (granularity,))
 
-        # Prepare and execute the insert or update query for each entry in the historical data
-        for entry in historical_data:
-            bar_time = entry['time']
-            is_complete = entry['complete']
-            open_price = entry['mid']['o']
-            high_price = entry['mid']['h']
-            low_price = entry['mid']['l']
-            close_price = entry['mid']['c']
-            volume = entry['volume']
-
-            insert_bar_query = '''
-                INSERT INTO bars (time, instrument_name, granularity_name, open, high, low, close, volume, complete)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ON CONFLICT(instrument_name, granularity_name, time) DO UPDATE SET
-                open=excluded.open, high=excluded.high, low=excluded.low, close=excluded.close, volume=excluded.volume, complete=excluded.complete
-            '''
-            execute_db_query(connection, insert_bar_query, (
-                bar_time, instrument, granularity, open_price, high_price, low_price, close_price, volume, is_complete
-            ))
+        corrected_time = find_first_corrected_bar(connection, instrument, granularity, historical_data)
+
+        cursor = connection.cursor()
+        cursor.executemany(INSERT_BID_ASK_BAR_QUERY if historical_data.has_bid_ask else INSERT_BAR_QUERY,
+                           historical_data.rows(instrument, granularity))
+        if corrected_time is not None:
+            invalidate_indicator_values(connection, instrument, granularity, corrected_time)
+
+        logging.info(f"Historical data save complete, {cursor.rowcount} of {len(historical_data)} bars written.")
+    # Write-through once committed, so the cache never holds bars the table does not
+    bar_cache.write(instrument, granularity, historical_data)
+
+
+def track_forming_bar(instrument, granularity, batch):
+    """
+    Remember the forming bar of a fresh API batch reaching the present and when the next completed bar
+    can be expected. A forming bar that opened more than a bar ago is stale and leaves the state as is.
+    """
+    key = (instrument, granularity)
+    granularity_ns = int(granularity_to_minutes(granularity) * 60 * 1e9)
+    forming = batch[~batch.complete]
+    now = time.time_ns()
+    with _lifecycle_lock:
+        if len(forming):
+            candle = next(iter(forming[-1:]))
+            if now - candle.time > granularity_ns:
+                return
+            _forming_bars[key] = candle
+            _next_refresh[key] = candle.time + granularity_ns
+        else:
+            # Market closed: look again one bar later
+            _forming_bars.pop(key, None)
+            _next_refresh[key] = now + granularity_ns
 
-        logging.info("Historical data save complete.")
+
+def get_forming_bar(instrument, granularity):
+    """The in-memory forming bar as a Candle, or None when none was seen or it has completed since."""
+    key = (instrument, granularity)
+    with _lifecycle_lock:
+        if time.time_ns() >= _next_refresh.get(key, 0):
+            return None
+        return _forming_bars.get(key)
 
 
 def log_order(order_response):
@@ -248,50 +529,76 @@ def granularity_to_minutes(granularity):
     # Return the corresponding minutes, defaulting to 0 if granularity is not recognized
     return granularity_map.get(granularity, 0)
 
-def fetch_historical_data(instrument, granularity, count, access_token):
+def latest_complete_bar_time(instrument, granularity):
+    """Epoch ns of the last complete bar in the bars table, or None."""
     ensure_bars_tables_exists()
     with connect_to_db() as connection:
-        # Attempt to fetch the latest available data from the database
-        latest_data_query = '''
-            SELECT time
+        return execute_db_query(connection, '''
+            SELECT MAX(time)
             FROM bars
-            WHERE instrument_name = ? AND granularity_name = ?
-            ORDER BY time DESC
-            LIMIT 1
-        '''
-        latest_result = execute_db_query(connection, latest_data_query, (instrument, granularity), fetch_one=True)
-        latest_bar_time = parse_iso8601_date(latest_result[0]) if latest_result else datetime.utcnow()
+            WHERE instrument_name = ? AND granularity_name = ? AND complete = 1
+        ''', (instrument, granularity), fetch_one=True)[0]
 
-        # Calculate the start date for the data request
-        start_date = calculate_start_date_from_count(latest_bar_time, count, granularity)
-
-        # Modify the fetch_query to select data after the calculated start date
-        fetch_query = '''
-            SELECT time, open, high, low, close, volume, complete
-            FROM bars
-            WHERE instrument_name = ? AND granularity_name = ? AND time >= ?
-            ORDER BY time DESC
-        '''
-        result = execute_db_query(connection, fetch_query, (instrument, granularity, start_date.isoformat()), fetch_all=True)
 
-        if result:
-            if len(result) < count:
-                logging.warning(f"Insufficient data found for {instrument} at {granularity} granularity. Fetching from API.")
-                api_data = get_historical_data(count - len(result), granularity, access_token, instrument, start_date=start_date)
-                save_historical_data(api_data, instrument, granularity)
-                result.extend(extract_bar_data(api_data))
+def refresh_completed_bars(instrument, granularity, latest_time, access_token):
+    """
+    Append the bars completed since latest_time (epoch ns), MAX_CANDLES_PER_REQUEST a page until a page
+    comes back short or reaches the forming bar; the forming bar only refreshes memory.
+    """
+    try:
+        while True:
+            batch = get_historical_batch(MAX_CANDLES_PER_REQUEST, granularity, access_token, instrument,
+                                         start_date=epoch_ns_to_datetime(latest_time))
+            last_page = len(batch) < MAX_CANDLES_PER_REQUEST or not batch.complete.all()
+            save_historical_data(batch, instrument, granularity, reaches_present=last_page)
+            if last_page:
+                return
+            # 'from' is inclusive, the next page starts at this one's last bar
+            latest_time = int(batch.time.max())
+    except Exception as e:
+        logging.warning(f"Could not refresh {instrument} {granularity} bars, serving stored bars: {e}")
 
-            bar_df = pd.DataFrame(result, columns=['time', 'open', 'high', 'low', 'close', 'volume', 'complete']).sort_values(by='time').reset_index(drop=True)
-            bar_df[['open', 'high', 'low', 'close']] = bar_df[['open', 'high', 'low', 'close']].astype(float)
-            return bar_df
 
-        else:
+@spanned('fetch')
+def fetch_historical_batch(instrument, granularity, count, access_token, include_forming=False):
+    """
+    The last count bars of an instrument as of its last complete bar, oldest first, as a read-only
+    CandleBatch. Windows are sliced from bar_cache; completed bars are fetched from the API once their
+    close time has passed and include_forming appends the in-memory forming bar.
+    """
+    latest_time = bar_cache.last_time(instrument, granularity)
+    if latest_time is None:
+        latest_time = latest_complete_bar_time(instrument, granularity)
+    if latest_time is not None and time.time_ns() >= _next_refresh.get((instrument, granularity), 0):
+        refresh_completed_bars(instrument, granularity, latest_time, access_token)
+
+    batch = bar_cache.get(instrument, granularity, count)
+    if batch is None:
+        batch = query_last_bars(instrument, granularity, count)
+        if not len(batch):
             logging.warning(f"No data found for {instrument} with granularity {granularity}. Fetching from API.")
-            start_date = calculate_start_date_from_count(latest_bar_time, count, granularity)
-            api_data = get_historical_data(start_date=start_date, granularity=granularity, access_token=access_token, instrument=instrument)
-            save_historical_data(api_data, instrument, granularity)
-            bars_df = extract_bar_data(api_data)
-            return bars_df
+            save_historical_data(get_historical_batch(min(count, MAX_CANDLES_PER_REQUEST), granularity, access_token,
+                                                      instrument), instrument, granularity)
+            batch = query_last_bars(instrument, granularity, count)
+        elif len(batch) < count:
+            logging.warning(f"Insufficient data found for {instrument} at {granularity} granularity. Fetching from API.")
+            save_historical_data(get_historical_batch(min(count - len(batch), MAX_CANDLES_PER_REQUEST), granularity,
+                                                      access_token, instrument,
+                                                      end_date=epoch_ns_to_datetime(batch.time[0])),
+                                 instrument, granularity, reaches_present=False)
+            batch = query_last_bars(instrument, granularity, count)
+        bar_cache.load(instrument, granularity, batch)
+
+    forming = get_forming_bar(instrument, granularity)
+    if include_forming and forming is not None:
+        batch = CandleBatch(*(np.append(batch[column], getattr(forming, column)) for column in CandleBatch.columns))
+    return batch
+
+
+def fetch_historical_data(instrument, granularity, count, access_token, include_forming=False):
+    """fetch_historical_batch as a DataFrame (time in epoch ns)."""
+    return fetch_historical_batch(instrument, granularity, count, access_token, include_forming).to_dataframe()
+
 
 def get_instrument_value(currency_name, attribute):
     """
@@ -319,6 +626,17 @@ def get_instrument_value(currency_name, attribute):
             return None
 
 
+def get_instrument_row(currency_name):
+    """All cached specs of an instrument as a dict keyed by column, or None if it is unknown."""
+    with connect_to_db() as connection:
+        cursor = connection.execute("SELECT * FROM instruments WHERE name = ?", (currency_name,))
+        row = cursor.fetchone()
+        if row is None:
+            logging.warning(f"No data found for {currency_name}.")
+            return None
+        return dict(zip((column[0] for column in cursor.description), row))
+
+
 def get_instrument_list():
     """
     Retrieve a list of all currency pairs from the database.
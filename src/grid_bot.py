@@ -1,7 +1,13 @@
 import logging
 from datetime import datetime
 
+from oandapyV20.endpoints import positions
+from oandapyV20.exceptions import V20Error
+
+from src import tracing
 from src.database_functions import get_instrument_value
+from src.grid_reconciler import GridReconciler
+from src.grid_simulator import GridSimulator
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s : %(message)s')
 
@@ -11,20 +17,25 @@ from src.bot_utils import BotUtils, adjust_price_to_pip_location
 # -----------------Grid Bot Classes-----------------#
 
 class GridBot:
-    def __init__(self, main_bot, instrument):
+    def __init__(self, main_bot, instrument, available_funds=None):
         self.utils = BotUtils(main_bot)  # Creates a new BotUtils instance for each GridBot
         self.utils.instrument = instrument
         self.account_id = main_bot.account_id
         self.api = main_bot.api
         self.access_token = main_bot.access_token
         self.instrument = instrument
+        self.state_store = main_bot.state_store
 
         self.pip_location = self.utils.get_pip_location()
         self.pip_value = self.utils.get_pip_value()
         self.get_current_price = self.utils.get_current_price
-        self.available_funds = main_bot.funds_available_for_grid
+        # The orchestrator passes each bot its share of the grid funds
+        self.available_funds = main_bot.funds_available_for_grid if available_funds is None else available_funds
         self.grid_settings = main_bot.grid_settings
+        self.grid_simulation = main_bot.grid_simulation
         self.get_recent_atr = self.utils.get_recent_atr
+        # Only orders tagged as this grid's are ever replaced or cancelled
+        self.reconciler = GridReconciler(self.api, self.account_id, instrument, risk_engine=self.utils.risk_engine)
 
         self.conversion_factor_pos, self.conversion_factor_neg = self.utils.get_conversion_factors()
         self.long_available_units, self.short_available_units = self.get_available_units()
@@ -35,6 +46,71 @@ class GridBot:
         self.is_grid_active = None
         self.is_long = None
         self.is_ranging = None
+        self.grid_levels = None
+        self.grid_setup_time = None
+        self.placing = False  # Checkpointed while the levels' orders are being sent
+        self.out_of_band = False  # Latched while price stays outside the grid band, so one excursion checks once
+
+    def state(self):
+        return {
+            "is_grid_active": bool(self.is_grid_active),
+            "grid_setup_time": self.grid_setup_time.isoformat() if self.grid_setup_time else None,
+            "grid_levels": self.grid_levels,
+            "placing": self.placing,
+            "available_funds": self.available_funds,
+            "long_available_units": self.long_available_units,
+            "short_available_units": self.short_available_units,
+        }
+
+    def checkpoint(self):
+        # Saved before the orders it describes are sent, so a crash in between is finished on restart
+        self.state_store.set_item('grids', self.instrument, self.state())
+
+    def restore(self, state):
+        self.is_grid_active = state['is_grid_active']
+        self.grid_setup_time = datetime.fromisoformat(state['grid_setup_time']) if state['grid_setup_time'] else None
+        self.grid_levels = state['grid_levels']
+        self.placing = state.get('placing', False)
+        self.available_funds = state['available_funds']
+        self.long_available_units = state['long_available_units']
+        self.short_available_units = state['short_available_units']
+
+    def resume(self, state, live_orders, has_position=False):
+        """
+        Continue a checkpointed grid after a restart. live_orders are the grid's pending orders by level,
+        read with the rest of the account, so an order placement the crash cut short is completed without
+        re-reading the orders. While a position is held, a missing level was filled rather than never sent,
+        and is not placed again. A grid whose orders were all placed and are gone, with no position left,
+        has run its course: it is re-centered on the current price and ATR like one with nothing to resume.
+        """
+        self.restore(state)
+        if self.is_grid_active and self.grid_levels and (self.placing or live_orders or has_position):
+            logging.info(f"Resuming grid for {self.instrument} set up at {self.grid_setup_time}")
+            desired = self.desired_orders()
+            if has_position:
+                desired = {level: spec for level, spec in desired.items() if level in live_orders}
+            self.reconciler.reconcile(desired, live=live_orders)
+            if self.placing:
+                self.placing = False
+                self.checkpoint()
+        else:
+            self.reset_grid()
+
+    def desired_orders(self):
+        # Long order at current price - ATR, short order at current price + ATR, each with its stop loss and
+        # take profit sl_distance/tp_distance from its own entry, as GridSimulator and PortfolioBacktest model them
+        levels = self.grid_levels
+        long_entry, short_entry = levels['long_entry'], levels['short_entry']
+        return {
+            "long": self.reconciler.order_spec(
+                "long", self.long_available_units, long_entry,
+                stopLossOnFill={"price": str(long_entry - levels['sl_distance'])},
+                takeProfitOnFill={"price": str(long_entry + levels['tp_distance'])}),
+            "short": self.reconciler.order_spec(
+                "short", -self.short_available_units, short_entry,
+                stopLossOnFill={"price": str(short_entry + levels['sl_distance'])},
+                takeProfitOnFill={"price": str(short_entry - levels['tp_distance'])}),
+        }
 
     def get_available_units(self):
         logging.info(f"Setting available units for {self.instrument}")
@@ -59,9 +135,8 @@ class GridBot:
             f"Pip Value: {self.pip_value}")
 
     def reset_grid(self):
-        # TODO - ENSURE ONLY GRID ORDERS ARE CANCELLED
+        # Re-centering goes through the reconciler: levels that moved are replaced, the rest keep their queue place
         # self.close_all_positions()
-        # self.cancel_all_orders()
         self.is_grid_active = False
         logging.info("Grid reset.")
         self.activate_grid()
@@ -72,23 +147,31 @@ class GridBot:
 
     def check_grid_status(self):
         logging.info(f"Checking grid status for {self.instrument}")
-        pos = self.utils.get_current_positions()
-        if pos:
+        position, resting = self.get_holdings()
+        if position or resting:
             if not self.is_market_condition_favorable():
                 self.reset_grid()
         else:
-            orders = self.utils.get_open_orders()
+            self.reset_grid()
 
-            if orders:
-                if not self.is_market_condition_favorable():
-                    self.reset_grid()
-            else:
-                self.reset_grid()
+    def get_holdings(self):
+        # This instrument's position and resting orders, from the risk engine's account state instead of a
+        # REST round trip per check; without a risk engine, the instrument's own position and grid orders
+        risk_engine = self.utils.risk_engine
+        if risk_engine is not None:
+            return risk_engine.holdings(self.instrument)
+        try:
+            position = self.api.request(positions.PositionDetails(self.account_id, self.instrument))['position']
+            units = float(position['long']['units']) + float(position['short']['units'])
+        except V20Error:
+            units = 0.0  # Never traded
+        return units, sum(abs(float(order['units'])) for order in self.reconciler.live_orders().values())
 
     def place_atr_based_orders(self):
         self.pip_location = 4
         current_price = self.get_current_price()
         atr = self.get_recent_atr()
+        tracing.mark('indicator')
         adjusted_atr = round(atr, self.pip_location)
 
         atr_factor = self.grid_settings['entry_atr_factor']
@@ -115,28 +198,46 @@ class GridBot:
 
         logging.info(f"Adjusted SL distance: {adjusted_sl_distance}Adjust TP distance: {adjusted_tp_distance}")
 
-        buy_take_profit = current_price + tp_distance
-        sell_take_profit = current_price - tp_distance
+        if self.grid_simulation['enabled'] and not self.is_simulation_acceptable(current_price, atr):
+            self.is_grid_active = False
+            self.checkpoint()
+            self.reconciler.reconcile({})  # Take down what is left of the previous grid
+            self.state_store.remove_item('grids', self.instrument)  # Nothing left to resume
+            return
 
-        adjusted_buy_take_profit = round(buy_take_profit, self.pip_location)
-        adjusted_sell_take_profit = round(sell_take_profit, self.pip_location)
+        self.grid_levels = {
+            "atr": atr,
+            "long_entry": adjusted_long_entry_price,
+            "short_entry": adjusted_short_entry_price,
+            "sl_distance": adjusted_sl_distance,
+            "tp_distance": adjusted_tp_distance,
+        }
 
-        logging.info(
-            f"Buy take profit: {buy_take_profit}, "
-            f"Sell take profit: {sell_take_profit}")
-        logging.info(f"Adjusted Buy take profit: {adjusted_buy_take_profit}, "
-                     f"Sell take profit: {adjusted_sell_take_profit}")
-
-        # Calculate and place orders
-        self.utils.place_order(price=adjusted_long_entry_price,
-                               units=self.long_available_units,)
-# Long order at current price + ATR
-
-        self.utils.place_order(price=adjusted_short_entry_price,
-                               units=-self.short_available_units,)
-     # Short order at current price - ATR
+        self.placing = True
+        self.checkpoint()
+        self.reconciler.reconcile(self.desired_orders())
+        self.placing = False  # Checkpointed by activate_grid with the setup time
         logging.info(f"Orders placed for {self.instrument}")
 
+    def is_simulation_acceptable(self, current_price, atr):
+        simulator = GridSimulator.from_store(self.instrument, access_token=self.access_token,
+                                             paths=self.grid_simulation['paths'],
+                                             horizon=self.grid_simulation['horizon'],
+                                             block_size=self.grid_simulation['block_size'])
+        margin_rate = get_instrument_value(self.instrument, 'marginRate')
+        # Orders below are entered one full ATR away from the price, whatever entry_atr_factor says
+        settings = dict(self.grid_settings, entry_atr_factor=1.0)
+        report = simulator.run([settings], self.available_funds, self.conversion_factor_pos,
+                               float(margin_rate) if margin_rate else 0.0333, atr=atr, price=current_price)[0]
+        logging.info(f"Simulated grid for {self.instrument}: expected P&L {report['expected_pnl']:.2f}, "
+                     f"P&L 5%-95% [{report['pnl_p5']:.2f}, {report['pnl_p95']:.2f}], "
+                     f"max drawdown {report['expected_max_drawdown']:.2f}, "
+                     f"margin call probability {report['margin_call_probability']:.2%}")
+        if report['margin_call_probability'] > self.grid_simulation['max_margin_call_probability']:
+            logging.warning(f"Grid for {self.instrument} not deployed, margin call probability too high")
+            return False
+        return True
+
     def is_market_condition_favorable(self):
         logging.info(f"Checking market condition for {self.instrument}")
         return True
@@ -145,6 +246,26 @@ class GridBot:
         if not self.is_grid_active:
             logging.info(f"Activating grid for {self.instrument}")
             self.is_grid_active = True
+            self.out_of_band = False
             self.initialize_grid_parameters()
             self.place_atr_based_orders()
             self.grid_setup_time = datetime.utcnow()
+            self.checkpoint()
+
+    def on_tick(self, price):
+        # Woken by the orchestrator on every tick for this instrument; only re-check once price leaves the grid band
+        if not self.is_grid_active or not self.grid_levels:
+            return
+        lower = self.grid_levels['long_entry'] - self.grid_levels['sl_distance']
+        upper = self.grid_levels['short_entry'] + self.grid_levels['sl_distance']
+        tracing.mark('decision')
+        if lower <= price <= upper:
+            self.out_of_band = False
+        elif not self.out_of_band:
+            self.out_of_band = True  # Cleared when price comes back or the grid is re-centered
+            logging.info(f"{self.instrument} price {price} left grid band [{lower}, {upper}]")
+            self.check_grid_status()
+
+    def on_bar_close(self, bar_time):
+        logging.info(f"Bar closed for {self.instrument} at {bar_time}")
+        self.check_grid_status()
@@ -0,0 +1,148 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import logging
+import queue
+import threading
+
+from src import tracing
+from src.database_functions import granularity_to_minutes
+from src.grid_bot import GridBot
+from src.market_cache import MarketDataCache
+from src.stream_handler import StreamHandler
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s : %(message)s')
+
+
+class GridOrchestrator:
+    """
+    Runs many GridBots on a worker pool.
+
+    All bots share one MarketDataCache and one pricing stream. A bot is only woken when a tick
+    or a bar close arrives for its own instrument, and never runs twice at the same time.
+    """
+
+    def __init__(self, main_bot, max_workers=8, bar_granularity='H1'):
+        self.main_bot = main_bot
+        self.market_cache = MarketDataCache(main_bot.api, main_bot.account_id)
+        main_bot.market_cache = self.market_cache  # BotUtils picks the shared cache up from the main bot
+        self.risk_engine = main_bot.risk_engine
+        if self.risk_engine is not None:
+            self.risk_engine.market_cache = self.market_cache
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='grid')
+        self.bar_minutes = granularity_to_minutes(bar_granularity)
+        self.bots = {}
+        self.stream_handler = None
+        self.price_queue = None
+        self.running = False
+        self._busy = set()
+        self._pending = {}
+        self._last_bar = {}
+        self._lock = threading.Lock()
+
+    def split_funds(self, instruments):
+        total_funds = self.main_bot.funds_available_for_grid * self.main_bot.max_grids
+        funds_per_grid = total_funds / len(instruments)
+        logging.info(f"Splitting {total_funds} grid funds across {len(instruments)} grids: {funds_per_grid} each")
+        return funds_per_grid
+
+    def build_bot(self, instrument, available_funds):
+        return GridBot(self.main_bot, instrument, available_funds=available_funds)
+
+    def start(self, instruments, resumed=None):
+        """resumed: instrument -> (checkpointed state, live orders by level, has position), see GridBot.resume."""
+        resumed = resumed or {}
+        if not instruments:
+            logging.warning("No instruments to orchestrate.")
+            return
+        # One batched pricing request warms quotes and conversion factors for every bot
+        self.market_cache.refresh_prices(instruments)
+        funds_per_grid = self.split_funds(instruments)
+
+        # Bot construction still does a few blocking lookups, so build them concurrently
+        bots = self.executor.map(lambda instrument: self.build_bot(instrument, funds_per_grid), instruments)
+        for instrument, bot in zip(instruments, bots):
+            self.bots[instrument] = bot
+            if instrument in resumed:
+                self.dispatch(instrument, bot.resume, *resumed[instrument], keep=True)
+            else:
+                self.dispatch(instrument, bot.run_strategy, keep=True)
+        logging.info(f"Orchestrating {len(self.bots)} grids: {list(self.bots)}")
+
+        self.running = True
+        if self.main_bot.market_data is not None:
+            # Supervisor worker: ticks come from the shared market-data service instead of an own stream
+            self.price_queue = self.main_bot.market_data.subscribe(list(self.bots))
+            threading.Thread(target=self.pump_prices, name='price-pump', daemon=True).start()
+            return
+        self.stream_handler = StreamHandler('pricing', self.main_bot, list(self.bots))
+        self.stream_handler.subscribe('*', self.on_price)
+        self.stream_handler.run_stream()
+
+    def pump_prices(self):
+        while self.running:
+            try:
+                msg = self.price_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            tracing.begin('price', msg.get('instrument'))
+            self.on_price(msg)
+            tracing.end()
+
+    def stop(self):
+        self.running = False
+        if self.stream_handler:
+            self.stream_handler.stop_stream()
+        if self.price_queue is not None:
+            self.main_bot.market_data.unsubscribe(self.price_queue)
+        self.executor.shutdown(wait=True)
+        logging.info("Grid orchestrator stopped.")
+
+    def dispatch(self, instrument, func, *args, keep=False):
+        # Coalesce work while the bot is busy: ticks are dropped, kept events (bar closes) run right after.
+        # The event's trace goes with the work, or is finished here when the work is dropped.
+        trace = tracing.handoff()
+        with self._lock:
+            if instrument in self._busy:
+                dropped = trace
+                if keep:
+                    dropped = self._pending.get(instrument, (None, None, None))[2]
+                    self._pending[instrument] = (func, args, trace)
+                tracing.end('coalesced', dropped)
+                return None
+            self._busy.add(instrument)
+        return self.executor.submit(self._run, instrument, trace, func, *args)
+
+    def _run(self, instrument, trace, func, *args):
+        while True:
+            try:
+                with tracing.resumed(trace):
+                    func(*args)
+            except Exception as e:
+                logging.error(f"Grid bot for {instrument} failed: {e}")
+            with self._lock:
+                if instrument not in self._pending:
+                    self._busy.discard(instrument)
+                    return
+                func, args, trace = self._pending.pop(instrument)
+
+    def on_price(self, msg):
+        if msg.get('type') != 'PRICE':
+            return
+        quote = self.market_cache.update_from_price(msg)
+        tracing.mark('quote')
+        instrument = msg['instrument']
+        bot = self.bots.get(instrument)
+        if quote is not None and self.risk_engine is not None:
+            self.risk_engine.on_price(instrument, quote['bid'], quote['ask'],
+                                      self.market_cache.conversion_factors.get(instrument))
+            tracing.mark('risk')
+        if quote is None or bot is None:
+            return
+
+        bar_index = int((quote['time'] - datetime(1970, 1, 1)).total_seconds() // 60 // self.bar_minutes)
+        last_bar_index = self._last_bar.get(instrument)
+        self._last_bar[instrument] = bar_index
+        if last_bar_index is not None and bar_index > last_bar_index:
+            self.dispatch(instrument, bot.on_bar_close, quote['time'], keep=True)
+        else:
+            self.dispatch(instrument, bot.on_tick, quote['mid'])
@@ -0,0 +1,151 @@
+"""
+Moves a live grid to new levels with the fewest order requests.
+
+Grid orders carry clientExtensions {"id": "<tag>-<instrument>-<level>", "tag": <tag>}, so the live
+grid is told apart from every other pending order on the account. reconcile() compares the desired
+levels with the tagged pending orders and only sends:
+
+    OrderCreate  for levels without a live order,
+    OrderReplace for levels whose price, units or exits moved,
+    OrderCancel  for live levels that are no longer wanted.
+
+Levels that did not move are left alone and keep their place in the queue.
+"""
+from oandapyV20.endpoints import orders
+
+import logging
+
+from src import tracing
+from src.order_validator import order_validator
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s : %(message)s')
+
+EXIT_FIELDS = ('takeProfitOnFill', 'stopLossOnFill', 'trailingStopLossOnFill')
+
+
+def _price(value):
+    return float(value) if value is not None else None
+
+
+def order_matches(live, desired, price_tolerance=1e-9):
+    """True when a live pending order already is the desired order."""
+    if live.get('type') != desired.get('type') or float(live['units']) != float(desired['units']):
+        return False
+    if abs(float(live['price']) - float(desired['price'])) > price_tolerance:
+        return False
+    for field in EXIT_FIELDS:
+        live_exit, desired_exit = live.get(field) or {}, desired.get(field) or {}
+        for key in ('price', 'distance'):
+            live_value, desired_value = _price(live_exit.get(key)), _price(desired_exit.get(key))
+            if (live_value is None) != (desired_value is None):
+                return False
+            if live_value is not None and abs(live_value - desired_value) > price_tolerance:
+                return False
+    return True
+
+
+def diff_grid(desired, live, price_tolerance=1e-9):
+    """
+    desired: level -> order spec, live: level -> pending order. Returns (creates, replaces, cancels) as
+    lists of (level, spec), (level, order id, spec) and (level, order).
+    """
+    creates, replaces, cancels = [], [], []
+    for level, spec in desired.items():
+        order = live.get(level)
+        if order is None:
+            creates.append((level, spec))
+        elif not order_matches(order, spec, price_tolerance):
+            replaces.append((level, order['id'], spec))
+    for level, order in live.items():
+        if level not in desired:
+            cancels.append((level, order))
+    return creates, replaces, cancels
+
+
+def tagged_orders(pending_orders, tag='grid'):
+    """Pending orders carrying tag by instrument and level, e.g. from the orders of AccountDetails."""
+    tagged = {}
+    for order in pending_orders:
+        extensions = order.get('clientExtensions') or {}
+        prefix = f"{tag}-{order.get('instrument')}-"
+        if extensions.get('tag') == tag and extensions.get('id', '').startswith(prefix):
+            tagged.setdefault(order['instrument'], {})[extensions['id'][len(prefix):]] = order
+    return tagged
+
+
+class GridReconciler:
+    def __init__(self, api, account_id, instrument, tag='grid', risk_engine=None, price_tolerance=1e-9):
+        self.api = api
+        self.account_id = account_id
+        self.instrument = instrument
+        self.tag = tag
+        self.risk_engine = risk_engine
+        self.price_tolerance = price_tolerance
+
+    def client_id(self, level):
+        return f"{self.tag}-{self.instrument}-{level}"
+
+    def order_spec(self, level, units, price, order_type='LIMIT', **exits):
+        """Order body of one grid level; exits are takeProfitOnFill/stopLossOnFill/... dicts."""
+        spec = {
+            "instrument": self.instrument,
+            "units": str(units),
+            "type": order_type,
+            "price": str(price),
+            "positionFill": "DEFAULT",
+            "clientExtensions": {"id": self.client_id(level), "tag": self.tag},
+        }
+        spec.update(exits)
+        return spec
+
+    def live_orders(self):
+        """Pending grid orders of the instrument by level."""
+        response = self.api.request(orders.OrderList(self.account_id,
+                                                     params={"instrument": self.instrument, "state": "PENDING"}))
+        return tagged_orders(response.get('orders', []), self.tag).get(self.instrument, {})
+
+    def _check(self, spec, replaced_units=0.0):
+        if self.risk_engine is None:
+            return
+        # A replace frees the reservation of the order it replaces
+        reason = self.risk_engine.check_order(self.instrument, float(spec['units']) - replaced_units,
+                                              float(spec['price']))
+        if reason:
+            logging.error(f"Grid order rejected by pre-trade check: {reason}")
+            raise ValueError(f"Pre-trade check failed: {reason}")
+
+    def reconcile(self, desired, live=None):
+        """
+        Bring the live grid to desired (level -> order spec, see order_spec). Level keys are strings.
+        Returns the number of creates, replaces, cancels and unchanged levels.
+        """
+        # Normalized first, so prices compare equal to what OANDA echoes back for unchanged levels
+        desired = {str(level): order_validator.validate(spec) for level, spec in desired.items()}
+        live = self.live_orders() if live is None else live
+        creates, replaces, cancels = diff_grid(desired, live, self.price_tolerance)
+        tracing.mark('reconcile')
+
+        for level, order in cancels:
+            self.api.request(orders.OrderCancel(self.account_id, order['id']))
+            tracing.mark('order')
+            if self.risk_engine is not None:
+                self.risk_engine.on_order_cancelled(self.instrument, float(order['units']))
+        for level, order_id, spec in replaces:
+            replaced_units = float(live[level]['units'])
+            self._check(spec, replaced_units)
+            response = self.api.request(orders.OrderReplace(self.account_id, order_id, data={"order": spec}))
+            tracing.mark('order')
+            if self.risk_engine is not None:
+                self.risk_engine.on_order_cancelled(self.instrument, replaced_units)
+                self.risk_engine.on_order_response(spec, response)
+        for level, spec in creates:
+            self._check(spec)
+            response = self.api.request(orders.OrderCreate(self.account_id, data={"order": spec}))
+            tracing.mark('order')
+            if self.risk_engine is not None:
+                self.risk_engine.on_order_response(spec, response)
+
+        summary = {"created": len(creates), "replaced": len(replaces), "cancelled": len(cancels),
+                   "unchanged": len(desired) - len(creates) - len(replaces)}
+        logging.info(f"Reconciled {self.instrument} grid: {summary}")
+        return summary
@@ -0,0 +1,136 @@
+"""
+Monte Carlo outcomes of an ATR grid before it is deployed.
+
+Paths are built by block-bootstrapping the bar-to-bar moves (close, high and low relative to the
+previous close) of the bars store, so intrabar touches and volatility clustering within a block are
+kept. Every grid_settings candidate is simulated on the same paths: one long limit entry at
+entry_atr_factor ATRs below the start price and one short entry above it, each with its own stop and
+take profit at sl_atr_factor/tp_atr_factor ATRs from the entry, sized like GridBot.get_available_units.
+Paths are simulated in NumPy batches of (paths x bars) arrays spread across a process pool.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import os
+
+import numpy as np
+
+from src.database_functions import fetch_historical_batch
+from src.kernels import atr, leg_events
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s : %(message)s')
+
+MARGIN_CLOSEOUT_FRACTION = 0.5  # OANDA closes positions out once NAV falls below half the margin used
+
+
+def relative_moves(bars):
+    """Log close, high and low of every bar relative to the previous close, shape (3, len(bars) - 1)."""
+    previous = np.log(bars['close'][:-1])
+    return np.stack((np.log(bars['close'][1:]) - previous, np.log(bars['high'][1:]) - previous,
+                     np.log(bars['low'][1:]) - previous))
+
+
+def recent_atr(bars, length=14):
+    """Wilder ATR at the last bar, the same smoothing as pandas_ta.atr."""
+    return float(atr(bars['high'], bars['low'], bars['close'], length)[-1])
+
+
+def block_bootstrap(moves, paths, horizon, block_size, rng):
+    """Resample (paths, horizon) bars as circular blocks of consecutive historical bars."""
+    blocks = -(-horizon // block_size)
+    starts = rng.integers(0, moves.shape[1], size=(paths, blocks, 1))
+    index = ((starts + np.arange(block_size)) % moves.shape[1]).reshape(paths, -1)[:, :horizon]
+    close_moves, high_moves, low_moves = moves[:, index]
+    log_close = np.cumsum(close_moves, axis=1)
+    log_previous = np.concatenate((np.zeros((paths, 1)), log_close[:, :-1]), axis=1)
+    # Prices relative to the start price
+    return np.exp(log_previous + high_moves), np.exp(log_previous + low_moves), np.exp(log_close)
+
+
+def simulate_leg(high, low, close, entry, stop, take, direction):
+    """P&L per unit over time and the open-position mask of one limit entry with a stop and a take profit."""
+    steps = np.arange(close.shape[1])
+    fill, stopped, taken = leg_events(high, low, entry, stop, take, direction)
+    after_fill = steps >= fill[:, None]
+    exit_step = np.minimum(stopped, taken)
+    exit_price = np.where(stopped <= taken, stop, take)  # Both in one bar: assume the stop came first
+    is_open = after_fill & (steps < exit_step[:, None])
+    closed = steps >= exit_step[:, None]
+    pnl = np.where(is_open, direction * (close - entry), 0.0)
+    pnl = np.where(closed, direction * (exit_price - entry)[:, None], pnl)
+    return pnl, is_open, fill < close.shape[1]
+
+
+def _simulate_batch(moves, paths, horizon, block_size, seed, candidates, atr, price, funds, conversion, margin_rate):
+    rng = np.random.default_rng(seed)
+    high, low, close = block_bootstrap(moves, paths, horizon, block_size, rng)
+    high, low, close = high * price, low * price, close * price
+    results = []
+    for settings in candidates:
+        units = funds * conversion / settings['order_limit']
+        equity = np.zeros_like(close)
+        open_units = np.zeros_like(close)
+        filled = np.zeros(paths, dtype=bool)
+        for direction in (1, -1):
+            entry = price - direction * settings['entry_atr_factor'] * atr
+            stop = entry - direction * settings['sl_atr_factor'] * atr
+            take = entry + direction * settings['tp_atr_factor'] * atr
+            pnl, is_open, leg_filled = simulate_leg(high, low, close, entry, stop, take, direction)
+            equity += units * pnl * conversion
+            open_units += units * is_open
+            filled |= leg_filled
+        drawdown = (np.maximum.accumulate(np.maximum(equity, 0.0), axis=1) - equity).max(axis=1)
+        margin_used = open_units * close * conversion * margin_rate
+        margin_call = ((funds + equity) < MARGIN_CLOSEOUT_FRACTION * margin_used).any(axis=1)
+        results.append((equity[:, -1], drawdown, margin_call, filled))
+    return results
+
+
+class GridSimulator:
+    def __init__(self, bars, paths=20000, horizon=168, block_size=24, batch_size=2500, processes=None, seed=1):
+        self.moves = relative_moves(bars)
+        self.price = float(bars['close'][-1])
+        self.atr = recent_atr(bars)
+        self.paths = paths
+        self.horizon = horizon  # Bars simulated after the grid is placed (168 H1 bars = one week)
+        self.block_size = block_size
+        self.batch_size = batch_size
+        self.processes = processes or os.cpu_count()
+        self.seed = seed
+
+    @classmethod
+    def from_store(cls, instrument, granularity='H1', count=5000, access_token=None, **kwargs):
+        return cls(fetch_historical_batch(instrument, granularity, count, access_token), **kwargs)
+
+    def run(self, candidates, funds, conversion=1.0, margin_rate=0.0333, atr=None, price=None):
+        """
+        Simulate every grid_settings candidate on the same paths. Returns one report per candidate with
+        expected P&L, P&L quantiles, max drawdown and the probability of a margin closeout.
+        """
+        atr = self.atr if atr is None else atr
+        price = self.price if price is None else price
+        batches = [(self.moves, min(self.batch_size, self.paths - start), self.horizon, self.block_size,
+                    self.seed + i, candidates, atr, price, funds, conversion, margin_rate)
+                   for i, start in enumerate(range(0, self.paths, self.batch_size))]
+        if self.processes > 1 and len(batches) > 1:
+            with ProcessPoolExecutor(max_workers=min(self.processes, len(batches))) as pool:
+                batch_results = list(pool.map(_simulate_batch, *zip(*batches)))
+        else:
+            batch_results = [_simulate_batch(*batch) for batch in batches]
+
+        reports = []
+        for i, settings in enumerate(candidates):
+            pnl, drawdown, margin_call, filled = (np.concatenate(column) for column in
+                                                  zip(*(result[i] for result in batch_results)))
+            reports.append({
+                "settings": settings,
+                "expected_pnl": float(pnl.mean()),
+                "pnl_std": float(pnl.std()),
+                "pnl_p5": float(np.percentile(pnl, 5)),
+                "pnl_p95": float(np.percentile(pnl, 95)),
+                "expected_max_drawdown": float(drawdown.mean()),
+                "max_drawdown_p95": float(np.percentile(drawdown, 95)),
+                "margin_call_probability": float(margin_call.mean()),
+                "fill_probability": float(filled.mean()),
+            })
+        logging.info(f"Simulated {len(candidates)} grid candidates on {self.paths} paths of {self.horizon} bars")
+        return reports
@@ -0,0 +1,133 @@
+import logging
+import threading
+
+import numpy as np
+
+from src.database_functions import connect_to_db, execute_db_query, ensure_bars_tables_exists, fetch_historical_batch
+from src.kernels import compute_kernel_indicator
+from src.profiler import spanned
+from tools.my_tools import compute_indicator, LazyModule
+
+ta = LazyModule('pandas_ta')
+pd = LazyModule('pandas')
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s : %(message)s')
+
+MAX_OUTPUTS = 5  # v0..v4 in indicator_values, enough for bbands (lower, mid, upper, bandwidth, percent)
+
+
+class IndicatorSpec:
+    """An indicator function of pandas_ta plus its parameters, e.g. IndicatorSpec('chop', length=14)."""
+
+    def __init__(self, name, **params):
+        self.name = name
+        self.params = params
+        self.key = f"{name}({','.join(f'{k}={v}' for k, v in sorted(params.items()))})"
+
+    @property
+    def warmup(self):
+        # Bars needed before the first new bar to reproduce its value. ATR is Wilder-smoothed (RMA), which
+        # has infinite memory, so it gets a long warmup that makes the seed error negligible.
+        length = int(self.params.get('length', 14))
+        return length * 10 if self.name == 'atr' else length * 2
+
+    def compute(self, data):
+        # ATR, CHOP and BBands come from the array kernels, anything else from pandas_ta
+        values = compute_kernel_indicator(self.name, data, **self.params)
+        if values is not None:
+            return values
+        return compute_indicator(data=data, indicator_func=getattr(ta, self.name), include_volume=False,
+                                 **self.params)
+
+    def __repr__(self):
+        return self.key
+
+
+class IndicatorStore:
+    """
+    Materialized indicator values per (instrument, granularity, spec) in the indicator_values table.
+
+    Only complete bars are materialized. A read extends the table for the bars appended since the last
+    materialized one, using just the warmup window before them; save_historical_data deletes values from
+    a corrected bar onwards so they are recomputed. Screening, backtests and sweeps read series from here
+    instead of recomputing indicators from raw bars.
+    """
+
+    def __init__(self, access_token=None, history=5000):
+        self.access_token = access_token
+        self.history = history  # Bars materialized the first time a spec is read
+        self.outputs = {}  # spec key -> number of output columns
+        self._lock = threading.Lock()
+
+    def materialize(self, instrument, granularity, spec):
+        """Extend the stored values of spec up to the latest complete bar, returns the number of new values."""
+        ensure_bars_tables_exists()
+        with self._lock, connect_to_db() as connection:
+            last_time = execute_db_query(connection, '''
+                SELECT MAX(time) FROM indicator_values
+                WHERE instrument_name = ? AND granularity_name = ? AND spec = ?
+            ''', (instrument, granularity, spec.key), fetch_one=True)[0]
+
+            if last_time is None:
+                new_bars = execute_db_query(connection, '''
+                    SELECT time, open, high, low, close, volume FROM bars
+                    WHERE instrument_name = ? AND granularity_name = ? AND complete = 1
+                    ORDER BY time DESC LIMIT ?
+                ''', (instrument, granularity, self.history), fetch_all=True)[::-1]
+                warmup_bars = []
+            else:
+                new_bars = execute_db_query(connection, '''
+                    SELECT time, open, high, low, close, volume FROM bars
+                    WHERE instrument_name = ? AND granularity_name = ? AND complete = 1 AND time > ?
+                    ORDER BY time
+                ''', (instrument, granularity, last_time), fetch_all=True)
+                warmup_bars = execute_db_query(connection, '''
+                    SELECT time, open, high, low, close, volume FROM bars
+                    WHERE instrument_name = ? AND granularity_name = ? AND complete = 1 AND time <= ?
+                    ORDER BY time DESC LIMIT ?
+                ''', (instrument, granularity, last_time, spec.warmup), fetch_all=True)[::-1]
+            if not new_bars:
+                return 0
+
+            data = pd.DataFrame(warmup_bars + new_bars, columns=['time', 'open', 'high', 'low', 'close', 'volume'])
+            values = np.asarray(spec.compute(data), dtype=np.float64)
+            values = values.reshape(len(data), -1)[len(warmup_bars):, :MAX_OUTPUTS]
+            padded = np.full((len(values), MAX_OUTPUTS), np.nan)
+            padded[:, :values.shape[1]] = values
+
+            rows = [(instrument, granularity, spec.key, bar[0], *(None if np.isnan(v) else v for v in row))
+                    for bar, row in zip(new_bars, padded.tolist())]
+            connection.cursor().executemany('''
+                INSERT OR REPLACE INTO indicator_values
+                (instrument_name, granularity_name, spec, time, v0, v1, v2, v3, v4)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            self.outputs[spec.key] = values.shape[1]
+            logging.info(f"Materialized {len(rows)} {spec} values for {instrument} {granularity}")
+            return len(rows)
+
+    @spanned('indicator')
+    def get_series(self, instrument, granularity, spec, count, refresh=True):
+        """
+        Last count values of spec, oldest first: shape (count,) for single-output indicators,
+        (count, outputs) otherwise.
+        """
+        if refresh:
+            # Make sure the bars store itself is up to date (fetches from the API when bars are missing)
+            fetch_historical_batch(instrument, granularity, count + spec.warmup, self.access_token)
+        self.materialize(instrument, granularity, spec)
+        with connect_to_db() as connection:
+            rows = execute_db_query(connection, '''
+                SELECT time, v0, v1, v2, v3, v4 FROM indicator_values
+                WHERE instrument_name = ? AND granularity_name = ? AND spec = ?
+                ORDER BY time DESC LIMIT ?
+            ''', (instrument, granularity, spec.key, count), fetch_all=True)[::-1]
+        values = np.array([row[1:] for row in rows], dtype=np.float64).reshape(len(rows), MAX_OUTPUTS)
+        outputs = self.outputs.get(spec.key) or self._stored_outputs(values)
+        return values[:, 0] if outputs == 1 else values[:, :outputs]
+
+    @staticmethod
+    def _stored_outputs(values):
+        # Number of output columns that hold any value
+        filled = ~np.isnan(values).all(axis=0)
+        return int(filled.nonzero()[0].max()) + 1 if filled.any() else 1
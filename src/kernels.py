@@ -0,0 +1,302 @@
+"""
+Array kernels behind the indicator math and the grid simulations.
+
+The sequential parts (exponential smoothing, rolling windows, first touches of a price path) are written
+twice: as plain loops, compiled with Numba when it is installed, and as NumPy fallbacks. The loops match
+pandas/pandas_ta step by step (same recurrences, same NaN rules), so atr, chop and bbands give the
+values of pandas_ta.atr, .chop and .bbands with either backend.
+"""
+import logging
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s : %(message)s')
+
+
+# -----------------Loop kernels-----------------#
+# Plain Python on NumPy arrays, restricted to what numba.njit compiles.
+
+def _ewm_mean_loop(values, alpha, min_periods):
+    # pandas' ewm(alpha, adjust=True, ignore_na=False).mean() recurrence
+    count = len(values)
+    out = np.empty(count)
+    if count == 0:
+        return out
+    old_weight_factor = 1.0 - alpha
+    weighted = values[0]
+    observations = 1 if weighted == weighted else 0
+    out[0] = weighted if observations >= max(min_periods, 1) else np.nan
+    old_weight = 1.0
+    for i in range(1, count):
+        current = values[i]
+        is_observation = current == current
+        observations += is_observation
+        if weighted == weighted:
+            old_weight *= old_weight_factor
+            if is_observation:
+                if weighted != current:
+                    weighted = (old_weight * weighted + current) / (old_weight + 1.0)
+                old_weight += 1.0
+        elif is_observation:
+            weighted = current
+        out[i] = weighted if observations >= max(min_periods, 1) else np.nan
+    return out
+
+
+def _rolling_max_loop(values, length):
+    # Monotonic deque of indices, O(n) whatever the window length
+    count = len(values)
+    out = np.full(count, np.nan)
+    window = np.empty(count, dtype=np.int64)
+    head, tail = 0, 0
+    for i in range(count):
+        while tail > head and values[window[tail - 1]] <= values[i]:
+            tail -= 1
+        window[tail] = i
+        tail += 1
+        if window[head] <= i - length:
+            head += 1
+        if i >= length - 1:
+            out[i] = values[window[head]]
+    return out
+
+
+def _rolling_sum_loop(values, length):
+    # NaN while any value in the window is NaN, like pandas' rolling(length).sum()
+    count = len(values)
+    out = np.full(count, np.nan)
+    total, missing = 0.0, 0
+    for i in range(count):
+        if values[i] == values[i]:
+            total += values[i]
+        else:
+            missing += 1
+        if i >= length:
+            if values[i - length] == values[i - length]:
+                total -= values[i - length]
+            else:
+                missing -= 1
+        if i >= length - 1 and missing == 0:
+            out[i] = total
+    return out
+
+
+def _rolling_mean_std_loop(values, length, ddof):
+    # Two passes per window: exact for prices whose variance is tiny next to their level
+    count = len(values)
+    mean, std = np.full(count, np.nan), np.full(count, np.nan)
+    for i in range(length - 1, count):
+        total = 0.0
+        for j in range(i - length + 1, i + 1):
+            total += values[j]
+        average = total / length
+        squares = 0.0
+        for j in range(i - length + 1, i + 1):
+            squares += (values[j] - average) ** 2
+        mean[i] = average
+        std[i] = np.sqrt(squares / (length - ddof))
+    return mean, std
+
+
+def _leg_events_loop(high, low, entry, stop, take, direction):
+    # One pass per path that stops at the exit instead of scanning every bar for every event
+    paths, steps = high.shape
+    fill = np.full(paths, steps, dtype=np.int64)
+    stopped = np.full(paths, steps, dtype=np.int64)
+    taken = np.full(paths, steps, dtype=np.int64)
+    for p in range(paths):
+        for t in range(steps):
+            if fill[p] == steps:
+                if (low[p, t] <= entry) if direction > 0 else (high[p, t] >= entry):
+                    fill[p] = t
+                else:
+                    continue
+            if (low[p, t] <= stop) if direction > 0 else (high[p, t] >= stop):
+                stopped[p] = t
+            if (high[p, t] >= take) if direction > 0 else (low[p, t] <= take):
+                taken[p] = t
+            if stopped[p] < steps or taken[p] < steps:
+                break
+    return fill, stopped, taken
+
+
+# -----------------NumPy kernels-----------------#
+
+def _ewm_mean_numpy(values, alpha, min_periods):
+    # The same weighted mean in closed form, sum r^(t-j) x_j / sum r^(t-j) over observations, per block so
+    # that the r^-j factors stay finite
+    observed = ~np.isnan(values)
+    out = np.full(len(values), np.nan)
+    ratio = 1.0 - alpha
+    if ratio <= 0.0:
+        index = np.where(observed, np.arange(len(values)), -1)
+        np.maximum.accumulate(index, out=index)
+        out[index >= 0] = values[index[index >= 0]]
+    else:
+        block = max(1, int(300 / -np.log(ratio)))
+        x, weights = np.where(observed, values, 0.0), observed.astype(np.float64)
+        numerator, denominator = np.empty(len(values)), np.empty(len(values))
+        carry_numerator = carry_denominator = 0.0
+        for start in range(0, len(values), block):
+            stop = min(start + block, len(values))
+            steps = np.arange(stop - start)
+            scale, inverse = ratio ** steps, ratio ** -steps.astype(np.float64)
+            numerator[start:stop] = scale * (ratio * carry_numerator + np.cumsum(x[start:stop] * inverse))
+            denominator[start:stop] = scale * (ratio * carry_denominator + np.cumsum(weights[start:stop] * inverse))
+            carry_numerator, carry_denominator = numerator[stop - 1], denominator[stop - 1]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out = numerator / denominator
+        out[denominator == 0] = np.nan
+    out[np.cumsum(observed) < max(min_periods, 1)] = np.nan
+    return out
+
+
+def _windowed(values, length, reduce):
+    out = np.full(len(values), np.nan)
+    if len(values) >= length:
+        out[length - 1:] = reduce(sliding_window_view(values, length), axis=1)
+    return out
+
+
+def _rolling_max_numpy(values, length):
+    return _windowed(values, length, np.max)
+
+
+def _rolling_sum_numpy(values, length):
+    return _windowed(values, length, np.sum)
+
+
+def _rolling_mean_std_numpy(values, length, ddof):
+    mean = _windowed(values, length, np.mean)
+    std = _windowed(values, length, lambda windows, axis: windows.std(axis=axis, ddof=ddof))
+    return mean, std
+
+
+def _leg_events_numpy(high, low, entry, stop, take, direction):
+    steps = np.arange(high.shape[1])
+    fill = _first(low <= entry) if direction > 0 else _first(high >= entry)
+    after_fill = steps >= fill[:, None]
+    if direction > 0:
+        stopped, taken = _first((low <= stop) & after_fill), _first((high >= take) & after_fill)
+    else:
+        stopped, taken = _first((high >= stop) & after_fill), _first((low <= take) & after_fill)
+    # Like the loop, which stops at the exit bar: the later of the two is not looked for
+    exit_step = np.minimum(stopped, taken)
+    return fill, np.where(stopped == exit_step, stopped, len(steps)), np.where(taken == exit_step, taken, len(steps))
+
+
+def _first(mask):
+    # Index of the first True per row, or the row length when there is none
+    return np.where(mask.any(axis=1), mask.argmax(axis=1), mask.shape[1])
+
+
+# -----------------Backend-----------------#
+
+_LOOP_KERNELS = {'ewm_mean': _ewm_mean_loop, 'rolling_max': _rolling_max_loop, 'rolling_sum': _rolling_sum_loop,
+                 'rolling_mean_std': _rolling_mean_std_loop, 'leg_events': _leg_events_loop}
+_NUMPY_KERNELS = {'ewm_mean': _ewm_mean_numpy, 'rolling_max': _rolling_max_numpy, 'rolling_sum': _rolling_sum_numpy,
+                  'rolling_mean_std': _rolling_mean_std_numpy, 'leg_events': _leg_events_numpy}
+
+
+def _select_backend():
+    try:
+        import numba  # noqa: F401
+        return 'numba'
+    except ImportError:
+        return 'numpy'
+
+
+def set_kernel_backend(name):
+    """
+    'numba' (the loops, compiled on first call), 'numpy', or 'python' (the loops uncompiled, slow), e.g. to
+    benchmark or to rule out a JIT bug.
+    """
+    global KERNEL_BACKEND, ewm_mean, rolling_max, rolling_sum, rolling_mean_std, leg_events
+    if name == 'numba':
+        import numba
+        kernels = {key: numba.njit(cache=True)(kernel) for key, kernel in _LOOP_KERNELS.items()}
+    elif name == 'python':
+        kernels = _LOOP_KERNELS
+    else:
+        kernels = _NUMPY_KERNELS
+    KERNEL_BACKEND = name
+    ewm_mean, rolling_max, rolling_sum = kernels['ewm_mean'], kernels['rolling_max'], kernels['rolling_sum']
+    rolling_mean_std, leg_events = kernels['rolling_mean_std'], kernels['leg_events']
+    logging.info(f"Kernel backend set to {KERNEL_BACKEND}")
+
+
+set_kernel_backend(_select_backend())
+
+
+# -----------------Indicators-----------------#
+# Inputs are float64 arrays without gaps; outputs have NaN over the warmup, like pandas_ta.
+
+def _float_array(values):
+    return np.ascontiguousarray(values, dtype=np.float64)
+
+
+def true_range(high, low, close):
+    high, low, close = _float_array(high), _float_array(low), _float_array(close)
+    high_low = high - low
+    if (high_low == 0).any():
+        high_low = high_low + np.finfo(float).eps  # pandas_ta's non_zero_range
+    out = np.empty(len(close))
+    out[0] = np.nan
+    previous = close[:-1]
+    out[1:] = np.maximum(np.maximum(high_low[1:], np.abs(high[1:] - previous)), np.abs(previous - low[1:]))
+    return out
+
+
+def atr(high, low, close, length=14):
+    """Wilder ATR (pandas_ta's rma of the true range)."""
+    length = int(length)
+    return ewm_mean(true_range(high, low, close), 1.0 / length, length)
+
+
+def rolling_min(values, length):
+    return -rolling_max(-_float_array(values), length)
+
+
+def chop(high, low, close, length=14, atr_length=1, scalar=100):
+    """Choppiness Index: ATR summed over length bars against the range of those bars, on a log scale."""
+    length = int(length)
+    atr_sum = rolling_sum(atr(high, low, close, atr_length), length)
+    price_range = rolling_max(_float_array(high), length) - rolling_min(low, length)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return scalar * (np.log10(atr_sum) - np.log10(price_range)) / np.log10(length)
+
+
+def bbands(close, length=5, std=2.0, ddof=0):
+    """Bollinger Bands as columns lower, mid, upper, bandwidth, percent, in pandas_ta's order."""
+    close = _float_array(close)
+    mid, deviation = rolling_mean_std(close, int(length), int(ddof))
+    lower, upper = mid - float(std) * deviation, mid + float(std) * deviation
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.column_stack((lower, mid, upper, 100 * (upper - lower) / mid, (close - lower) / (upper - lower)))
+
+
+# Indicators served by the kernels instead of pandas_ta: name -> (function, bar columns it reads, parameters)
+INDICATORS = {
+    'atr': (atr, ('high', 'low', 'close'), {'length'}),
+    'chop': (chop, ('high', 'low', 'close'), {'length', 'atr_length', 'scalar'}),
+    'bbands': (bbands, ('close',), {'length', 'std', 'ddof'}),
+}
+
+
+def compute_kernel_indicator(name, data, **params):
+    """name's values over data (DataFrame or CandleBatch), or None when the kernels don't cover name/params."""
+    kernel = INDICATORS.get(name)
+    if kernel is None or not set(params) <= kernel[2]:
+        return None
+    function, columns, _ = kernel
+    return function(*(np.asarray(data[column]) for column in columns), **params)
+
+
+# -----------------Grids-----------------#
+
+def grid_entries(price, atr_value, grid_levels, entry_atr_factor, pip_location):
+    """Entry prices and sides (buys from the middle level up) of every AdvancedGridStrategy level."""
+    levels = np.arange(grid_levels)
+    entries = np.round(price + atr_value * entry_atr_factor * (levels - grid_levels / 2), pip_location)
+    return entries, levels >= grid_levels / 2
@@ -1,35 +1,81 @@
 from oandapyV20 import API
 from oandapyV20.endpoints import accounts
 
-from src.database_functions import set_instruments_table, fetch_historical_data, get_instrument_list
+from src.database_functions import set_instruments_table, fetch_historical_data, get_instrument_list, \
+    set_accounts_table, get_cached_account_ids, has_cached_instruments, get_instrument_value, fetch_historical_batch
 
-from tools.my_tools import compute_indicator
-import pandas_ta as ta
+from tools.my_tools import PhaseTimer
 
+from datetime import timedelta
 import logging
+import threading
 
-from src.grid_bot import GridBot
+from src.grid_orchestrator import GridOrchestrator
 
 from src.trend_bot import TrendingBot
 
 from src.stream_handler import StreamHandler
 
+from src.scheduler import BarCloseTrigger, WeeklyTrigger, IntervalTrigger
+
+from src.indicator_store import IndicatorStore, IndicatorSpec
+
+from src.risk_engine import RiskEngine
+
+from src.grid_simulator import GridSimulator
+
+from src.portfolio_backtest import PortfolioBacktest
+
+from src.profiler import spanned, start_profiling
+
+from src.tracing import start_tracing
+
+from src.order_validator import order_validator
+
+from src.screener import InstrumentScreener
+
+from src.correlation import CorrelationEngine
+
+from src.grid_reconciler import tagged_orders
+
+from src.state_store import StateStore
+
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s : %(message)s')
 
 
 
 class MainBot:
-    def __init__(self, access_token, environment="demo"):
+    def __init__(self, access_token, environment="demo", fast_start=False, account_id=None, market_data=None,
+                 profile=False, trace=False):
+        if profile:
+            start_profiling()  # Sampled stacks and scan/fetch/indicator/order spans, see src/profiler.py
+        if trace:
+            start_tracing()  # Tick-to-order stage latencies of every stream event, see src/tracing.py
+        self.startup_timer = PhaseTimer()
+        self.requested_account_id = account_id  # Sub-account run by a Supervisor worker, primary account otherwise
+        self.market_data = market_data  # Shared MarketDataService proxy when run by a Supervisor
+        self.indicator_store = IndicatorStore(access_token)
         self.max_grids = 1
+        self.max_grid_workers = 8
+        self.grid_orchestrator = None
+        self.market_cache = None
+        self.risk_engine = None
         self.max_trenders = 1
-        self.api = API(access_token=access_token, environment=environment)
+        with self.startup_timer.phase('api'):
+            self.api = API(access_token=access_token, environment=environment)
         self.access_token = access_token
-        self.account_id = self.get_primary_account_id()
-        self.set_account_instruments()
-        self.viable_instruments_for_grid = []
-        self.viable_instruments_for_trending = []
-
+        self.account_id = None
+        self.refresh_thread = None
+        if fast_start and self.load_cached_account():
+            # Start from the local DB and bring it up to date without blocking the strategies
+            self.refresh_thread = threading.Thread(target=self.refresh_account_metadata, name='metadata-refresh',
+                                                   daemon=True)
+            self.refresh_thread.start()
+        else:
+            self.refresh_account_metadata()
+        # Checkpoint of the screener results and every grid, restored by run_strategies after a restart
+        self.state_store = StateStore(f"data/state_{self.account_id}.json")
         self.grid_amount = 0.5  # Amount of the account balance to be used for grid trading
         self.trending_amount = 0.5  # Amount of the account balance to be used for trending trading
         self.chop_filters = {"high": 61.8, "low": 38.2}
@@ -37,6 +83,35 @@ class MainBot:
         self.bb_settings = {"length": 20, "std_dev": 2}
         self.bb_filters = {"high": 0.8, "low": 0.2}
         self.fetch_settings = {"granularity": 'H1', "count": 30}
+        # Kept between scans, ranked by BB %B from low to high
+        self.screener = InstrumentScreener(self.chop_filters, self.bb_filters)
+        self.viable_instruments_for_grid = self.screener.grid
+        self.viable_instruments_for_trending = self.screener.trending
+        self.correlation_settings = {
+            "window": 500,  # Bars of returns of the fetch granularity
+            "max_correlation": 0.7,  # Absolute return correlation above which a grid candidate is passed over
+        }
+        self.correlation = CorrelationEngine(self.fetch_settings['granularity'], self.correlation_settings['window'])
+        self.schedule_settings = {
+            "rescan_granularity": 'H1',  # Rescan instruments on every bar close of this granularity
+            "atr_change_threshold": 0.2,  # Re-check a grid when its ATR moved by more than this fraction
+            "reset_weekday": 6,  # Weekly grid reset, Sunday before the market opens
+            "reset_hour": 21,
+        }
+
+        self.risk_settings = {
+            "max_margin_fraction": 0.8,  # Margin used plus resting orders, as a fraction of NAV
+            "max_instrument_exposure": None,  # Notional per instrument as a fraction of NAV, None for no limit
+            "sync_minutes": 5,  # Re-read the account to pick up fills of resting orders
+        }
+
+        self.grid_simulation = {
+            "enabled": False,  # Simulate every grid before GridBot places its orders
+            "paths": 20000,
+            "horizon": 168,  # Bars of the grid granularity (H1) simulated after placement
+            "block_size": 24,
+            "max_margin_call_probability": 0.01,  # Grids above this are not deployed
+        }
 
         self.grid_settings = {
             "order_limit": 5,
@@ -45,11 +120,70 @@ class MainBot:
             "entry_atr_factor": 0.25,  # ATR factor for entry
             "order_size_percent": 3
         }
+        logging.info(f"MainBot started in {self.startup_timer.report()}")
+
+    def load_cached_account(self):
+        with self.startup_timer.phase('cached_metadata'):
+            account_ids = get_cached_account_ids()
+            if not account_ids or not has_cached_instruments():
+                logging.info("No cached account metadata, falling back to a blocking start")
+                return False
+            self.account_id = self.requested_account_id or account_ids[0]
+        return True
+
+    def refresh_account_metadata(self):
+        # With fast_start this runs next to the startup jobs: the account they already run on is never switched
+        # (a new primary account is cached for the next start), and the instruments are upserted in a single
+        # transaction, so readers see either the cached or the refreshed table
+        with self.startup_timer.phase('account_list'):
+            account_id = self.requested_account_id or self.get_primary_account_id()
+        if self.account_id is None:
+            self.account_id = account_id
+        elif account_id != self.account_id:
+            logging.warning(f"Primary account is now {account_id}, running on {self.account_id} until restarted")
+        with self.startup_timer.phase('account_instruments'):
+            self.set_account_instruments()
+        logging.info(f"Account metadata refreshed ({self.startup_timer.report()})")
 
     def get_available_balance(self):
-        response = self.api.request(accounts.AccountDetails(self.account_id))
-        logging.info(f"Available balance: {response['account']['marginAvailable']}")
-        return float(response['account']['marginAvailable'])
+        # One AccountDetails request refreshes the whole risk state. The broker's marginAvailable is the
+        # balance; the engine's incremental figure only serves pre-trade checks between syncs
+        if self.risk_engine is None:
+            self.risk_engine = RiskEngine(self.api, self.account_id, self.market_cache,
+                                          self.risk_settings['max_margin_fraction'],
+                                          self.risk_settings['max_instrument_exposure'])
+        available_balance = float(self.risk_engine.sync()['marginAvailable'])
+        logging.info(f"Available balance: {available_balance}")
+        return available_balance
+
+    def simulate_grid_settings(self, instrument, candidates=None):
+        """Monte Carlo report per grid_settings candidate (the current settings by default) for an instrument."""
+        simulator = GridSimulator.from_store(instrument, access_token=self.access_token,
+                                             paths=self.grid_simulation['paths'],
+                                             horizon=self.grid_simulation['horizon'],
+                                             block_size=self.grid_simulation['block_size'])
+        margin_rate = get_instrument_value(instrument, 'marginRate')
+        return simulator.run(candidates or [self.grid_settings], self.funds_available_for_grid,
+                             margin_rate=float(margin_rate) if margin_rate else 0.0333)
+
+    def backtest_portfolio(self, instruments=None, start=None, end=None, cash=None):
+        """
+        Backtest the grids of several instruments (the ranked grid candidates by default) together on the
+        stored bars between start and end (epoch ns), sharing one account of cash (the balance by default).
+        """
+        instruments = instruments or [instrument for instrument, _ in
+                                      self.viable_instruments_for_grid.ranked()[:self.max_grids]]
+        # Live entries are placed a full ATR from the price
+        backtest = PortfolioBacktest.from_store(instruments, self.fetch_settings['granularity'], start, end,
+                                                grid_settings=dict(self.grid_settings, entry_atr_factor=1.0),
+                                                cash=cash or self.get_available_balance(),
+                                                grid_amount=self.grid_amount,
+                                                max_margin_fraction=self.risk_settings['max_margin_fraction'])
+        return backtest.run()
+
+    def sync_risk(self):
+        if self.risk_engine is not None:
+            self.risk_engine.sync()
 
 
     def set_available_funds(self):
@@ -62,40 +196,59 @@ class MainBot:
         r = accounts.AccountInstruments(accountID=self.account_id)
         response = self.api.request(r)
         set_instruments_table(response.get('instruments'))
+        order_validator.clear()
         logging.info(f"Account instruments set")
 
     def get_primary_account_id(self):
         accounts_response = self.api.request(accounts.AccountList())
+        set_accounts_table([account['id'] for account in accounts_response['accounts']])
         return accounts_response['accounts'][0]['id']
 
+    def get_indicator(self, instrument, indicator, **params):
+        # Under a Supervisor the shared market-data service serves indicators for every account
+        if self.market_data is not None:
+            return self.market_data.compute_indicator(instrument, self.fetch_settings['granularity'],
+                                                      self.fetch_settings['count'], indicator, **params)
+        return self.indicator_store.get_series(instrument, self.fetch_settings['granularity'],
+                                               IndicatorSpec(indicator, **params), self.fetch_settings['count'])
+
+    def get_latest_bar_time(self, instrument):
+        # A one-bar window, which also pulls in bars completed since the last refresh
+        granularity = self.fetch_settings['granularity']
+        if self.market_data is not None:
+            batch = self.market_data.fetch_bars(instrument, granularity, 1)
+        else:
+            batch = fetch_historical_batch(instrument, granularity, 1, self.access_token)
+        return int(batch.time[-1]) if len(batch) else None
+
+    @spanned('scan')
     def evaluate_instruments(self):
-        for instrument in get_instrument_list():
-            data = fetch_historical_data(instrument=instrument, **self.fetch_settings, access_token=self.access_token)
-            chop_value = compute_indicator(data=data, indicator_func=ta.chop, include_volume=False,
-                                           length=self.chop_settings['length'])[-1]
-
-            bb_perc = compute_indicator(data=data, indicator_func=ta.bbands, include_volume=False, length=self.bb_settings['length'],
-                                     std=self.bb_settings['std_dev'])[-1][4]
-            # bb_perc = (bband[-1][4])  # Bollinger Bands Percentage
-
-            # Skip instrument if bb_perc is higher than the filter's high threshold
-            if bb_perc > self.bb_filters['high']:
+        instruments = get_instrument_list()
+        self.screener.retain(instruments)
+        evaluated = 0
+        latest_time = None
+        for instrument in instruments:
+            # Only instruments with a new complete bar since their last evaluation are recomputed
+            bar_time = self.get_latest_bar_time(instrument)
+            if bar_time is not None and (latest_time is None or bar_time > latest_time):
+                latest_time = bar_time
+            if not self.screener.is_stale(instrument, bar_time):
                 continue
+            chop_value = self.get_indicator(instrument, 'chop', length=self.chop_settings['length'])[-1]
 
-            # Add instrument to the respective list along with its bb_perc
-            if chop_value > self.chop_filters['high']:
-                self.viable_instruments_for_grid.append((instrument, bb_perc))
-                logging.info(f"Instrument: {instrument} added as instrument for grid, Last CHOP Value: {chop_value}")
-            elif chop_value < self.chop_filters['low']:
-                self.viable_instruments_for_trending.append((instrument, bb_perc))
-                logging.info(
-                    f"Instrument: {instrument} added as instrument for trending, Last CHOP Value: {chop_value}")
+            bb_perc = self.get_indicator(instrument, 'bbands', length=self.bb_settings['length'],
+                                         std=self.bb_settings['std_dev'])[-1][4]
+            # bb_perc = (bband[-1][4])  # Bollinger Bands Percentage
 
-        # Sort the lists by bb_perc value from low to high
-        self.viable_instruments_for_grid.sort(key=lambda x: x[1])
-        self.viable_instruments_for_trending.sort(key=lambda x: x[1])
+            self.screener.update(instrument, bar_time, chop_value, bb_perc)
+            evaluated += 1
+        logging.info(f"Re-evaluated {evaluated} of {len(instruments)} instruments")
+        if evaluated:
+            self.state_store.set('screener', self.screener.state())
+        # The latest bars were just pulled in for every instrument, push them into the return correlations
+        self.correlation.refresh(instruments, latest_time)
 
-        # Logging the sorted lists
+        # Logging the ranked candidates
         for instrument, bb_perc in self.viable_instruments_for_grid:
             logging.info(f"Grid Instrument: {instrument}, BB_PERC: {bb_perc}")
         for instrument, bb_perc in self.viable_instruments_for_trending:
@@ -103,25 +256,102 @@ class MainBot:
 
     def run_strategies(self):
         self.set_available_funds()
+        if self.resume_strategies():
+            logging.info("Strategies resumed from the state checkpoint")
+            return
         self.evaluate_instruments()
         self.run_grid_strategy()
         # self.run_trending_strategy()
         logging.info("Strategies run")
-        self.run_stream()
 
 
+    def restore_state(self):
+        """Startup job when run_strategies is not scheduled: resume the checkpointed screener and grids."""
+        self.set_available_funds()
+        if self.resume_strategies():
+            logging.info("Strategies resumed from the state checkpoint")
+
+    def resume_strategies(self):
+        """
+        Restore the screener and the grids from the state checkpoint instead of rescanning. The grids are
+        checked against the AccountDetails that set_available_funds already read, one request for all of
+        them. Returns True when grids were resumed.
+        """
+        state = self.state_store.load()
+        self.screener.restore(state.get('screener'))
+        grids = state.get('grids') or {}
+        if not grids:
+            return False
+        account = self.risk_engine.account or self.risk_engine.sync()
+        live = tagged_orders(account.get('orders', []))
+        held = {position['instrument'] for position in account.get('positions', [])
+                if float(position['long']['units']) or float(position['short']['units'])}
+        for instrument in set(live) - set(grids):
+            logging.warning(f"Grid orders for {instrument} are not in the state checkpoint, leaving them alone")
+        resumed = {instrument: (grid_state, live.get(instrument, {}), instrument in held)
+                   for instrument, grid_state in grids.items()}
+        for instrument in grids:
+            self.viable_instruments_for_grid.remove(instrument)
+        self.grid_orchestrator = GridOrchestrator(self, max_workers=self.max_grid_workers)
+        self.grid_orchestrator.start(list(grids), resumed)
+        logging.info(f"Grid strategy resumed for {list(grids)}")
+        return True
+
+    def select_grid_instruments(self):
+        """
+        Up to max_grids grid candidates, lowest BB %B first, passing over candidates whose returns correlate
+        with an instrument already picked by more than max_correlation.
+        """
+        candidates = [instrument for instrument, _ in self.viable_instruments_for_grid.ranked()]
+        picks = []
+        while candidates and len(picks) < self.max_grids:
+            pick = self.correlation.next_pick(candidates, picks, self.correlation_settings['max_correlation'])
+            candidates.remove(pick)
+            self.viable_instruments_for_grid.remove(pick)
+            picks.append(pick)
+        return picks
+
     def run_grid_strategy(self):
-        for i in range(self.max_grids):
-            if self.viable_instruments_for_grid:
-                instrument = self.viable_instruments_for_grid.pop(0)[0]
-                grid_bot = GridBot(self, instrument)
-                grid_bot.run_strategy()
-                logging.info(f"Grid strategy run for {instrument}")
+        instruments = self.select_grid_instruments()
+        self.state_store.set('grids', {})  # The grids checkpoint themselves as they are set up
+        self.grid_orchestrator = GridOrchestrator(self, max_workers=self.max_grid_workers)
+        self.grid_orchestrator.start(instruments)
+        logging.info(f"Grid strategy run for {instruments}")
+
+    def check_grids_on_atr_change(self):
+        if not self.grid_orchestrator:
+            return
+        threshold = self.schedule_settings['atr_change_threshold']
+        for instrument, grid_bot in self.grid_orchestrator.bots.items():
+            if not grid_bot.grid_levels:
+                continue
+            grid_atr = grid_bot.grid_levels['atr']
+            atr = grid_bot.get_recent_atr()
+            if abs(atr - grid_atr) > threshold * grid_atr:
+                logging.info(f"ATR for {instrument} moved from {grid_atr} to {atr}, re-checking grid")
+                self.grid_orchestrator.dispatch(instrument, grid_bot.reset_grid, keep=True)
+
+    def reset_grids(self):
+        if not self.grid_orchestrator:
+            return
+        for instrument, grid_bot in self.grid_orchestrator.bots.items():
+            self.grid_orchestrator.dispatch(instrument, grid_bot.reset_grid, keep=True)
+        logging.info("Weekly grid reset dispatched")
+
+    def schedule_jobs(self, scheduler):
+        granularity = self.schedule_settings['rescan_granularity']
+        scheduler.add_job('rescan_instruments', self.evaluate_instruments, BarCloseTrigger(granularity))
+        scheduler.add_job('check_grid_atr', self.check_grids_on_atr_change, BarCloseTrigger(granularity, delay_seconds=5))
+        scheduler.add_job('reset_grids', self.reset_grids,
+                          WeeklyTrigger(self.schedule_settings['reset_weekday'], self.schedule_settings['reset_hour']),
+                          misfire_grace=3600)
+        scheduler.add_job('sync_risk', self.sync_risk,
+                          IntervalTrigger(timedelta(minutes=self.risk_settings['sync_minutes'])))
 
     def run_trending_strategy(self):
         for i in range(self.max_trenders):
             if self.viable_instruments_for_trending:
-                instrument = self.viable_instruments_for_trending.pop(0)[0]
+                instrument = self.viable_instruments_for_trending.pop()[0]
                 trending_bot = TrendingBot(self, instrument)
                 trending_bot.run_strategy()
                 logging.info(f"Trending strategy run for {instrument}")
@@ -0,0 +1,78 @@
+from oandapyV20.endpoints import pricing
+
+from src.database_functions import get_instrument_value, parse_iso8601_date
+
+import logging
+import threading
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s : %(message)s')
+
+
+class MarketDataCache:
+    """Quote, conversion factor and instrument spec cache shared by every bot of a MainBot."""
+
+    def __init__(self, api, account_id):
+        self.api = api
+        self.account_id = account_id
+        self._lock = threading.RLock()
+        self.quotes = {}  # instrument -> {"bid", "ask", "mid", "time"}
+        self.conversion_factors = {}  # instrument -> (positive, negative)
+        self.instrument_specs = {}  # (instrument, attribute) -> value
+
+    def update_from_price(self, msg):
+        """Update the cache from a PRICE message (pricing stream or PricingInfo)."""
+        instrument = msg.get('instrument')
+        if not instrument or not msg.get('bids') or not msg.get('asks'):
+            return None
+        bid = float(msg['bids'][0]['price'])
+        ask = float(msg['asks'][0]['price'])
+        quote = {"bid": bid, "ask": ask, "mid": (bid + ask) / 2, "time": parse_iso8601_date(msg['time'])}
+        with self._lock:
+            self.quotes[instrument] = quote
+            factors = msg.get('quoteHomeConversionFactors')
+            if factors:
+                self.conversion_factors[instrument] = (float(factors['positiveUnits']),
+                                                       float(factors['negativeUnits']))
+        return quote
+
+    def refresh_prices(self, instruments):
+        """Refresh quotes and conversion factors for many instruments with a single PricingInfo request."""
+        if not instruments:
+            return
+        response = self.api.request(
+            pricing.PricingInfo(accountID=self.account_id, params={"instruments": ",".join(instruments)}))
+        for price in response.get('prices', []):
+            self.update_from_price(price)
+        logging.info(f"Refreshed prices for {len(instruments)} instruments")
+
+    def get_quote(self, instrument):
+        with self._lock:
+            quote = self.quotes.get(instrument)
+        if quote is None:
+            self.refresh_prices([instrument])
+            with self._lock:
+                quote = self.quotes.get(instrument)
+        return quote
+
+    def get_mid(self, instrument):
+        quote = self.get_quote(instrument)
+        return quote['mid'] if quote else None
+
+    def get_conversion_factors(self, instrument):
+        with self._lock:
+            factors = self.conversion_factors.get(instrument)
+        if factors is None:
+            self.refresh_prices([instrument])
+            with self._lock:
+                factors = self.conversion_factors.get(instrument)
+        return factors
+
+    def get_instrument_value(self, instrument, attribute):
+        key = (instrument, attribute)
+        with self._lock:
+            if key in self.instrument_specs:
+                return self.instrument_specs[key]
+        value = get_instrument_value(instrument, attribute)
+        with self._lock:
+            self.instrument_specs[key] = value
+        return value
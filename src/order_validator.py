@@ -0,0 +1,109 @@
+"""
+Local pre-trade validation of order bodies against the cached instrument specs.
+
+Prices and distances are rounded to displayPrecision and units to tradeUnitsPrecision; orders
+that would be rejected anyway (size under minimumTradeSize or over maximumOrderUnits, trailing stop
+distance outside its bounds) raise ValueError before a request is sent. Specs are read once per
+instrument from the instruments table and kept in memory, so a check costs a few microseconds.
+"""
+import logging
+import threading
+
+from src.database_functions import get_instrument_row
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s : %(message)s')
+
+PRICE_FIELDS = ('price', 'priceBound')
+EXIT_FIELDS = ('takeProfitOnFill', 'stopLossOnFill', 'guaranteedStopLossOnFill', 'trailingStopLossOnFill')
+
+
+class InstrumentConstraints:
+    __slots__ = ('display_precision', 'units_precision', 'minimum_trade_size', 'maximum_order_units',
+                 'minimum_trailing_distance', 'maximum_trailing_distance')
+
+    def __init__(self, row):
+        self.display_precision = int(row['displayPrecision'])
+        self.units_precision = int(row['tradeUnitsPrecision'] or 0)
+        self.minimum_trade_size = float(row['minimumTradeSize'] or 0)
+        self.maximum_order_units = float(row['maximumOrderUnits']) if row['maximumOrderUnits'] else None
+        self.minimum_trailing_distance = float(row['minimumTrailingStopDistance'] or 0)
+        self.maximum_trailing_distance = (float(row['maximumTrailingStopDistance'])
+                                          if row['maximumTrailingStopDistance'] else None)
+
+    def format_price(self, value):
+        return f"{float(value):.{self.display_precision}f}"
+
+    def format_units(self, units):
+        return f"{round(units, self.units_precision):.{self.units_precision}f}"
+
+
+class OrderValidator:
+    def __init__(self):
+        self.constraints = {}  # instrument -> InstrumentConstraints
+        self._lock = threading.Lock()
+
+    def get_constraints(self, instrument):
+        constraints = self.constraints.get(instrument)
+        if constraints is None:
+            row = get_instrument_row(instrument)
+            if row is None:
+                raise ValueError(f"Order validation failed: no instrument specs for {instrument}")
+            with self._lock:
+                constraints = self.constraints[instrument] = InstrumentConstraints(row)
+        return constraints
+
+    def clear(self):
+        """Forget the cached specs, after the instruments table was refreshed."""
+        with self._lock:
+            self.constraints.clear()
+
+    def check_trailing_distance(self, instrument, distance):
+        constraints = self.get_constraints(instrument)
+        distance = float(distance)
+        if distance < constraints.minimum_trailing_distance:
+            raise ValueError(f"Trailing stop loss distance too low: {distance} "
+                             f"(minimum {constraints.minimum_trailing_distance})")
+        if constraints.maximum_trailing_distance is not None and distance > constraints.maximum_trailing_distance:
+            raise ValueError(f"Trailing stop loss distance too high: {distance} "
+                             f"(maximum {constraints.maximum_trailing_distance})")
+        return constraints.format_price(distance)
+
+    def validate(self, order_data):
+        """Return a normalized copy of an order body, or raise ValueError with the reason it would be rejected."""
+        instrument = order_data['instrument']
+        constraints = self.get_constraints(instrument)
+        order = dict(order_data)
+
+        units = round(float(order['units']), constraints.units_precision)
+        if abs(units) < max(constraints.minimum_trade_size, 10 ** -constraints.units_precision):
+            raise ValueError(f"Order validation failed: {units} {instrument} units is below the minimum trade "
+                             f"size {constraints.minimum_trade_size}")
+        if constraints.maximum_order_units is not None and abs(units) > constraints.maximum_order_units:
+            raise ValueError(f"Order validation failed: {units} {instrument} units is above the maximum "
+                             f"{constraints.maximum_order_units}")
+        order['units'] = constraints.format_units(units)
+
+        for field in PRICE_FIELDS:
+            if field in order:
+                if float(order[field]) <= 0:
+                    raise ValueError(f"Order validation failed: {field} {order[field]} is not positive")
+                order[field] = constraints.format_price(order[field])
+
+        for field in EXIT_FIELDS:
+            if order.get(field):
+                exit_order = dict(order[field])
+                if 'price' in exit_order:
+                    exit_order['price'] = constraints.format_price(exit_order['price'])
+                if 'distance' in exit_order:
+                    if field == 'trailingStopLossOnFill':
+                        try:
+                            exit_order['distance'] = self.check_trailing_distance(instrument, exit_order['distance'])
+                        except ValueError as e:
+                            raise ValueError(f"Order validation failed: {e}")
+                    else:
+                        exit_order['distance'] = constraints.format_price(exit_order['distance'])
+                order[field] = exit_order
+        return order
+
+
+order_validator = OrderValidator()
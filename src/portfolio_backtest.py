@@ -0,0 +1,209 @@
+"""
+Backtest of ATR grids on many instruments at once, sharing one account and margin pool.
+
+The bars of every instrument are read from the bars store (bid/ask when stored, see
+query_bars_range) and aligned on the union of their times into (bars, instruments) arrays. Each step
+then moves all instruments together with vector operations: stops and take profits of open legs,
+fills of the resting entries (accepted while the shared margin allows), re-centering, and
+mark-to-market of the account. Like GridBot, each grid has one long limit entry below the price and
+one short entry above it, ATR-spaced, each sent with a stop loss and take profit sl_atr_factor and
+tp_atr_factor ATRs from its entry (GridBot.desired_orders), and is re-centered once price leaves its
+band or the grid is recenter_bars old. Fills on a bar's
+open or inside its range are taken at the limit price (or the better open), exits of a bar that
+touches both the stop and the take profit at the stop.
+"""
+import logging
+import time
+
+import numpy as np
+
+from src.database_functions import query_bars_range, get_instrument_value
+from src.grid_simulator import MARGIN_CLOSEOUT_FRACTION
+from src.kernels import atr
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s : %(message)s')
+
+ALIGNED_FIELDS = ('close', 'bid_open', 'bid_high', 'bid_low', 'bid_close', 'ask_open', 'ask_high', 'ask_low',
+                  'ask_close')
+
+
+def align(batches):
+    """Merge per-instrument CandleBatches onto their union of times: (times, {field: (bars, instruments) array})."""
+    times = np.unique(np.concatenate([batch.time for batch in batches]))
+    arrays = {field: np.full((len(times), len(batches)), np.nan) for field in ALIGNED_FIELDS + ('atr',)}
+    for i, batch in enumerate(batches):
+        rows = np.searchsorted(times, batch.time)
+        for field in ALIGNED_FIELDS:
+            arrays[field][rows, i] = batch[field] if batch.has_bid_ask or field == 'close' \
+                else batch[field.split('_')[1]]
+        arrays['atr'][rows, i] = atr(batch.high, batch.low, batch.close)
+    return times, arrays
+
+
+def _forward_fill(values):
+    # Last known value down each column, for valuing instruments on steps where they have no bar (0 before the first)
+    index = np.where(np.isnan(values), 0, np.arange(len(values))[:, None])
+    np.maximum.accumulate(index, axis=0, out=index)
+    return np.nan_to_num(values[index, np.arange(values.shape[1])])
+
+
+class PortfolioBacktest:
+    def __init__(self, batches, instruments, grid_settings, cash=10000, grid_amount=0.5, allocations=None,
+                 margin_rates=None, conversions=None, max_margin_fraction=0.8, recenter_bars=168):
+        self.instruments = list(instruments)
+        self.times, self.arrays = align(batches)
+        self.grid_settings = grid_settings
+        self.cash = cash
+        self.grid_amount = grid_amount  # Of the balance, split across the grids by allocations
+        weights = np.array([(allocations or {}).get(instrument, 1.0) for instrument in self.instruments])
+        self.allocations = weights / weights.sum()
+        self.margin_rates = np.array([(margin_rates or {}).get(instrument, 0.0333) for instrument in self.instruments])
+        # Quote to home currency; 1.0 for instruments quoted in the account currency
+        self.conversions = np.array([(conversions or {}).get(instrument, 1.0) for instrument in self.instruments])
+        self.max_margin_fraction = max_margin_fraction
+        self.recenter_bars = recenter_bars
+
+    @classmethod
+    def from_store(cls, instruments, granularity='H1', start=None, end=None, **kwargs):
+        """Bars of every instrument between start and end (epoch ns) from the bars table."""
+        batches = [query_bars_range(instrument, granularity, start, end, bid_ask=True) for instrument in instruments]
+        if 'margin_rates' not in kwargs:
+            margin_rates = {instrument: get_instrument_value(instrument, 'marginRate') for instrument in instruments}
+            kwargs['margin_rates'] = {instrument: float(rate) for instrument, rate in margin_rates.items() if rate}
+        return cls(batches, instruments, **kwargs)
+
+    def run(self):
+        started = time.perf_counter()
+        a = self.arrays
+        steps, count = a['close'].shape
+        has_bar = ~np.isnan(a['bid_low'])
+        mark_close = _forward_fill(a['close'])
+        mark_bid, mark_ask = _forward_fill(a['bid_close']), _forward_fill(a['ask_close'])
+        atr = np.where(mark_close > 0, _forward_fill(a['atr']), np.nan)
+        settings = self.grid_settings
+        units_per_fund = self.conversions / settings['order_limit']
+
+        balance = float(self.cash)
+        # Resting entries and open legs per instrument, NaN/0 when there is none
+        long_entry, short_entry = np.full(count, np.nan), np.full(count, np.nan)
+        entry_units = np.zeros(count)
+        long_units, short_units = np.zeros(count), np.zeros(count)
+        long_price, short_price = np.zeros(count), np.zeros(count)
+        long_stop, long_take = np.full(count, np.nan), np.full(count, np.nan)
+        short_stop, short_take = np.full(count, np.nan), np.full(count, np.nan)
+        band_low, band_high = np.full(count, np.nan), np.full(count, np.nan)
+        placed_at = np.full(count, -self.recenter_bars)
+        realized = np.zeros(count)
+        trades = np.zeros(count, dtype=np.int64)
+        equity = np.empty(steps)
+        margin_curve = np.empty(steps)
+        margin_calls = 0
+        sl_factor, tp_factor, entry_factor = (settings['sl_atr_factor'], settings['tp_atr_factor'],
+                                              settings['entry_atr_factor'])
+
+        for t in range(steps):
+            bar = has_bar[t]
+            bid_open, bid_high, bid_low = a['bid_open'][t], a['bid_high'][t], a['bid_low'][t]
+            ask_open, ask_high, ask_low = a['ask_open'][t], a['ask_high'][t], a['ask_low'][t]
+
+            # Exits of open legs: longs sell at the bid, shorts buy back at the ask
+            long_stopped = (long_units > 0) & (bid_low <= long_stop)
+            long_exit = long_stopped | ((long_units > 0) & (bid_high >= long_take))
+            if long_exit.any():
+                exit_price = np.where(long_stopped, np.minimum(long_stop, bid_open), np.maximum(long_take, bid_open))
+                pnl = np.where(long_exit, long_units * (exit_price - long_price) * self.conversions, 0.0)
+                balance += pnl.sum()
+                realized += pnl
+                long_units[long_exit] = 0.0
+            short_stopped = (short_units > 0) & (ask_high >= short_stop)
+            short_exit = short_stopped | ((short_units > 0) & (ask_low <= short_take))
+            if short_exit.any():
+                exit_price = np.where(short_stopped, np.maximum(short_stop, ask_open),
+                                      np.minimum(short_take, ask_open))
+                pnl = np.where(short_exit, short_units * (short_price - exit_price) * self.conversions, 0.0)
+                balance += pnl.sum()
+                realized += pnl
+                short_units[short_exit] = 0.0
+
+            # Entry fills, accepted in instrument order while the shared margin allows them
+            close = mark_close[t]
+            net_units = np.abs(long_units - short_units)
+            margin_used = (net_units * close * self.conversions * self.margin_rates).sum()
+            unrealized = (long_units * (mark_bid[t] - long_price) + short_units * (short_price - mark_ask[t])) \
+                * self.conversions
+            nav = balance + unrealized.sum()
+            long_fill = (long_units == 0) & (ask_low <= long_entry)
+            short_fill = (short_units == 0) & (bid_high >= short_entry)
+            if long_fill.any() or short_fill.any():
+                # A fill against an open leg of the other side nets it and needs no extra margin
+                added = np.where(long_fill, entry_units, 0.0) - np.where(short_fill, entry_units, 0.0)
+                extra_margin = np.maximum(np.abs(long_units - short_units + added) - net_units, 0.0) \
+                    * close * self.conversions * self.margin_rates
+                accepted = np.cumsum(extra_margin) <= self.max_margin_fraction * nav - margin_used
+                long_fill &= accepted
+                short_fill &= accepted
+                long_price = np.where(long_fill, np.minimum(long_entry, ask_open), long_price)
+                long_units = np.where(long_fill, entry_units, long_units)
+                long_stop = np.where(long_fill, long_entry - sl_factor * atr[t], long_stop)
+                long_take = np.where(long_fill, long_entry + tp_factor * atr[t], long_take)
+                short_price = np.where(short_fill, np.maximum(short_entry, bid_open), short_price)
+                short_units = np.where(short_fill, entry_units, short_units)
+                short_stop = np.where(short_fill, short_entry + sl_factor * atr[t], short_stop)
+                short_take = np.where(short_fill, short_entry - tp_factor * atr[t], short_take)
+                trades += long_fill.astype(np.int64) + short_fill.astype(np.int64)
+                long_entry[long_fill] = np.nan
+                short_entry[short_fill] = np.nan
+
+            # Mark to market, and the margin closeout of everything when NAV falls too far
+            unrealized = (long_units * (mark_bid[t] - long_price) + short_units * (short_price - mark_ask[t])) \
+                * self.conversions
+            nav = balance + unrealized.sum()
+            margin_used = (np.abs(long_units - short_units) * close * self.conversions * self.margin_rates).sum()
+            if margin_used and nav < MARGIN_CLOSEOUT_FRACTION * margin_used:
+                balance = nav
+                realized += unrealized
+                long_units[:], short_units[:] = 0.0, 0.0
+                long_entry[:], short_entry[:] = np.nan, np.nan
+                margin_calls += 1
+                logging.info(f"Margin closeout at step {t}, NAV {nav:.2f}")
+
+            # Re-center grids that price left, that are recenter_bars old, or that have nothing resting
+            idle = np.isnan(long_entry) & np.isnan(short_entry) & (long_units == 0) & (short_units == 0)
+            recenter = bar & (atr[t] > 0) & (idle | (close < band_low) | (close > band_high)
+                                                  | (t - placed_at >= self.recenter_bars))
+            if recenter.any():
+                distance = entry_factor * atr[t]
+                long_entry = np.where(recenter & (long_units == 0), close - distance, long_entry)
+                short_entry = np.where(recenter & (short_units == 0), close + distance, short_entry)
+                band_low = np.where(recenter, close - distance - sl_factor * atr[t], band_low)
+                band_high = np.where(recenter, close + distance + sl_factor * atr[t], band_high)
+                funds = balance * self.grid_amount * self.allocations
+                entry_units = np.where(recenter, np.floor(funds * units_per_fund), entry_units)
+                placed_at = np.where(recenter, t, placed_at)
+
+            equity[t] = nav
+            margin_curve[t] = margin_used
+
+        elapsed = time.perf_counter() - started
+        instrument_bars = int(has_bar.sum())
+        peak = np.maximum.accumulate(equity)
+        report = {
+            "start": int(self.times[0]) if steps else None,
+            "end": int(self.times[-1]) if steps else None,
+            "final_nav": float(equity[-1]) if steps else float(self.cash),
+            "return": float(equity[-1] / self.cash - 1) if steps else 0.0,
+            "max_drawdown": float(((peak - equity) / peak).max()) if steps else 0.0,
+            "max_margin_used": float(margin_curve.max()) if steps else 0.0,
+            "margin_calls": margin_calls,
+            "trades": int(trades.sum()),
+            "instruments": {instrument: {"realized_pl": float(realized[i]), "trades": int(trades[i])}
+                            for i, instrument in enumerate(self.instruments)},
+            "instrument_bars": instrument_bars,
+            "elapsed_s": elapsed,
+            "instrument_bars_per_s": instrument_bars / elapsed if elapsed else None,
+        }
+        self.equity, self.margin_used = equity, margin_curve
+        logging.info(f"Portfolio backtest of {len(self.instruments)} instruments over {steps} steps: "
+                     f"NAV {report['final_nav']:.2f}, max drawdown {report['max_drawdown']:.1%}, "
+                     f"{report['instrument_bars_per_s']:,.0f} instrument-bars/s")
+        return report
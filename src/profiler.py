@@ -0,0 +1,177 @@
+"""
+Low-overhead sampling profiler for live and backtest runs.
+
+A daemon thread samples the stacks of every other thread with sys._current_frames() a few hundred
+times per second and counts them in collapsed form ("thread;[span];frame;frame count"), which
+flamegraph.pl, speedscope and inferno read directly. Named spans (scan, fetch, indicator, order...)
+are pushed on a per-thread stack, so samples are grouped under them, and their wall time is totalled.
+
+Profiles are written on stop(), on SIGUSR1, or when the command file contains 'dump'
+('reset' clears the counts, 'stop' stops sampling):
+
+    echo dump > data/profile.cmd
+    kill -USR1 <pid>
+"""
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s : %(message)s')
+
+_profiler = None  # The running SamplingProfiler, spans are free while it is None
+
+
+class SamplingProfiler:
+    def __init__(self, interval=0.005, output_dir='data/profiles', command_file='data/profile.cmd'):
+        self.interval = interval
+        self.output_dir = output_dir
+        self.command_file = command_file
+        self.stacks = Counter()
+        self.span_stats = defaultdict(lambda: [0, 0.0])  # span name -> [count, seconds]
+        self.spans = {}  # thread ident -> names of the spans it is in, outermost first
+        self.samples = 0
+        self.running = False
+        self._labels = {}  # code object -> frame label
+        self._thread = None
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._loop, name='profiler', daemon=True)
+        self._thread.start()
+        logging.info(f"Profiler sampling every {self.interval * 1000:.0f}ms, "
+                     f"'dump' to {self.command_file} or SIGUSR1 writes a profile")
+
+    def stop(self, dump=True):
+        self.running = False
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+        return self.dump() if dump and self.samples else None
+
+    def _loop(self):
+        next_command_check = 0.0
+        while self.running:
+            self.sample()
+            now = time.monotonic()
+            if now >= next_command_check:
+                self.check_command_file()
+                next_command_check = now + 1
+            time.sleep(self.interval)
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def sample(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            spans = [f"[{name}]" for name in tuple(self.spans.get(ident, ()))]
+            self.stacks[';'.join([names.get(ident, str(ident)), *spans, *stack])] += 1
+        self.samples += 1
+
+    def check_command_file(self):
+        if not os.path.exists(self.command_file):
+            return
+        with open(self.command_file) as file:
+            command = file.read().strip()
+        os.remove(self.command_file)
+        logging.info(f"Profiler command: {command}")
+        if command == 'dump':
+            self.dump()
+        elif command == 'reset':
+            self.reset()
+        elif command == 'stop':
+            self.stop()
+
+    def reset(self):
+        self.stacks.clear()
+        self.span_stats.clear()
+        self.samples = 0
+
+    def dump(self):
+        """Write the collapsed stacks and the span totals, returns the path of the stacks file."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"profile-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.folded")
+        with open(path, 'w') as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+        spans = {name: {"count": count, "seconds": seconds, "mean_ms": seconds / count * 1000}
+                 for name, (count, seconds) in sorted(self.span_stats.items(), key=lambda item: -item[1][1])}
+        with open(path.replace('.folded', '.spans.json'), 'w') as file:
+            json.dump({"samples": self.samples, "interval": self.interval, "spans": spans}, file, indent=2)
+        logging.info(f"Profile with {self.samples} samples written to {path}")
+        return path
+
+
+# -----------------Spans-----------------#
+
+@contextmanager
+def span(name):
+    profiler = _profiler
+    if profiler is None:
+        yield
+        return
+    stack = profiler.spans.setdefault(threading.get_ident(), [])
+    stack.append(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stack.pop()
+        stats = profiler.span_stats[name]
+        stats[0] += 1
+        stats[1] += time.perf_counter() - start
+
+
+def spanned(name):
+    """Decorator form of span()."""
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# -----------------Switch-----------------#
+
+def start_profiling(**kwargs):
+    """Start the process-wide profiler (once) and hook SIGUSR1 to dump it when called from the main thread."""
+    global _profiler
+    if _profiler is not None:
+        return _profiler
+    _profiler = SamplingProfiler(**kwargs)
+    _profiler.start()
+    if threading.current_thread() is threading.main_thread() and hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: _profiler and _profiler.dump())
+    return _profiler
+
+
+def stop_profiling(dump=True):
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler.stop(dump) if profiler else None
+
+
+def get_profiler():
+    return _profiler
@@ -0,0 +1,261 @@
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+import numpy as np
+
+from tools.my_tools import LazyModule
+
+pd = LazyModule('pandas')
+
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_DAY = _EPOCH.toordinal()
+_NS_PER_SECOND = 1_000_000_000
+_NS_PER_DAY = 86_400 * _NS_PER_SECOND
+
+# Bid and ask OHLC are stored as non-negative offsets from the mid OHLC (mid - bid, ask - mid) in millionths
+# of a price unit: exact for every OANDA display precision, and one or two bytes per value as SQLite integers.
+SPREAD_SCALE = 1_000_000
+BID_ASK_COLUMNS = ('bid_open', 'bid_high', 'bid_low', 'bid_close', 'ask_open', 'ask_high', 'ask_low', 'ask_close')
+
+
+# -----------------Time helpers-----------------#
+
+@lru_cache(maxsize=4096)
+def _day_to_epoch_ns(day):
+    year, month, day_of_month = int(day[0:4]), int(day[5:7]), int(day[8:10])
+    return (date(year, month, day_of_month).toordinal() - _EPOCH_DAY) * _NS_PER_DAY
+
+
+def iso_to_epoch_ns(iso_time):
+    """
+    Convert an OANDA RFC3339 time ('2024-01-02T10:00:00.000000000Z') or UNIX time ('1704189600.000000000')
+    to integer nanoseconds since the epoch, without going through datetime.
+    """
+    if 'T' not in iso_time:
+        seconds, _, fraction = iso_time.partition('.')
+        return int(seconds) * _NS_PER_SECOND + int(fraction[:9].ljust(9, '0') or 0)
+    day, _, clock = iso_time.partition('T')
+    seconds = int(clock[0:2]) * 3600 + int(clock[3:5]) * 60 + int(clock[6:8])
+    fraction = clock[9:].rstrip('Z') if len(clock) > 8 and clock[8] == '.' else ''
+    nanos = int(fraction[:9].ljust(9, '0')) if fraction else 0
+    return _day_to_epoch_ns(day) + seconds * _NS_PER_SECOND + nanos
+
+
+def iso_times_to_epoch_ns(iso_times):
+    """Vectorised iso_to_epoch_ns for a list of times, parsed by NumPy's datetime64 instead of per string."""
+    if iso_times and 'T' not in iso_times[0]:
+        return np.array([iso_to_epoch_ns(iso_time) for iso_time in iso_times], dtype=np.int64)
+    return np.array([iso_time.rstrip('Z') for iso_time in iso_times], dtype='datetime64[ns]').astype(np.int64)
+
+
+def epoch_ns_to_iso(epoch_ns):
+    """Inverse of iso_to_epoch_ns, in OANDA's nanosecond RFC3339 format."""
+    return np.datetime_as_string(np.datetime64(int(epoch_ns), 'ns'), unit='ns') + 'Z'
+
+
+def datetime_to_epoch_ns(naive_utc):
+    """Naive UTC datetime (as used across the bot) to epoch ns, without the local-timezone .timestamp()."""
+    delta = naive_utc - _EPOCH
+    return (delta.days * 86_400 + delta.seconds) * _NS_PER_SECOND + delta.microseconds * 1000
+
+
+def epoch_ns_to_datetime(epoch_ns):
+    return _EPOCH + timedelta(microseconds=int(epoch_ns) // 1000)
+
+
+# -----------------Scalar records-----------------#
+
+class Candle:
+    __slots__ = ('time', 'open', 'high', 'low', 'close', 'volume', 'complete')
+
+    def __init__(self, time, open, high, low, close, volume, complete):
+        self.time = time  # epoch ns
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.complete = complete
+
+    @classmethod
+    def from_v20(cls, entry, price='mid'):
+        prices = entry[price]
+        return cls(iso_to_epoch_ns(entry['time']), float(prices['o']), float(prices['h']), float(prices['l']),
+                   float(prices['c']), int(entry['volume']), bool(entry['complete']))
+
+    def __repr__(self):
+        return (f"Candle({epoch_ns_to_iso(self.time)}, o={self.open}, h={self.high}, l={self.low}, c={self.close}, "
+                f"v={self.volume}, complete={self.complete})")
+
+
+class Tick:
+    """Top of book from a pricing stream PRICE message."""
+    __slots__ = ('instrument', 'time', 'bid', 'ask')
+
+    def __init__(self, instrument, time, bid, ask):
+        self.instrument = instrument
+        self.time = time  # epoch ns
+        self.bid = bid
+        self.ask = ask
+
+    @classmethod
+    def from_v20(cls, msg):
+        return cls(msg['instrument'], iso_to_epoch_ns(msg['time']), float(msg['bids'][0]['price']),
+                   float(msg['asks'][0]['price']))
+
+    @property
+    def mid(self):
+        return (self.bid + self.ask) / 2
+
+    def __repr__(self):
+        return f"Tick({self.instrument}, {epoch_ns_to_iso(self.time)}, bid={self.bid}, ask={self.ask})"
+
+
+class Quote(Tick):
+    """Full PricingInfo/stream price: top of book plus closeouts and home conversion factors."""
+    __slots__ = ('closeout_bid', 'closeout_ask', 'conversion_pos', 'conversion_neg')
+
+    def __init__(self, instrument, time, bid, ask, closeout_bid, closeout_ask, conversion_pos=None,
+                 conversion_neg=None):
+        super().__init__(instrument, time, bid, ask)
+        self.closeout_bid = closeout_bid
+        self.closeout_ask = closeout_ask
+        self.conversion_pos = conversion_pos
+        self.conversion_neg = conversion_neg
+
+    @classmethod
+    def from_v20(cls, msg):
+        factors = msg.get('quoteHomeConversionFactors')
+        return cls(msg['instrument'], iso_to_epoch_ns(msg['time']), float(msg['bids'][0]['price']),
+                   float(msg['asks'][0]['price']), float(msg['closeoutBid']), float(msg['closeoutAsk']),
+                   float(factors['positiveUnits']) if factors else None,
+                   float(factors['negativeUnits']) if factors else None)
+
+
+# -----------------Batch record-----------------#
+
+class CandleBatch:
+    """
+    Struct-of-arrays form of many candles of one instrument/granularity.
+
+    Columns are NumPy arrays (time is int64 epoch ns), so the DB writer, indicators and the
+    backtester can consume a batch without building per-candle dicts or DataFrame rows. OHLC is mid;
+    batches fetched with price='BAM' also carry spread_offsets, an int32 (n, 8) array of the bid and
+    ask OHLC as SPREAD_SCALE offsets from it, read as columns through batch['bid_low'] etc.
+    """
+    __slots__ = ('time', 'open', 'high', 'low', 'close', 'volume', 'complete', 'spread_offsets')
+    columns = ('time', 'open', 'high', 'low', 'close', 'volume', 'complete')
+
+    def __init__(self, time, open, high, low, close, volume, complete, spread_offsets=None):
+        self.time = np.asarray(time, dtype=np.int64)
+        self.open = np.asarray(open, dtype=np.float64)
+        self.high = np.asarray(high, dtype=np.float64)
+        self.low = np.asarray(low, dtype=np.float64)
+        self.close = np.asarray(close, dtype=np.float64)
+        self.volume = np.asarray(volume, dtype=np.int64)
+        self.complete = np.asarray(complete, dtype=np.bool_)
+        self.spread_offsets = None if spread_offsets is None else np.asarray(spread_offsets, dtype=np.int32)
+
+    @property
+    def has_bid_ask(self):
+        return self.spread_offsets is not None
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], [], [], [], [], [])
+
+    @classmethod
+    def from_v20(cls, candles, price='mid'):
+        """price is 'mid', 'bid' or 'ask', or 'bam' for mid OHLC with the bid/ask spread offsets."""
+        count = len(candles)
+        times = [None] * count
+        volumes = np.empty(count, dtype=np.int64)
+        complete = np.empty(count, dtype=np.bool_)
+        components = ('mid', 'bid', 'ask') if price == 'bam' else (price,)
+        # Only the used fields are pulled out; times and OHLC strings are then converted in single NumPy calls
+        ohlc = []
+        for i, entry in enumerate(candles):
+            times[i] = entry['time']
+            volumes[i] = entry['volume']
+            complete[i] = entry['complete']
+            for component in components:
+                prices = entry[component]
+                ohlc += (prices['o'], prices['h'], prices['l'], prices['c'])
+        ohlc = np.array(ohlc, dtype=np.float64).reshape(count, 4 * len(components))
+        spread_offsets = None
+        if price == 'bam':
+            mid = ohlc[:, 0:4]
+            spread_offsets = np.rint(np.hstack((mid - ohlc[:, 4:8], ohlc[:, 8:12] - mid)) * SPREAD_SCALE)
+        return cls(iso_times_to_epoch_ns(times), ohlc[:, 0], ohlc[:, 1], ohlc[:, 2], ohlc[:, 3], volumes, complete,
+                   spread_offsets)
+
+    @classmethod
+    def from_candles(cls, candles):
+        if not candles:
+            return cls.empty()
+        return cls(*zip(*((c.time, c.open, c.high, c.low, c.close, c.volume, c.complete) for c in candles)))
+
+    @classmethod
+    def from_dataframe(cls, df):
+        times = df['time'].to_numpy()
+        if times.dtype.kind in 'OUT':
+            times = iso_times_to_epoch_ns(times.tolist())
+        batch = cls(times, df['open'].to_numpy(), df['high'].to_numpy(), df['low'].to_numpy(),
+                    df['close'].to_numpy(), df['volume'].to_numpy(), df['complete'].to_numpy())
+        if all(column in df for column in BID_ASK_COLUMNS):
+            batch.set_bid_ask(*(df[column].to_numpy() for column in BID_ASK_COLUMNS))
+        return batch
+
+    def __len__(self):
+        return len(self.time)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if key in BID_ASK_COLUMNS:
+                return self.bid_ask_column(key)
+            return getattr(self, key)
+        return CandleBatch(*(getattr(self, column)[key] for column in self.columns),
+                           None if self.spread_offsets is None else self.spread_offsets[key])
+
+    def bid_ask_column(self, name):
+        """One of BID_ASK_COLUMNS as float prices, e.g. 'ask_low'."""
+        index = BID_ASK_COLUMNS.index(name)
+        mid = getattr(self, name.split('_')[1])
+        offsets = self.spread_offsets[:, index] / SPREAD_SCALE
+        return mid - offsets if index < 4 else mid + offsets
+
+    def set_bid_ask(self, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close):
+        mid = np.column_stack((self.open, self.high, self.low, self.close))
+        bid = np.column_stack((bid_open, bid_high, bid_low, bid_close))
+        ask = np.column_stack((ask_open, ask_high, ask_low, ask_close))
+        self.spread_offsets = np.rint(np.hstack((mid - bid, ask - mid)) * SPREAD_SCALE).astype(np.int32)
+
+    def __iter__(self):
+        for row in zip(*(getattr(self, column).tolist() for column in self.columns)):
+            yield Candle(*row)
+
+    def nbytes(self):
+        return sum(getattr(self, column).nbytes for column in self.columns) + (
+            0 if self.spread_offsets is None else self.spread_offsets.nbytes)
+
+    def iso_times(self):
+        return np.char.add(np.datetime_as_string(self.time.astype('datetime64[ns]'), unit='ns'), 'Z')
+
+    def rows(self, *prefix):
+        """
+        Rows for executemany: (*prefix, epoch ns time, open, high, low, close, volume, complete), followed
+        by the 8 spread offsets when the batch has bid/ask.
+        """
+        offsets = self.spread_offsets.T.tolist() if self.spread_offsets is not None else ()
+        return zip(*([value] * len(self) for value in prefix), self.time.tolist(), self.open.tolist(),
+                   self.high.tolist(), self.low.tolist(), self.close.tolist(), self.volume.tolist(),
+                   self.complete.tolist(), *offsets)
+
+    def to_dataframe(self, datetime_index=False):
+        """DataFrame in the fetch_historical_data layout (epoch ns times), or indexed by datetime for backtrader."""
+        data = {column: getattr(self, column) for column in self.columns[1:]}
+        if self.spread_offsets is not None:
+            data.update((column, self.bid_ask_column(column)) for column in BID_ASK_COLUMNS)
+        if datetime_index:
+            return pd.DataFrame(data, index=pd.DatetimeIndex(self.time.astype('datetime64[ns]'), name='datetime'))
+        return pd.DataFrame({'time': self.time, **data})
@@ -0,0 +1,286 @@
+"""
+Account-wide exposure, margin and unrealized P&L kept in memory.
+
+The state is loaded with one AccountDetails request and then moved forward by ticks, fills and
+submitted orders. Each update only touches the instrument it is about and adjusts the totals by the
+difference, so a tick costs the same with 2 or 200 open positions, and a pre-trade check is a few
+dictionary lookups instead of a REST round trip. sync() re-reads the account to pick up fills of
+resting orders and any drift.
+"""
+from oandapyV20.endpoints import accounts, pricing
+
+import logging
+import threading
+
+from src.database_functions import get_instrument_value
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s : %(message)s')
+
+ENTRY_ORDER_TYPES = ('LIMIT', 'STOP', 'MARKET_IF_TOUCHED')
+
+
+class InstrumentRisk:
+    __slots__ = ('units', 'average_price', 'pending_long', 'pending_short', 'bid', 'ask', 'conversion_pos',
+                 'conversion_neg', 'margin_rate', 'exposure', 'margin', 'unrealized_pl')
+
+    def __init__(self, margin_rate):
+        self.units = 0.0  # Net position, negative when short
+        self.average_price = 0.0
+        self.pending_long = 0.0  # Units of resting entry orders that would add to the position if filled
+        self.pending_short = 0.0
+        self.bid = self.ask = None
+        self.conversion_pos = self.conversion_neg = 1.0
+        self.margin_rate = margin_rate
+        self.exposure = 0.0  # Signed notional in the home currency
+        self.margin = 0.0
+        self.unrealized_pl = 0.0
+
+    def revalue(self):
+        """Recompute exposure, margin and P&L from units and prices; returns the (exposure, margin, P&L) deltas."""
+        old = (self.exposure, self.margin, self.unrealized_pl)
+        if self.bid is None or not self.units:
+            self.exposure = self.margin = self.unrealized_pl = 0.0
+        else:
+            mid = (self.bid + self.ask) / 2
+            self.exposure = self.units * mid * self.conversion_pos
+            self.margin = abs(self.exposure) * self.margin_rate
+            # A position is closed out at the bid when long and at the ask when short
+            pl = self.units * ((self.bid if self.units > 0 else self.ask) - self.average_price)
+            self.unrealized_pl = pl * (self.conversion_pos if pl >= 0 else self.conversion_neg)
+        return self.exposure - old[0], self.margin - old[1], self.unrealized_pl - old[2]
+
+    def worst_case_units(self, extra_units=0.0):
+        # If every resting order on one side fills, with the new order added to its side
+        long_side = self.units + self.pending_long + max(extra_units, 0.0)
+        short_side = self.units - self.pending_short + min(extra_units, 0.0)
+        return max(abs(long_side), abs(short_side))
+
+
+class RiskEngine:
+    def __init__(self, api, account_id, market_cache=None, max_margin_fraction=0.8,
+                 max_instrument_exposure=None):
+        self.api = api
+        self.account_id = account_id
+        self.market_cache = market_cache
+        self.max_margin_fraction = max_margin_fraction  # Of NAV, counting resting orders as filled
+        self.max_instrument_exposure = max_instrument_exposure  # Of NAV per instrument, None for no limit
+        self.balance = 0.0
+        self.instruments = {}  # instrument -> InstrumentRisk
+        self.total_exposure = 0.0  # Net, home currency
+        self.gross_exposure = 0.0
+        self.margin_used = 0.0
+        self.unrealized_pl = 0.0
+        self.pending_margin = 0.0  # Margin of resting orders beyond current positions, worst case
+        self.account = None  # AccountDetails of the last sync
+        self._lock = threading.Lock()
+
+    # -----------------State-----------------#
+
+    def _get(self, instrument):
+        risk = self.instruments.get(instrument)
+        if risk is None:
+            margin_rate = get_instrument_value(instrument, 'marginRate')
+            risk = self.instruments[instrument] = InstrumentRisk(float(margin_rate) if margin_rate else 0.05)
+            if self.market_cache is not None:
+                quote = self.market_cache.quotes.get(instrument)
+                factors = self.market_cache.conversion_factors.get(instrument)
+                if quote:
+                    risk.bid, risk.ask = quote['bid'], quote['ask']
+                if factors:
+                    risk.conversion_pos, risk.conversion_neg = factors
+        return risk
+
+    def _apply(self, risk, old_pending_margin):
+        # Fold one instrument's change into the totals
+        old_exposure = risk.exposure
+        exposure_delta, margin_delta, pl_delta = risk.revalue()
+        self.total_exposure += exposure_delta
+        self.gross_exposure += abs(risk.exposure) - abs(old_exposure)
+        self.margin_used += margin_delta
+        self.unrealized_pl += pl_delta
+        self.pending_margin += self._pending_margin(risk) - old_pending_margin
+
+    @staticmethod
+    def _pending_margin(risk):
+        if risk.bid is None:
+            return 0.0
+        mid = (risk.bid + risk.ask) / 2
+        return (risk.worst_case_units() - abs(risk.units)) * mid * risk.conversion_pos * risk.margin_rate
+
+    def _fetch_prices(self, instruments):
+        # Instruments held before any tick arrived are priced with one batched PricingInfo request
+        response = self.api.request(
+            pricing.PricingInfo(accountID=self.account_id, params={"instruments": ",".join(instruments)}))
+        prices = {}
+        for price in response.get('prices', []):
+            factors = price.get('quoteHomeConversionFactors')
+            prices[price['instrument']] = (float(price['bids'][0]['price']), float(price['asks'][0]['price']),
+                                           (float(factors['positiveUnits']), float(factors['negativeUnits']))
+                                           if factors else None)
+        return prices
+
+    def sync(self):
+        """
+        Reload balance, positions and resting orders with a single AccountDetails request, returns the
+        account so callers can reuse it instead of asking again.
+        """
+        account = self.api.request(accounts.AccountDetails(self.account_id))['account']
+        held = {position['instrument'] for position in account.get('positions', [])}
+        held.update(order['instrument'] for order in account.get('orders', []) if order.get('type') in ENTRY_ORDER_TYPES)
+        unpriced = [instrument for instrument in held
+                    if instrument not in self.instruments or self.instruments[instrument].bid is None]
+        prices = self._fetch_prices(unpriced) if unpriced else {}
+        with self._lock:
+            self.balance = float(account['balance'])
+            for risk in self.instruments.values():
+                risk.units = risk.average_price = risk.pending_long = risk.pending_short = 0.0
+            for instrument, (bid, ask, factors) in prices.items():
+                risk = self._get(instrument)
+                if risk.bid is None:
+                    risk.bid, risk.ask = bid, ask
+                    if factors:
+                        risk.conversion_pos, risk.conversion_neg = factors
+            for position in account.get('positions', []):
+                risk = self._get(position['instrument'])
+                long_units, short_units = float(position['long']['units']), float(position['short']['units'])
+                risk.units = long_units + short_units
+                side = position['long'] if risk.units > 0 else position['short']
+                risk.average_price = float(side.get('averagePrice', 0.0))
+            for order in account.get('orders', []):
+                if order.get('type') in ENTRY_ORDER_TYPES:
+                    risk = self._get(order['instrument'])
+                    units = float(order['units'])
+                    if units > 0:
+                        risk.pending_long += units
+                    else:
+                        risk.pending_short -= units
+            self.total_exposure = self.gross_exposure = self.margin_used = 0.0
+            self.unrealized_pl = self.pending_margin = 0.0
+            for risk in self.instruments.values():
+                risk.exposure = risk.margin = risk.unrealized_pl = 0.0
+                self._apply(risk, 0.0)
+        logging.info(f"Risk engine synced: NAV {self.nav:.2f}, margin used {self.margin_used:.2f}, "
+                     f"net exposure {self.total_exposure:.2f}")
+        self.account = account
+        return account
+
+    @property
+    def nav(self):
+        return self.balance + self.unrealized_pl
+
+    @property
+    def margin_available(self):
+        return self.nav - self.margin_used
+
+    # -----------------Updates-----------------#
+
+    def on_price(self, instrument, bid, ask, conversion_factors=None):
+        """Tick update; instruments without a position or resting order are ignored."""
+        risk = self.instruments.get(instrument)
+        if risk is None:
+            return
+        with self._lock:
+            old_pending_margin = self._pending_margin(risk)
+            risk.bid, risk.ask = bid, ask
+            if conversion_factors:
+                risk.conversion_pos, risk.conversion_neg = conversion_factors
+            self._apply(risk, old_pending_margin)
+
+    def on_fill(self, instrument, units, price, realized_pl=0.0, from_pending=False):
+        with self._lock:
+            risk = self._get(instrument)
+            old_pending_margin = self._pending_margin(risk)
+            if from_pending:
+                if units > 0:
+                    risk.pending_long = max(risk.pending_long - units, 0.0)
+                else:
+                    risk.pending_short = max(risk.pending_short + units, 0.0)
+            new_units = risk.units + units
+            if risk.units * units >= 0 and new_units:
+                # Opening or adding: volume-weighted entry price
+                risk.average_price = (risk.units * risk.average_price + units * price) / new_units
+            elif risk.units * new_units < 0:
+                risk.average_price = price  # Flipped through zero, the remainder opened at this price
+            risk.units = new_units
+            self.balance += realized_pl
+            self._apply(risk, old_pending_margin)
+
+    def holdings(self, instrument):
+        """(net position units, resting entry units) of one instrument, as of the last sync plus the orders since."""
+        with self._lock:
+            risk = self.instruments.get(instrument)
+            if risk is None:
+                return 0.0, 0.0
+            return risk.units, risk.pending_long + risk.pending_short
+
+    def on_order_submitted(self, instrument, units):
+        """A resting entry order was accepted; it counts against margin as if it were filled."""
+        with self._lock:
+            risk = self._get(instrument)
+            old_pending_margin = self._pending_margin(risk)
+            if units > 0:
+                risk.pending_long += units
+            else:
+                risk.pending_short -= units
+            self._apply(risk, old_pending_margin)
+
+    def on_order_cancelled(self, instrument, units):
+        """A resting entry order was cancelled or replaced; release its reservation."""
+        with self._lock:
+            risk = self._get(instrument)
+            old_pending_margin = self._pending_margin(risk)
+            if units > 0:
+                risk.pending_long = max(risk.pending_long - units, 0.0)
+            else:
+                risk.pending_short = max(risk.pending_short + units, 0.0)
+            self._apply(risk, old_pending_margin)
+
+    def on_order_response(self, order_data, response):
+        """Fold an OrderCreate response in: an immediate fill moves the position, a resting order is reserved."""
+        fill = response.get('orderFillTransaction')
+        if fill:
+            self.on_fill(fill['instrument'], float(fill['units']), float(fill['price']),
+                         float(fill.get('pl', 0.0)))
+        elif response.get('orderCreateTransaction') and order_data.get('type') in ENTRY_ORDER_TYPES:
+            self.on_order_submitted(order_data['instrument'], float(order_data['units']))
+
+    # -----------------Pre-trade check-----------------#
+
+    def check_order(self, instrument, units, price=None):
+        """Return None when the order fits the limits, otherwise the reason it does not."""
+        with self._lock:
+            risk = self._get(instrument)
+            if risk.bid is None and price is None:
+                return f"No price for {instrument}"
+            order_price = price if price is not None else (risk.bid + risk.ask) / 2
+            unit_value = order_price * risk.conversion_pos
+            # Worst case margin of this instrument with the order, against what it uses now (positions + resting)
+            current = risk.worst_case_units() * unit_value * risk.margin_rate
+            projected = risk.worst_case_units(units) * unit_value * risk.margin_rate
+            margin_after = self.margin_used + self.pending_margin + projected - current
+            nav = self.nav
+            if margin_after > self.max_margin_fraction * nav:
+                return (f"Margin {margin_after:.2f} after the order would exceed "
+                        f"{self.max_margin_fraction:.0%} of NAV {nav:.2f}")
+            if self.max_instrument_exposure is not None:
+                exposure_after = abs(risk.units + units) * unit_value
+                if exposure_after > self.max_instrument_exposure * nav:
+                    return (f"{instrument} exposure {exposure_after:.2f} would exceed "
+                            f"{self.max_instrument_exposure:.0%} of NAV {nav:.2f}")
+        return None
+
+    def get_summary(self):
+        return {
+            "nav": self.nav,
+            "balance": self.balance,
+            "net_exposure": self.total_exposure,
+            "gross_exposure": self.gross_exposure,
+            "margin_used": self.margin_used,
+            "pending_margin": self.pending_margin,
+            "margin_available": self.margin_available,
+            "unrealized_pl": self.unrealized_pl,
+            "instruments": {instrument: {"units": risk.units, "exposure": risk.exposure, "margin": risk.margin,
+                                         "unrealized_pl": risk.unrealized_pl}
+                            for instrument, risk in self.instruments.items() if risk.units or risk.pending_long
+                            or risk.pending_short},
+        }
@@ -0,0 +1,228 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from datetime import datetime, timedelta
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from src.database_functions import granularity_to_minutes
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s : %(message)s')
+
+EPOCH = datetime(1970, 1, 1)
+
+
+# -----------------Triggers-----------------#
+# A trigger returns the next UTC fire time strictly after the given time, or None when it is exhausted.
+
+class BarCloseTrigger:
+    """Fires on every bar close of an OANDA granularity, e.g. 'H1' fires at the top of every hour."""
+
+    def __init__(self, granularity, delay_seconds=1):
+        self.granularity = granularity
+        self.bar_seconds = granularity_to_minutes(granularity) * 60
+        if self.bar_seconds <= 0 or granularity in ('W', 'M'):
+            raise ValueError(f"Unsupported bar close granularity: {granularity}")
+        # Small delay so the closed bar is available from the API when the job runs
+        self.delay = timedelta(seconds=delay_seconds)
+
+    def next_fire_time(self, after):
+        seconds = (after - self.delay - EPOCH).total_seconds()
+        next_close = (int(seconds // self.bar_seconds) + 1) * self.bar_seconds
+        return EPOCH + timedelta(seconds=next_close) + self.delay
+
+
+class IntervalTrigger:
+    def __init__(self, interval, start=None):
+        self.interval = interval
+        self.start = start
+
+    def next_fire_time(self, after):
+        if self.start is None:
+            self.start = after
+        if after < self.start:
+            return self.start
+        periods = int((after - self.start) / self.interval) + 1
+        return self.start + periods * self.interval
+
+
+class WeeklyTrigger:
+    """Fires once a week at weekday (Monday=0) hour:minute UTC."""
+
+    def __init__(self, weekday, hour=0, minute=0):
+        self.weekday = weekday
+        self.hour = hour
+        self.minute = minute
+
+    def next_fire_time(self, after):
+        candidate = after.replace(hour=self.hour, minute=self.minute, second=0, microsecond=0)
+        candidate += timedelta(days=(self.weekday - candidate.weekday()) % 7)
+        if candidate <= after:
+            candidate += timedelta(days=7)
+        return candidate
+
+
+class OnceTrigger:
+    def __init__(self, run_at=None):
+        self.run_at = run_at
+        self.fired = False
+
+    def next_fire_time(self, after):
+        if self.fired:
+            return None
+        self.fired = True
+        return self.run_at or after
+
+
+# -----------------Scheduler-----------------#
+
+class Job:
+    def __init__(self, name, func, trigger, misfire_grace, coalesce):
+        self.name = name
+        self.func = func
+        self.trigger = trigger
+        self.misfire_grace = misfire_grace
+        self.coalesce = coalesce
+        self.next_run = None
+        self.running = False
+        self.runs = 0
+        self.skipped = 0
+        self.missed = 0
+        self.latencies = deque(maxlen=100)  # seconds from scheduled time to job start
+        self.durations = deque(maxlen=100)
+
+
+class Scheduler:
+    """
+    Runs jobs on a worker pool when their trigger fires.
+
+    The scheduler thread sleeps until the next due job instead of polling. A job never overlaps
+    with itself: a fire that arrives while the previous run is still going is skipped. Fires missed
+    by more than misfire_grace seconds (e.g. after a suspend) are counted as missed; with coalesce the
+    whole backlog collapses into a single catch-up run, otherwise it is dropped.
+    """
+
+    def __init__(self, max_workers=4):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scheduler')
+        self.jobs = {}
+        self._queue = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def add_job(self, name, func, trigger, misfire_grace=60, coalesce=True):
+        job = Job(name, func, trigger, misfire_grace, coalesce)
+        with self._condition:
+            self.jobs[name] = job
+            self._schedule(job, datetime.utcnow())
+            self._condition.notify()
+        logging.info(f"Job {name} scheduled, next run at {job.next_run}")
+        return job
+
+    def add_event_job(self, name, func):
+        """Register a job that only runs when trigger_event is called."""
+        job = Job(name, func, None, misfire_grace=None, coalesce=True)
+        with self._condition:
+            self.jobs[name] = job
+        return job
+
+    def trigger_event(self, name):
+        with self._condition:
+            self._submit(self.jobs[name], datetime.utcnow())
+
+    def remove_job(self, name):
+        with self._condition:
+            job = self.jobs.pop(name, None)
+            if job:
+                job.next_run = None
+
+    def _schedule(self, job, after):
+        job.next_run = job.trigger.next_fire_time(after)
+        if job.next_run is not None:
+            heapq.heappush(self._queue, (job.next_run, next(self._counter), job))
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, name='scheduler', daemon=True)
+        self._thread.start()
+        logging.info("Scheduler started.")
+
+    def stop(self, wait=True):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread:
+            self._thread.join()
+        self.executor.shutdown(wait=wait)
+        logging.info("Scheduler stopped.")
+
+    def join(self):
+        while self._thread and self._thread.is_alive():
+            self._thread.join(timeout=1)
+
+    def _loop(self):
+        with self._condition:
+            while self._running:
+                if not self._queue:
+                    self._condition.wait()
+                    continue
+                fire_time, _, job = self._queue[0]
+                now = datetime.utcnow()
+                if fire_time > now:
+                    self._condition.wait(timeout=(fire_time - now).total_seconds())
+                    continue
+                heapq.heappop(self._queue)
+                if job.next_run != fire_time or self.jobs.get(job.name) is not job:
+                    continue  # Removed or rescheduled job
+
+                late = (now - fire_time).total_seconds()
+                if job.misfire_grace is not None and late > job.misfire_grace:
+                    job.missed += 1
+                    logging.warning(f"Job {job.name} missed its run at {fire_time} by {late:.0f}s")
+                    if job.coalesce:
+                        self._submit(job, fire_time)  # One catch-up run for the whole backlog
+                    self._schedule(job, now)
+                else:
+                    self._submit(job, fire_time)
+                    self._schedule(job, now if job.coalesce else fire_time)
+
+    def _submit(self, job, scheduled_time):
+        if job.running:
+            job.skipped += 1
+            logging.warning(f"Job {job.name} still running, skipping run scheduled at {scheduled_time}")
+            return
+        job.running = True
+        self.executor.submit(self._run_job, job, scheduled_time)
+
+    def _run_job(self, job, scheduled_time):
+        start = time.perf_counter()
+        latency = (datetime.utcnow() - scheduled_time).total_seconds()
+        job.latencies.append(latency)
+        try:
+            job.func()
+        except Exception as e:
+            logging.error(f"Job {job.name} failed: {e}")
+        finally:
+            duration = time.perf_counter() - start
+            job.durations.append(duration)
+            job.runs += 1
+            job.running = False
+            logging.info(f"Job {job.name} ran {latency:.3f}s after its trigger, took {duration:.3f}s")
+
+    def get_stats(self):
+        stats = {}
+        for name, job in self.jobs.items():
+            latencies = sorted(job.latencies)
+            stats[name] = {
+                "runs": job.runs,
+                "skipped": job.skipped,
+                "missed": job.missed,
+                "next_run": job.next_run,
+                "median_latency": latencies[len(latencies) // 2] if latencies else None,
+                "max_latency": latencies[-1] if latencies else None,
+                "last_duration": job.durations[-1] if job.durations else None,
+            }
+        return stats
@@ -0,0 +1,114 @@
+"""
+Instrument screener that keeps its results between scans.
+
+For every instrument the time of the last bar it was evaluated on and its CHOP and BB %B values are
+kept, so a rescan only recomputes instruments with a new complete bar. The grid and trending
+candidates are RankedSets ordered by BB %B, updated in O(log n) per changed instrument instead of
+re-sorting (and re-appending) whole lists on every scan.
+"""
+from itertools import count
+import heapq
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s : %(message)s')
+
+
+class RankedSet:
+    """Members ordered by score, lowest first; set, remove and pop are O(log n)."""
+
+    def __init__(self):
+        self._heap = []  # [score, sequence, member, live] entries, stale ones are skipped lazily
+        self._entries = {}  # member -> its live heap entry
+        self._sequence = count()
+
+    def set(self, member, score):
+        entry = self._entries.get(member)
+        if entry is not None:
+            if entry[0] == score:
+                return
+            entry[3] = False
+        entry = self._entries[member] = [score, next(self._sequence), member, True]
+        heapq.heappush(self._heap, entry)
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            # Too many stale entries, rebuild from the live ones
+            self._heap = [entry for entry in self._heap if entry[3]]
+            heapq.heapify(self._heap)
+
+    def remove(self, member):
+        entry = self._entries.pop(member, None)
+        if entry is not None:
+            entry[3] = False
+
+    def _prune(self):
+        while self._heap and not self._heap[0][3]:
+            heapq.heappop(self._heap)
+
+    def peek(self):
+        self._prune()
+        return (self._heap[0][2], self._heap[0][0]) if self._heap else None
+
+    def pop(self):
+        """Remove and return the lowest (member, score)."""
+        self._prune()
+        score, _, member, _ = heapq.heappop(self._heap)
+        del self._entries[member]
+        return member, score
+
+    def ranked(self):
+        return [(entry[2], entry[0]) for entry in sorted(self._entries.values())]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, member):
+        return member in self._entries
+
+    def __iter__(self):
+        return iter(self.ranked())
+
+
+class InstrumentScreener:
+    def __init__(self, chop_filters, bb_filters):
+        self.chop_filters = chop_filters
+        self.bb_filters = bb_filters
+        self.results = {}  # instrument -> (bar time, chop, bb_perc) of its last evaluation
+        self.grid = RankedSet()
+        self.trending = RankedSet()
+
+    def is_stale(self, instrument, bar_time):
+        """True when the instrument has a bar it was not evaluated on (or no bars at all yet)."""
+        result = self.results.get(instrument)
+        return result is None or bar_time is None or result[0] != bar_time
+
+    def retain(self, instruments):
+        """Forget instruments that are no longer tradeable."""
+        for instrument in set(self.results) - set(instruments):
+            del self.results[instrument]
+            self.grid.remove(instrument)
+            self.trending.remove(instrument)
+
+    def state(self):
+        """The evaluation results, all the screener needs to be rebuilt (see restore)."""
+        return {instrument: [bar_time, float(chop_value), float(bb_perc)]
+                for instrument, (bar_time, chop_value, bb_perc) in self.results.items()}
+
+    def restore(self, state):
+        # Results evaluated since the checkpoint was written are newer and kept
+        for instrument, (bar_time, chop_value, bb_perc) in (state or {}).items():
+            result = self.results.get(instrument)
+            if result is None or result[0] is None or (bar_time is not None and bar_time > result[0]):
+                self.update(instrument, bar_time, chop_value, bb_perc)
+
+    def update(self, instrument, bar_time, chop_value, bb_perc):
+        self.results[instrument] = (bar_time, chop_value, bb_perc)
+        self.grid.remove(instrument)
+        self.trending.remove(instrument)
+        # Skip instrument if bb_perc is higher than the filter's high threshold
+        if bb_perc > self.bb_filters['high']:
+            return
+        if chop_value > self.chop_filters['high']:
+            self.grid.set(instrument, bb_perc)
+            logging.info(f"Instrument: {instrument} added as instrument for grid, Last CHOP Value: {chop_value}")
+        elif chop_value < self.chop_filters['low']:
+            self.trending.set(instrument, bb_perc)
+            logging.info(f"Instrument: {instrument} added as instrument for trending, Last CHOP Value: {chop_value}")
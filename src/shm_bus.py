@@ -0,0 +1,175 @@
+"""
+Single-writer / multi-reader market data bus in multiprocessing.shared_memory.
+
+The writer (the process owning the pricing stream) publishes the latest quote and every completed
+bar per instrument. Readers in other processes (scanners, backtest pools) attach by name and get
+NumPy views straight onto the shared buffer. Nothing is locked: every quote slot is a seqlock and
+every bar row carries the sequence number it was written with, so readers detect torn reads and
+ring overruns instead of blocking the writer.
+"""
+from multiprocessing import resource_tracker, shared_memory
+import logging
+import time
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s : %(message)s')
+
+MAGIC = 0x4F414E44  # 'OAND'
+VERSION = 1
+NAME_BYTES = 32
+HEADER_DTYPE = np.dtype([('magic', 'i8'), ('version', 'i8'), ('instruments', 'i8'), ('bar_capacity', 'i8')])
+QUOTE_DTYPE = np.dtype([('seq', 'i8'), ('time', 'i8'), ('bid', 'f8'), ('ask', 'f8')])
+BAR_DTYPE = np.dtype([('seq', 'i8'), ('time', 'i8'), ('open', 'f8'), ('high', 'f8'), ('low', 'f8'),
+                      ('close', 'f8'), ('volume', 'i8')])
+
+
+class MarketDataBus:
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        header = np.ndarray((1,), dtype=HEADER_DTYPE, buffer=shm.buf)[0]
+        if header['magic'] != MAGIC or header['version'] != VERSION:
+            raise ValueError(f"{shm.name} is not a market data bus")
+        count, capacity = int(header['instruments']), int(header['bar_capacity'])
+        self.bar_capacity = capacity
+
+        offset = HEADER_DTYPE.itemsize
+        names = np.ndarray((count,), dtype=f'S{NAME_BYTES}', buffer=shm.buf, offset=offset)
+        self.instruments = [name.decode() for name in names]
+        self.index = {instrument: i for i, instrument in enumerate(self.instruments)}
+        offset += names.nbytes
+        self.quotes = np.ndarray((count,), dtype=QUOTE_DTYPE, buffer=shm.buf, offset=offset)
+        offset += self.quotes.nbytes
+        self.bar_counts = np.ndarray((count,), dtype='i8', buffer=shm.buf, offset=offset)
+        offset += self.bar_counts.nbytes
+        self.bars = np.ndarray((count, capacity), dtype=BAR_DTYPE, buffer=shm.buf, offset=offset)
+        # Per-field views so the hot publish/read paths index plain int64/float64 arrays
+        self.quote_seq, self.quote_time = self.quotes['seq'], self.quotes['time']
+        self.quote_bid, self.quote_ask = self.quotes['bid'], self.quotes['ask']
+
+    @staticmethod
+    def size(instrument_count, bar_capacity):
+        return (HEADER_DTYPE.itemsize + instrument_count * (NAME_BYTES + QUOTE_DTYPE.itemsize + 8)
+                + instrument_count * bar_capacity * BAR_DTYPE.itemsize)
+
+    @classmethod
+    def create(cls, instruments, bar_capacity=4096, name=None):
+        """Create the bus; the creating process is its only writer."""
+        shm = shared_memory.SharedMemory(name=name, create=True, size=cls.size(len(instruments), bar_capacity))
+        shm.buf[:shm.size] = bytes(shm.size)
+        header = np.ndarray((1,), dtype=HEADER_DTYPE, buffer=shm.buf)
+        header[0] = (MAGIC, VERSION, len(instruments), bar_capacity)
+        names = np.ndarray((len(instruments),), dtype=f'S{NAME_BYTES}', buffer=shm.buf, offset=HEADER_DTYPE.itemsize)
+        names[:] = [instrument.encode() for instrument in instruments]
+        logging.info(f"Market data bus {shm.name} created for {len(instruments)} instruments "
+                     f"({shm.size / 2 ** 20:.1f}MB)")
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name, untrack=True):
+        shm = shared_memory.SharedMemory(name=name)
+        if untrack:
+            # A reader with its own resource tracker would unlink the writer's segment when it exits.
+            # Children forked from the writer share its tracker and must pass untrack=False.
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self):
+        # Views must be dropped before the buffer can be released
+        del self.quotes, self.bar_counts, self.bars, self.quote_seq, self.quote_time, self.quote_bid, self.quote_ask
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    # -----------------Writer-----------------#
+
+    def publish_quote(self, instrument, time_ns, bid, ask):
+        i = self.index[instrument]
+        seq = int(self.quote_seq[i])
+        self.quote_seq[i] = seq + 1  # Odd: write in progress
+        self.quote_time[i] = time_ns
+        self.quote_bid[i] = bid
+        self.quote_ask[i] = ask
+        self.quote_seq[i] = seq + 2
+
+    def publish_bar(self, instrument, time_ns, open, high, low, close, volume):
+        i = self.index[instrument]
+        count = int(self.bar_counts[i])
+        row = self.bars[i, count % self.bar_capacity:count % self.bar_capacity + 1]
+        row['seq'] = -1  # Invalid while the row is rewritten
+        row['time'] = time_ns
+        row['open'] = open
+        row['high'] = high
+        row['low'] = low
+        row['close'] = close
+        row['volume'] = volume
+        row['seq'] = count + 1
+        self.bar_counts[i] = count + 1
+
+    def publish_batch(self, instrument, batch):
+        """Publish the complete bars of a CandleBatch."""
+        for row in batch[batch.complete]:
+            self.publish_bar(instrument, row.time, row.open, row.high, row.low, row.close, row.volume)
+
+    # -----------------Readers-----------------#
+
+    def read_quote(self, instrument, retries=100):
+        """Consistent (time, bid, ask) of the latest quote, or None if nothing was published yet."""
+        i = self.index[instrument]
+        for attempt in range(retries):
+            seq = int(self.quote_seq[i])
+            if not seq & 1:
+                time_ns, bid, ask = int(self.quote_time[i]), float(self.quote_bid[i]), float(self.quote_ask[i])
+                if int(self.quote_seq[i]) == seq:
+                    return (time_ns, bid, ask) if seq else None
+            if attempt > 10:
+                time.sleep(0)  # The writer was preempted mid-write, let it run
+        raise RuntimeError(f"Could not read a consistent quote for {instrument}")
+
+    def bar_reader(self, instrument, from_start=False):
+        return BarReader(self, instrument, from_start)
+
+
+class BarReader:
+    """
+    Cursor over one instrument's bar ring. poll() returns the bars published since the last poll,
+    as a view into shared memory when they are contiguous: copy them if they must outlive the ring.
+    """
+
+    def __init__(self, bus, instrument, from_start=False):
+        self.bus = bus
+        self.i = bus.index[instrument]
+        self.ring = bus.bars[self.i]  # Zero-copy view of the ring
+        count = int(bus.bar_counts[self.i])
+        self.cursor = max(0, count - bus.bar_capacity) if from_start else count
+        self.overruns = 0
+
+    def poll(self):
+        count = int(self.bus.bar_counts[self.i])
+        capacity = self.bus.bar_capacity
+        if count - self.cursor > capacity:
+            # The writer lapped us: the oldest unread bars are gone
+            lost = count - capacity - self.cursor
+            self.overruns += lost
+            logging.warning(f"Bar reader for {self.bus.instruments[self.i]} overrun, {lost} bars lost")
+            self.cursor = count - capacity
+        if count == self.cursor:
+            return self.ring[:0]
+        start, end = self.cursor % capacity, count % capacity
+        if start < end:
+            bars = self.ring[start:end]  # Contiguous: a view, no copy
+        else:
+            bars = np.concatenate((self.ring[start:], self.ring[:end]))
+        expected = np.arange(self.cursor + 1, count + 1)
+        valid = bars['seq'] == expected
+        if not valid.all():
+            # Rows rewritten by the writer while we read them, re-read on the next poll
+            count = self.cursor + int(np.argmin(valid))
+            bars = bars[:count - self.cursor]
+        self.cursor = count
+        return bars
@@ -0,0 +1,84 @@
+"""
+Crash-safe checkpoint of the strategies' in-memory state.
+
+The whole state is one small JSON document of sections (the screener results, one entry per grid...).
+Every change rewrites it atomically: the new document goes to a temporary file that is fsynced and then
+renamed over the old one, so after a crash the file holds either the previous or the new state, never a
+torn one. Strategies save their intent before acting on it (a grid's levels before its orders are sent),
+so a restart can finish what was interrupted instead of working it out from the account.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s : %(message)s')
+
+STATE_VERSION = 1
+
+
+class StateStore:
+    def __init__(self, path='data/state.json', durable=True):
+        self.path = path
+        self.durable = durable  # fsync the file and its directory on every save
+        self._lock = threading.Lock()
+        # Read up front, so a write of one section before load() keeps the sections already on disk
+        self.state = self._read()
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                document = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.error(f"Ignoring unreadable state checkpoint {self.path}: {e}")
+            return {}
+        if document.get('version') != STATE_VERSION:
+            logging.warning(f"Ignoring state checkpoint {self.path} of version {document.get('version')}")
+            return {}
+        sections = document.get('sections', {})
+        logging.info(f"Read state checkpoint saved at {document.get('saved_at')}: {sorted(sections)}")
+        return sections
+
+    def load(self):
+        """The saved sections, {} when there is no usable checkpoint."""
+        with self._lock:
+            return json.loads(json.dumps(self.state))  # A copy the caller can change
+
+    def set(self, section, value):
+        with self._lock:
+            self.state[section] = value
+            self._write()
+
+    def set_item(self, section, key, value):
+        """Set one entry of a dict section, e.g. set_item('grids', 'EUR_USD', grid_state)."""
+        with self._lock:
+            self.state.setdefault(section, {})[key] = value
+            self._write()
+
+    def remove_item(self, section, key):
+        with self._lock:
+            if self.state.get(section, {}).pop(key, None) is not None:
+                self._write()
+
+    def _write(self):
+        data = json.dumps({"version": STATE_VERSION, "saved_at": time.time(), "sections": self.state},
+                          separators=(',', ':'))
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w') as f:
+            f.write(data)
+            if self.durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+        if self.durable and hasattr(os, 'O_DIRECTORY'):
+            # The rename itself only survives a power loss once the directory entry is on disk
+            descriptor = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(descriptor)
+            finally:
+                os.close(descriptor)
@@ -0,0 +1,257 @@
+"""
+One strategy worker process per account, all fed by a single shared market-data service.
+
+The MarketDataService lives in a manager process reachable over a local socket. It owns the only
+pricing stream, fetches bars once for every account and serves materialized indicators, so adding an
+account adds a worker process but no extra stream or history fetch.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from multiprocessing.managers import BaseManager
+import logging
+import multiprocessing
+import os
+import queue
+import resource
+import threading
+import time
+
+from oandapyV20 import API
+from oandapyV20.endpoints import accounts
+
+from src.database_functions import fetch_historical_batch, get_instrument_list, has_cached_instruments, \
+    set_instruments_table
+from src.indicator_store import IndicatorStore, IndicatorSpec
+from src.records import iso_to_epoch_ns
+from src.shm_bus import MarketDataBus
+from src.stream_handler import StreamHandler
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s : %(message)s')
+
+
+# -----------------Shared market data-----------------#
+
+class MarketDataService:
+    def __init__(self, access_token, environment, account_id, bus_granularity=None):
+        self.api = API(access_token=access_token, environment=environment)
+        self.access_token = access_token
+        self.account_id = account_id  # Any account can open the pricing stream
+        self.quotes = {}
+        self.subscriptions = defaultdict(list)  # instrument -> subscriber queues
+        self.indicator_store = IndicatorStore(access_token)
+        self.stream_handler = None
+        self._lock = threading.RLock()
+        # Optional shared-memory bus with latest quotes and completed bars of one granularity for process pools
+        self.bus = MarketDataBus.create(self.get_instruments()) if bus_granularity else None
+        self.bus_granularity = bus_granularity
+        self.published_bar_time = {}
+
+    def get_instruments(self):
+        # On a first run the instruments table does not exist yet, the bus needs its slots before any worker starts
+        if not has_cached_instruments():
+            response = self.api.request(accounts.AccountInstruments(accountID=self.account_id))
+            set_instruments_table(response.get('instruments'))
+            logging.info("Instruments table filled for the market data bus")
+        return get_instrument_list() or []
+
+    def subscribe(self, instruments):
+        """Return a queue receiving the PRICE messages of these instruments."""
+        subscriber = queue.Queue(maxsize=10000)
+        with self._lock:
+            new_instruments = [instrument for instrument in instruments if instrument not in self.subscriptions]
+            for instrument in instruments:
+                self.subscriptions[instrument].append(subscriber)
+        if new_instruments:
+            self.restart_stream()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            for subscribers in self.subscriptions.values():
+                if subscriber in subscribers:
+                    subscribers.remove(subscriber)
+
+    def restart_stream(self):
+        # The pricing stream is opened for the union of every worker's instruments
+        if self.stream_handler:
+            self.stream_handler.stop_stream()
+        self.stream_handler = StreamHandler('pricing', self, sorted(self.subscriptions))
+        self.stream_handler.subscribe('*', self.on_price)
+        self.stream_handler.run_stream()
+        logging.info(f"Shared pricing stream opened for {len(self.subscriptions)} instruments")
+
+    def on_price(self, msg):
+        if msg.get('type') != 'PRICE':
+            return
+        with self._lock:
+            self.quotes[msg['instrument']] = msg
+            subscribers = list(self.subscriptions.get(msg['instrument'], []))
+            if self.bus and msg['instrument'] in self.bus.index:
+                self.bus.publish_quote(msg['instrument'], iso_to_epoch_ns(msg['time']),
+                                       float(msg['bids'][0]['price']), float(msg['asks'][0]['price']))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(msg)
+            except queue.Full:
+                logging.warning(f"Subscriber queue full, dropping tick for {msg['instrument']}")
+
+    def get_quote(self, instrument):
+        return self.quotes.get(instrument)
+
+    def fetch_bars(self, instrument, granularity, count):
+        batch = fetch_historical_batch(instrument, granularity, count, self.access_token)
+        if self.bus and granularity == self.bus_granularity and instrument in self.bus.index:
+            self.publish_bars(instrument, batch)
+        return batch
+
+    def publish_bars(self, instrument, batch):
+        with self._lock:
+            last_time = self.published_bar_time.get(instrument, -1)
+            new_bars = batch[batch.time > last_time]
+            if len(new_bars):
+                self.bus.publish_batch(instrument, new_bars)
+                self.published_bar_time[instrument] = int(new_bars.time[-1])
+
+    def get_bus_name(self):
+        return self.bus.name if self.bus else None
+
+    def compute_indicator(self, instrument, granularity, count, indicator, **params):
+        """Last count values of an indicator, from the materialized indicator store."""
+        self.fetch_bars(instrument, granularity, count + IndicatorSpec(indicator, **params).warmup)
+        return self.indicator_store.get_series(instrument, granularity, IndicatorSpec(indicator, **params), count,
+                                               refresh=False)
+
+    def get_usage(self):
+        return resource_usage('market_data')
+
+
+_service = None
+
+
+def _init_service(access_token, environment, account_id, bus_granularity):
+    global _service
+    _service = MarketDataService(access_token, environment, account_id, bus_granularity)
+
+
+def _get_service():
+    return _service
+
+
+class MarketDataManager(BaseManager):
+    pass
+
+
+MarketDataManager.register('get_market_data', callable=_get_service, method_to_typeid={'subscribe': 'Queue'})
+# Proxy type for the subscriber queues returned by subscribe(); no callable so the queue itself is wrapped
+MarketDataManager.register('Queue', create_method=False)
+
+
+# -----------------Account workers-----------------#
+
+def resource_usage(name):
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        "name": name,
+        "pid": os.getpid(),
+        "cpu_seconds": usage.ru_utime + usage.ru_stime,
+        "max_rss_mb": usage.ru_maxrss / 1024,  # ru_maxrss is in KiB on Linux
+        "time": time.time(),
+    }
+
+
+def run_account_worker(account, access_token, environment, address, authkey, status_queue, report_interval):
+    # Imported in the worker so the supervisor process itself stays light
+    from src.main_bot import MainBot
+    from src.scheduler import Scheduler, OnceTrigger, IntervalTrigger
+
+    manager = MarketDataManager(address=address, authkey=authkey)
+    manager.connect()
+    main_bot = MainBot(access_token, environment, account_id=account['account_id'],
+                       market_data=manager.get_market_data(), profile=account.get('profile', False),
+                       trace=account.get('trace', False))
+    main_bot.grid_amount = account.get('grid_amount', main_bot.grid_amount)
+    main_bot.trending_amount = account.get('trending_amount', main_bot.trending_amount)
+    main_bot.max_grids = account.get('max_grids', main_bot.max_grids)
+
+    scheduler = Scheduler(max_workers=account.get('max_workers', 4))
+    scheduler.add_job('run_strategies', main_bot.run_strategies, OnceTrigger())
+    scheduler.add_job('report_usage', lambda: status_queue.put(resource_usage(account['account_id'])),
+                      IntervalTrigger(timedelta(seconds=report_interval)))
+    main_bot.schedule_jobs(scheduler)
+    scheduler.start()
+    scheduler.join()
+
+
+class Supervisor:
+    """
+    Starts the shared market-data service and one worker process per account, restarts workers
+    that die, and keeps the latest CPU/memory usage reported by every process.
+
+    accounts: [{"account_id": "...", "grid_amount": 0.5, "trending_amount": 0.5, "max_grids": 4}, ...]
+    """
+
+    def __init__(self, access_token, environment, accounts, report_interval=60, restart_delay=10,
+                 bus_granularity='H1'):
+        self.access_token = access_token
+        self.environment = environment
+        self.accounts = {account['account_id']: account for account in accounts}
+        self.report_interval = report_interval
+        self.restart_delay = restart_delay
+        self.bus_granularity = bus_granularity
+        self.authkey = os.urandom(16)
+        self.manager = None
+        self.workers = {}
+        self.usage = {}
+        self.status_queue = multiprocessing.Queue()
+        self.running = False
+
+    def start(self):
+        # address=None lets the manager listen on a private Unix socket
+        self.manager = MarketDataManager(authkey=self.authkey)
+        stream_account = next(iter(self.accounts))
+        self.manager.start(_init_service, (self.access_token, self.environment, stream_account, self.bus_granularity))
+        logging.info(f"Market data service listening on {self.manager.address}, "
+                     f"shared memory bus: {self.manager.get_market_data().get_bus_name()}")
+        for account_id in self.accounts:
+            self.start_worker(account_id)
+        self.running = True
+
+    def start_worker(self, account_id):
+        worker = multiprocessing.Process(
+            target=run_account_worker, name=f"account-{account_id}",
+            args=(self.accounts[account_id], self.access_token, self.environment, self.manager.address, self.authkey,
+                  self.status_queue, self.report_interval))
+        worker.start()
+        self.workers[account_id] = worker
+        logging.info(f"Worker for account {account_id} started, pid {worker.pid}")
+
+    def run(self):
+        """Monitor loop: collect usage reports and restart dead workers until stop() or Ctrl-C."""
+        if not self.running:
+            self.start()
+        try:
+            while self.running:
+                try:
+                    report = self.status_queue.get(timeout=self.restart_delay)
+                    self.usage[report['name']] = report
+                    logging.info(f"Usage {report['name']} (pid {report['pid']}): "
+                                 f"cpu {report['cpu_seconds']:.1f}s, max rss {report['max_rss_mb']:.1f}MB")
+                except queue.Empty:
+                    pass
+                self.usage['market_data'] = self.manager.get_market_data().get_usage()
+                for account_id, worker in list(self.workers.items()):
+                    if not worker.is_alive():
+                        logging.error(f"Worker for account {account_id} exited with {worker.exitcode}, restarting")
+                        self.start_worker(account_id)
+        except KeyboardInterrupt:
+            logging.info("Supervisor interrupted")
+        finally:
+            self.stop()
+
+    def stop(self):
+        self.running = False
+        for account_id, worker in self.workers.items():
+            worker.terminate()
+            worker.join()
+        if self.manager:
+            self.manager.shutdown()
+        logging.info("Supervisor stopped.")
@@ -0,0 +1,209 @@
+"""
+Tick-to-order latency tracing.
+
+Every inbound stream event gets a trace with a monotonic id. Stages mark the time since the previous
+mark as the event moves on: decode in StreamHandler, quote and risk in the orchestrator, queued when a
+worker picks the event up, decision in the bot, indicator, reconcile and order around the order
+requests. A trace lives in a thread-local while one thread works on it and is handed over with the
+work when the orchestrator dispatches it to a bot. Finished traces go to a ring buffer of the last
+capacity events, exported as JSON lines with a per-stage summary (count, mean, p50, p99):
+
+    on stop_tracing(), on SIGUSR2, or when data/trace.cmd contains 'dump'
+
+Like the profiler's spans, every call here is a no-op while tracing is off.
+"""
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import count
+import json
+import logging
+import os
+import signal
+import threading
+import time
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s : %(message)s')
+
+_tracer = None  # The running Tracer
+_local = threading.local()  # .trace, the trace the current thread works on
+
+
+class Trace:
+    __slots__ = ('trace_id', 'kind', 'instrument', 'time', 'start_ns', 'last_ns', 'end_ns', 'stages', 'outcome')
+
+    def __init__(self, trace_id, kind, instrument=None):
+        self.trace_id = trace_id
+        self.kind = kind
+        self.instrument = instrument
+        self.time = time.time()
+        self.start_ns = self.last_ns = time.perf_counter_ns()
+        self.end_ns = None
+        self.stages = []  # (stage, nanoseconds since the previous mark)
+        self.outcome = None
+
+    def mark(self, stage):
+        now = time.perf_counter_ns()
+        self.stages.append((stage, now - self.last_ns))
+        self.last_ns = now
+
+
+class Tracer:
+    def __init__(self, capacity=10_000, output_dir='data/traces', command_file='data/trace.cmd'):
+        self.capacity = capacity
+        self.output_dir = output_dir
+        self.command_file = command_file
+        self.traces = deque(maxlen=capacity)  # Finished traces, oldest dropped first
+        self.finished = 0
+        self._ids = count(1)
+        self._next_command_check = 0.0
+        self._command_lock = threading.Lock()  # One thread at a time looks at the command file
+
+    def begin(self, kind, instrument=None):
+        return Trace(next(self._ids), kind, instrument)
+
+    def finish(self, trace, outcome):
+        trace.end_ns = time.perf_counter_ns()
+        trace.outcome = outcome
+        self.traces.append(trace)
+        self.finished += 1
+        # Workers finish traces concurrently: the one that gets the lock checks, the others move on
+        if trace.end_ns >= self._next_command_check and self._command_lock.acquire(blocking=False):
+            try:
+                if trace.end_ns >= self._next_command_check:
+                    self._next_command_check = trace.end_ns + 1_000_000_000
+                    self.check_command_file()
+            finally:
+                self._command_lock.release()
+
+    def check_command_file(self):
+        try:
+            with open(self.command_file) as file:
+                command = file.read().strip()
+            os.remove(self.command_file)
+        except FileNotFoundError:
+            return  # No command, or another process took it first
+        logging.info(f"Tracer command: {command}")
+        if command == 'dump':
+            self.export()
+        elif command == 'reset':
+            self.traces.clear()
+
+    def summary(self):
+        """Count, mean, p50 and p99 in microseconds per stage, and of the total per outcome ('total:order'...)."""
+        durations = defaultdict(list)
+        for trace in list(self.traces):
+            for stage, ns in trace.stages:
+                durations[stage].append(ns)
+            durations[f"total:{trace.outcome}"].append(trace.end_ns - trace.start_ns)
+        summary = {}
+        for stage, values in sorted(durations.items()):
+            values = np.array(values) / 1000
+            summary[stage] = {"count": len(values), "mean_us": float(values.mean()),
+                              "p50_us": float(np.percentile(values, 50)), "p99_us": float(np.percentile(values, 99))}
+        return summary
+
+    def export(self):
+        """Write the buffered traces and their summary, returns the path of the traces file."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"traces-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.jsonl")
+        traces = list(self.traces)
+        with open(path, 'w') as file:
+            for trace in traces:
+                file.write(json.dumps({
+                    "id": trace.trace_id, "kind": trace.kind, "instrument": trace.instrument, "time": trace.time,
+                    "outcome": trace.outcome, "total_us": (trace.end_ns - trace.start_ns) / 1000,
+                    "stages": [[stage, ns / 1000] for stage, ns in trace.stages],
+                }, separators=(',', ':')) + "\n")
+        with open(path.replace('.jsonl', '.summary.json'), 'w') as file:
+            json.dump({"traces": len(traces), "finished": self.finished, "stages": self.summary()}, file, indent=2)
+        logging.info(f"{len(traces)} traces written to {path}")
+        return path
+
+
+# -----------------Current trace-----------------#
+
+def begin(kind, instrument=None):
+    """Start a trace for an inbound event on this thread, replacing (and dropping) any unfinished one."""
+    tracer = _tracer
+    if tracer is None:
+        return None
+    _local.trace = tracer.begin(kind, instrument)
+    return _local.trace
+
+
+def current():
+    return getattr(_local, 'trace', None)
+
+
+def mark(stage, instrument=None):
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        if instrument is not None and trace.instrument is None:
+            trace.instrument = instrument
+        trace.mark(stage)
+
+
+def end(outcome='done', trace=None):
+    """Finish the current trace (or trace) into the ring buffer."""
+    if trace is None:
+        trace = getattr(_local, 'trace', None)
+        _local.trace = None
+    tracer = _tracer
+    if trace is not None and tracer is not None:
+        tracer.finish(trace, outcome)
+
+
+def discard():
+    _local.trace = None
+
+
+def handoff():
+    """Take the current trace off this thread, to be carried on by another with resumed()."""
+    trace = getattr(_local, 'trace', None)
+    _local.trace = None
+    return trace
+
+
+@contextmanager
+def resumed(trace):
+    """Work on a handed-off trace: marks the time it waited, finishes it when the block exits."""
+    if trace is None:
+        yield
+        return
+    trace.mark('queued')
+    _local.trace = trace
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'order' if any(stage == 'order' for stage, _ in trace.stages) else 'done'
+    finally:
+        _local.trace = None
+        end(outcome, trace)
+
+
+# -----------------Switch-----------------#
+
+def start_tracing(**kwargs):
+    """Start the process-wide tracer (once) and hook SIGUSR2 to export it when called from the main thread."""
+    global _tracer
+    if _tracer is not None:
+        return _tracer
+    _tracer = Tracer(**kwargs)
+    if threading.current_thread() is threading.main_thread() and hasattr(signal, 'SIGUSR2'):
+        signal.signal(signal.SIGUSR2, lambda signum, frame: _tracer and _tracer.export())
+    logging.info(f"Tracing the last {_tracer.capacity} events, 'dump' to {_tracer.command_file} "
+                 f"or SIGUSR2 exports them")
+    return _tracer
+
+
+def stop_tracing(export=True):
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer.export() if tracer and export and tracer.traces else None
+
+
+def get_tracer():
+    return _tracer
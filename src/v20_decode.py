@@ -0,0 +1,106 @@
+import json
+import logging
+
+from oandapyV20 import API
+from oandapyV20.exceptions import V20Error
+from oandapyV20.oandapyV20 import TRADING_ENVIRONMENTS
+import oandapyV20.endpoints.instruments as instruments
+
+from src.records import CandleBatch, Quote
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s : %(message)s')
+
+
+# -----------------JSON backend-----------------#
+# The fastest installed parser wins; all of them accept bytes and return plain dicts/lists.
+
+def _select_backend():
+    try:
+        import orjson
+        return 'orjson', orjson.loads
+    except ImportError:
+        pass
+    try:
+        import ujson
+        return 'ujson', ujson.loads
+    except ImportError:
+        pass
+    return 'json', json.loads
+
+
+JSON_BACKEND, loads = _select_backend()
+
+
+def set_json_backend(name):
+    """Force a backend ('orjson', 'ujson' or 'json'), e.g. to benchmark or to rule out a parser bug."""
+    global JSON_BACKEND, loads
+    if name == 'json':
+        JSON_BACKEND, loads = 'json', json.loads
+    else:
+        module = __import__(name)
+        JSON_BACKEND, loads = name, module.loads
+    logging.info(f"JSON backend set to {JSON_BACKEND}")
+
+
+# -----------------Typed extraction-----------------#
+
+def decode_candles(payload, price='mid'):
+    """Decode a raw InstrumentsCandles response straight into a CandleBatch (price 'mid', 'bid', 'ask' or 'bam')."""
+    return CandleBatch.from_v20(loads(payload)['candles'], price=price)
+
+
+def decode_stream_line(line):
+    """Decode one pricing stream line: PRICE messages become a Quote, anything else (heartbeats) stays a dict."""
+    msg = loads(line)
+    if msg.get('type') == 'PRICE':
+        return Quote.from_v20(msg)
+    return msg
+
+
+# -----------------Raw requests-----------------#
+
+def _endpoint_url(api, endpoint, stream=False):
+    return f"{TRADING_ENVIRONMENTS[api.environment]['stream' if stream else 'api']}/{endpoint}"
+
+
+def request_raw(api, endpoint):
+    """Perform a GET endpoint request through the API session and return the undecoded body."""
+    response = api.client.get(_endpoint_url(api, endpoint), params=getattr(endpoint, 'params', None),
+                              **api.request_params)
+    if response.status_code >= 400:
+        raise V20Error(response.status_code, response.content.decode('utf-8'))
+    return response.content
+
+
+def iter_stream_lines(api, endpoint, on_open=None):
+    """
+    Yield the raw, non-empty lines of a streaming endpoint, for decode_stream_line or loads. on_open gets
+    the HTTP response first, closing it from another thread ends the iteration.
+    """
+    response = api.client.get(_endpoint_url(api, endpoint, stream=True), params=getattr(endpoint, 'params', None),
+                              stream=True, **api.request_params)
+    if on_open is not None:
+        on_open(response)
+    if response.status_code >= 400:
+        raise V20Error(response.status_code, response.content.decode('utf-8'))
+    for line in response.iter_lines(60):
+        if line:
+            yield line
+
+
+def get_historical_batch(count=None, granularity='D', access_token=None, instrument=None, start_date=None,
+                         end_date=None, price='BAM'):
+    """
+    get_historical_data, decoded with the fast backend straight into a CandleBatch. The default 'BAM'
+    fetches mid, bid and ask in one request; a single component ('M', 'B' or 'A') gives just that OHLC.
+    """
+    client = API(access_token=access_token)
+    params = {"granularity": granularity, "price": price}
+    if count is not None:
+        params["count"] = count
+    if start_date is not None:
+        params["from"] = start_date.isoformat()
+    if end_date is not None:
+        params["to"] = end_date.isoformat()
+    payload = request_raw(client, instruments.InstrumentsCandles(instrument=instrument, params=params))
+    return decode_candles(payload, price='bam' if len(price) > 1 else {'M': 'mid', 'B': 'bid', 'A': 'ask'}[price])
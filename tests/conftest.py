@@ -0,0 +1,48 @@
+import pytest
+
+from src.order_validator import order_validator, InstrumentConstraints
+
+EUR_USD_SPECS = {"displayPrecision": 5, "tradeUnitsPrecision": 0, "minimumTradeSize": "1",
+                 "maximumOrderUnits": "100000000", "minimumTrailingStopDistance": "0.00050",
+                 "maximumTrailingStopDistance": "1.00000"}
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """A working directory of its own, so data/ (bars database, checkpoints) starts empty."""
+    (tmp_path / 'data').mkdir()
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def eur_usd():
+    """EUR_USD specs in the shared order validator, without an instruments table."""
+    order_validator.constraints['EUR_USD'] = InstrumentConstraints(EUR_USD_SPECS)
+    yield 'EUR_USD'
+    order_validator.clear()
+
+
+class FakeApi:
+    """Records the endpoint requests; OrderList answers with the given pending orders."""
+
+    def __init__(self, pending=()):
+        self.pending = list(pending)
+        self.requests = []
+
+    def request(self, endpoint):
+        self.requests.append(endpoint)
+        if type(endpoint).__name__ == 'OrderList':
+            return {"orders": self.pending}
+        return {}
+
+    def sent(self):
+        # (endpoint name, order id or None) of every request but OrderList
+        return [(type(endpoint).__name__, endpoint._endpoint.split('/orders/')[1].split('/')[0]
+                 if '/orders/' in endpoint._endpoint else None)
+                for endpoint in self.requests if type(endpoint).__name__ != 'OrderList']
+
+
+@pytest.fixture
+def fake_api():
+    return FakeApi
@@ -0,0 +1,115 @@
+from src.grid_bot import GridBot
+from src.grid_reconciler import GridReconciler
+
+
+def test_grid_orders_carry_stop_loss_and_take_profit_from_their_entry(eur_usd, fake_api):
+    bot = GridBot.__new__(GridBot)
+    bot.reconciler = GridReconciler(fake_api(), 'account', eur_usd)
+    bot.long_available_units, bot.short_available_units = 1000, 900
+    bot.grid_levels = {"atr": 0.002, "long_entry": 1.098, "short_entry": 1.102, "sl_distance": 0.003,
+                       "tp_distance": 0.0025}
+    bot.reconciler.reconcile(bot.desired_orders(), live={})
+    sent = {request.data['order']['clientExtensions']['id']: request.data['order']
+            for request in bot.reconciler.api.requests}
+    long, short = sent['grid-EUR_USD-long'], sent['grid-EUR_USD-short']
+    assert (long['units'], long['price']) == ('1000', '1.09800')
+    assert long['stopLossOnFill'] == {"price": '1.09500'} and long['takeProfitOnFill'] == {"price": '1.10050'}
+    assert (short['units'], short['price']) == ('-900', '1.10200')
+    assert short['stopLossOnFill'] == {"price": '1.10500'} and short['takeProfitOnFill'] == {"price": '1.09950'}
+
+
+def test_grid_rejected_by_simulation_leaves_the_checkpoint(workdir, eur_usd, fake_api):
+    from src.state_store import StateStore
+    bot = GridBot.__new__(GridBot)
+    bot.instrument = eur_usd
+    bot.reconciler = GridReconciler(fake_api(), 'account', eur_usd)
+    bot.state_store = StateStore('data/state.json')
+    bot.grid_settings = {"sl_atr_factor": 1.5, "tp_atr_factor": 1.5, "entry_atr_factor": 0.25}
+    bot.grid_simulation = {"enabled": True}
+    bot.get_current_price, bot.get_recent_atr = (lambda: 1.1), (lambda: 0.002)
+    bot.is_simulation_acceptable = lambda price, atr: False
+    bot.is_grid_active, bot.grid_setup_time, bot.grid_levels, bot.placing = True, None, None, False
+    bot.available_funds, bot.long_available_units, bot.short_available_units = 5000.0, 1000, 1000
+    bot.state_store.set_item('grids', eur_usd, bot.state())
+
+    bot.place_atr_based_orders()
+    assert bot.is_grid_active is False
+    assert StateStore('data/state.json').load() == {'grids': {}}
+
+
+def resumable_bot(fake_api):
+    from src.state_store import StateStore
+    bot = GridBot.__new__(GridBot)
+    bot.instrument = 'EUR_USD'
+    bot.reconciler = GridReconciler(fake_api(), 'account', 'EUR_USD')
+    bot.state_store = StateStore('data/state.json')
+    bot.resets = 0
+
+    def reset_grid():
+        bot.resets += 1
+    bot.reset_grid = reset_grid
+    return bot
+
+
+def test_resume_finishes_an_interrupted_placement(workdir, eur_usd, fake_api):
+    from tests.test_state_store import GRID
+    bot = resumable_bot(fake_api)
+    bot.resume(dict(GRID, placing=True), {})
+    assert sorted(name for name, _ in bot.reconciler.api.sent()) == ['OrderCreate', 'OrderCreate']
+    assert bot.resets == 0
+    assert bot.state_store.load()['grids']['EUR_USD']['placing'] is False
+
+
+def test_resume_recenters_a_grid_that_ran_its_course(workdir, eur_usd, fake_api):
+    # All orders placed, since filled and closed out: the saved levels are stale
+    from tests.test_state_store import GRID
+    bot = resumable_bot(fake_api)
+    bot.resume(GRID, {})
+    assert bot.reconciler.api.sent() == []
+    assert bot.resets == 1
+
+
+class Holdings:
+    def __init__(self, **holdings):
+        self.by_instrument = holdings
+
+    def holdings(self, instrument):
+        return self.by_instrument.get(instrument, (0.0, 0.0))
+
+
+def banded_bot(risk_engine):
+    from types import SimpleNamespace
+    bot = GridBot.__new__(GridBot)
+    bot.instrument = 'EUR_USD'
+    bot.utils = SimpleNamespace(risk_engine=risk_engine)
+    bot.is_grid_active, bot.out_of_band = True, False
+    bot.grid_levels = {"atr": 0.002, "long_entry": 1.098, "short_entry": 1.102, "sl_distance": 0.003,
+                       "tp_distance": 0.003}
+    bot.resets = 0
+
+    def reset_grid():
+        bot.resets += 1
+        bot.out_of_band = False
+    bot.reset_grid = reset_grid
+    return bot
+
+
+def test_grid_status_only_looks_at_its_own_instrument():
+    # Another instrument's position does not keep an empty grid from resetting
+    bot = banded_bot(Holdings(GBP_USD=(1000.0, 2000.0)))
+    bot.check_grid_status()
+    assert bot.resets == 1
+    # A position or resting orders of its own keep it while the market is favorable
+    for holdings in ((1000.0, 0.0), (0.0, 2000.0)):
+        bot = banded_bot(Holdings(EUR_USD=holdings))
+        bot.check_grid_status()
+        assert bot.resets == 0
+
+
+def test_out_of_band_ticks_check_once_per_excursion():
+    bot = banded_bot(Holdings(EUR_USD=(1000.0, 0.0)))
+    checks = []
+    bot.check_grid_status = lambda: checks.append(1)
+    for price in (1.090, 1.089, 1.088, 1.100, 1.110, 1.111):  # Band is [1.095, 1.105]
+        bot.on_tick(price)
+    assert len(checks) == 2
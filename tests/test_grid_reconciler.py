@@ -0,0 +1,114 @@
+import pytest
+
+from src.grid_reconciler import GridReconciler, diff_grid, order_matches, tagged_orders
+
+
+def live_order(order_id, level, units, price, instrument='EUR_USD', tag='grid', **exits):
+    order = {"id": order_id, "instrument": instrument, "units": units, "type": 'LIMIT', "price": price,
+             "clientExtensions": {"id": f"{tag}-{instrument}-{level}", "tag": tag}}
+    order.update(exits)
+    return order
+
+
+@pytest.fixture
+def reconciler(eur_usd, fake_api):
+    return GridReconciler(fake_api(), 'account', eur_usd)
+
+
+def test_order_matches_within_price_tolerance(reconciler):
+    desired = reconciler.order_spec('long', 1000, '1.10000')
+    assert order_matches(live_order('1', 'long', '1000', '1.10000'), desired)
+    assert order_matches(live_order('1', 'long', '1000', '1.1000000001'), desired)
+    assert not order_matches(live_order('1', 'long', '1000', '1.10010'), desired)
+    assert not order_matches(live_order('1', 'long', '999', '1.10000'), desired)
+
+
+def test_order_matches_compares_exits(reconciler):
+    desired = reconciler.order_spec('long', 1000, '1.10000', takeProfitOnFill={"price": '1.10500'})
+    assert order_matches(live_order('1', 'long', '1000', '1.10000', takeProfitOnFill={"price": '1.10500'}), desired)
+    assert not order_matches(live_order('1', 'long', '1000', '1.10000', takeProfitOnFill={"price": '1.10600'}),
+                             desired)
+    assert not order_matches(live_order('1', 'long', '1000', '1.10000'), desired)
+
+
+def test_diff_grid_sorts_levels(reconciler):
+    desired = {
+        'unchanged': reconciler.order_spec('unchanged', 1000, '1.10000'),
+        'moved': reconciler.order_spec('moved', 1000, '1.10200'),
+        'new': reconciler.order_spec('new', -1000, '1.10400'),
+    }
+    live = {
+        'unchanged': live_order('1', 'unchanged', '1000', '1.10000'),
+        'moved': live_order('2', 'moved', '1000', '1.10100'),
+        'removed': live_order('3', 'removed', '-1000', '1.10300'),
+    }
+    creates, replaces, cancels = diff_grid(desired, live)
+    assert [level for level, _ in creates] == ['new']
+    assert [(level, order_id) for level, order_id, _ in replaces] == [('moved', '2')]
+    assert [(level, order['id']) for level, order in cancels] == [('removed', '3')]
+
+
+def test_reconcile_cancels_then_replaces_then_creates(reconciler):
+    reconciler.api.pending = [
+        live_order('1', 'unchanged', '1000', '1.10000'),
+        live_order('2', 'moved', '1000', '1.10100'),
+        live_order('3', 'removed', '-1000', '1.10300'),
+    ]
+    summary = reconciler.reconcile({
+        'unchanged': reconciler.order_spec('unchanged', 1000, 1.1),
+        'moved': reconciler.order_spec('moved', 1000, 1.102),
+        'new': reconciler.order_spec('new', -1000, 1.104),
+    })
+    assert summary == {"created": 1, "replaced": 1, "cancelled": 1, "unchanged": 1}
+    assert reconciler.api.sent() == [('OrderCancel', '3'), ('OrderReplace', '2'), ('OrderCreate', None)]
+    # Normalized by the validator before they are sent
+    assert reconciler.api.requests[-1].data["order"]["price"] == '1.10400'
+    assert reconciler.api.requests[-1].data["order"]["clientExtensions"] == {"id": 'grid-EUR_USD-new', "tag": 'grid'}
+
+
+def test_reconcile_unchanged_grid_sends_nothing(reconciler):
+    live = {'long': live_order('1', 'long', '1000', '1.10000')}
+    summary = reconciler.reconcile({'long': reconciler.order_spec('long', 1000, 1.1)}, live=live)
+    assert summary == {"created": 0, "replaced": 0, "cancelled": 0, "unchanged": 1}
+    assert reconciler.api.requests == []
+
+
+def test_reconcile_empty_grid_cancels_only_tagged_orders(reconciler):
+    reconciler.api.pending = [live_order('1', 'long', '1000', '1.10000'),
+                              live_order('2', 'long', '1000', '1.10000', tag='manual')]
+    reconciler.reconcile({})
+    assert reconciler.api.sent() == [('OrderCancel', '1')]
+
+
+def test_reconcile_stops_on_pre_trade_rejection(eur_usd, fake_api):
+    class RejectingRisk:
+        def check_order(self, instrument, units, price):
+            return 'margin'
+
+    reconciler = GridReconciler(fake_api(), 'account', eur_usd, risk_engine=RejectingRisk())
+    with pytest.raises(ValueError, match='Pre-trade check failed'):
+        reconciler.reconcile({'long': reconciler.order_spec('long', 1000, 1.1)}, live={})
+    assert reconciler.api.requests == []
+
+
+def test_tagged_orders_by_instrument_and_level():
+    orders = [
+        live_order('1', 'long', '1000', '1.10000'),
+        live_order('2', 'short', '-1000', '1.10400'),
+        live_order('3', 'long', '1000', '1.25000', instrument='GBP_USD'),
+        live_order('4', 'long', '1000', '1.10000', tag='manual'),
+        {"id": '5', "instrument": 'EUR_USD', "type": 'TAKE_PROFIT', "price": '1.2'},  # No client extensions
+        # Tagged, but its client id names another instrument
+        dict(live_order('6', 'long', '1000', '1.10000'), instrument='USD_JPY'),
+    ]
+    tagged = tagged_orders(orders)
+    assert {instrument: {level: order['id'] for level, order in levels.items()}
+            for instrument, levels in tagged.items()} == {'EUR_USD': {'long': '1', 'short': '2'},
+                                                          'GBP_USD': {'long': '3'}}
+    assert list(tagged_orders(orders, tag='manual')) == ['EUR_USD']
+
+
+def test_live_orders_of_the_instrument(reconciler):
+    reconciler.api.pending = [live_order('1', 'long', '1000', '1.10000'),
+                              live_order('3', 'long', '1000', '1.25000', instrument='GBP_USD')]
+    assert list(reconciler.live_orders()) == ['long']
@@ -0,0 +1,58 @@
+import importlib.util
+
+import numpy as np
+import pytest
+
+import src.kernels as kernels
+from benchmarks.bench_kernels import TOLERANCE, leg_cases, paths, reference_indicators, relative_error
+from benchmarks.synthetic import make_v20_candles
+from src.records import CandleBatch
+
+BACKENDS = ['python', 'numpy', pytest.param('numba', marks=pytest.mark.skipif(
+    not importlib.util.find_spec('numba'), reason='numba is not installed'))]
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+    previous = kernels.KERNEL_BACKEND
+    kernels.set_kernel_backend(request.param)
+    yield request.param
+    kernels.set_kernel_backend(previous)
+
+
+@pytest.fixture(scope='module')
+def bars():
+    data = CandleBatch.from_v20(make_v20_candles(1_500, granularity_minutes=60))
+    return data, reference_indicators(data)[0]
+
+
+def test_atr_matches_reference(backend, bars):
+    data, expected = bars
+    values = kernels.atr(data.high, data.low, data.close, 14)
+    assert relative_error(values, expected['atr']) <= TOLERANCE['atr']
+
+
+def test_chop_matches_reference(backend, bars):
+    data, expected = bars
+    values = kernels.chop(data.high, data.low, data.close, 14)
+    assert relative_error(values, expected['chop']) <= TOLERANCE['chop']
+
+
+def test_bbands_matches_reference(backend, bars):
+    data, expected = bars
+    values = kernels.bbands(data.close, 20, 2)
+    assert values.shape == expected['bbands'].shape
+    assert relative_error(values, expected['bbands']) <= TOLERANCE['bbands']
+
+
+def test_leg_events_match_uncompiled_loops(backend):
+    high, low = paths(count=200, steps=168)
+    for case in leg_cases(high, low):
+        expected = kernels._leg_events_loop(high, low, *case)
+        for got, want in zip(kernels.leg_events(high, low, *case), expected):
+            np.testing.assert_array_equal(got, want)
+
+
+def test_compute_kernel_indicator_leaves_uncovered_indicators_to_pandas_ta(bars):
+    data, _ = bars
+    assert kernels.compute_kernel_indicator('rsi', data.to_dataframe(), length=14) is None
@@ -0,0 +1,82 @@
+import pytest
+
+from src.database_functions import set_instruments_table
+from src.order_validator import OrderValidator, InstrumentConstraints
+
+from tests.conftest import EUR_USD_SPECS
+
+
+@pytest.fixture
+def validator():
+    validator = OrderValidator()
+    validator.constraints['EUR_USD'] = InstrumentConstraints(EUR_USD_SPECS)
+    validator.constraints['XAU_USD'] = InstrumentConstraints(dict(
+        EUR_USD_SPECS, displayPrecision=3, tradeUnitsPrecision=2, minimumTradeSize='0.01', maximumOrderUnits='500'))
+    return validator
+
+
+def order(**fields):
+    return dict({"instrument": 'EUR_USD', "units": '1000', "type": 'LIMIT', "price": '1.1',
+                 "positionFill": 'DEFAULT'}, **fields)
+
+
+def test_prices_and_exits_rounded_to_display_precision(validator):
+    validated = validator.validate(order(price='1.105123456', takeProfitOnFill={"price": 1.11},
+                                         stopLossOnFill={"distance": '0.0015004'}))
+    assert validated['price'] == '1.10512'
+    assert validated['takeProfitOnFill'] == {"price": '1.11000'}
+    assert validated['stopLossOnFill'] == {"distance": '0.00150'}
+
+
+def test_units_rounded_to_trade_units_precision(validator):
+    assert validator.validate(order(units='1000.4'))['units'] == '1000'
+    assert validator.validate(order(units=-999.6))['units'] == '-1000'
+    assert validator.validate(order(instrument='XAU_USD', units='1.236', price='2000.12345'))['units'] == '1.24'
+
+
+def test_order_body_is_copied(validator):
+    original = order(price='1.105123456')
+    validator.validate(original)
+    assert original['price'] == '1.105123456'
+
+
+def test_units_below_minimum_rejected(validator):
+    with pytest.raises(ValueError, match='below the minimum trade size'):
+        validator.validate(order(units='0.4'))  # Rounds to 0 units
+    with pytest.raises(ValueError, match='below the minimum trade size'):
+        validator.validate(order(instrument='XAU_USD', units='0.004', price='2000'))
+
+
+def test_units_above_maximum_rejected(validator):
+    with pytest.raises(ValueError, match='above the maximum'):
+        validator.validate(order(instrument='XAU_USD', units='-500.01', price='2000'))
+    assert validator.validate(order(instrument='XAU_USD', units='500', price='2000'))['units'] == '500.00'
+
+
+def test_non_positive_price_rejected(validator):
+    with pytest.raises(ValueError, match='is not positive'):
+        validator.validate(order(price='0'))
+
+
+def test_trailing_stop_distance_bounds(validator):
+    validated = validator.validate(order(trailingStopLossOnFill={"distance": '0.0012345'}))
+    assert validated['trailingStopLossOnFill'] == {"distance": '0.00123'}
+    with pytest.raises(ValueError, match='Trailing stop loss distance too low'):
+        validator.validate(order(trailingStopLossOnFill={"distance": '0.0004'}))
+    with pytest.raises(ValueError, match='Trailing stop loss distance too high'):
+        validator.validate(order(trailingStopLossOnFill={"distance": '1.5'}))
+
+
+def test_specs_read_from_instruments_table(workdir):
+    set_instruments_table([dict(EUR_USD_SPECS, name='EUR_USD', type='CURRENCY', displayName='EUR/USD', pipLocation=-4,
+                                maximumPositionSize='0', marginRate='0.0333', guaranteedStopLossOrderMode='DISABLED')])
+    validator = OrderValidator()
+    assert validator.validate(order(price='1.105123456'))['price'] == '1.10512'
+    assert 'EUR_USD' in validator.constraints
+
+
+def test_unknown_instrument_rejected(workdir):
+    set_instruments_table([dict(EUR_USD_SPECS, name='EUR_USD', type='CURRENCY', displayName='EUR/USD', pipLocation=-4,
+                                maximumPositionSize='0', marginRate='0.0333', guaranteedStopLossOrderMode='DISABLED')])
+    with pytest.raises(ValueError, match='no instrument specs for GBP_USD'):
+        OrderValidator().validate(order(instrument='GBP_USD'))
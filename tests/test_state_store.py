@@ -0,0 +1,51 @@
+import json
+
+from src.screener import InstrumentScreener
+from src.state_store import StateStore
+
+GRID = {"is_grid_active": True, "grid_setup_time": '2024-01-05T21:00:00',
+        "grid_levels": {"atr": 0.002, "long_entry": 1.098, "short_entry": 1.102, "sl_distance": 0.003,
+                        "tp_distance": 0.003},
+        "placing": False, "available_funds": 5000.0, "long_available_units": 1000, "short_available_units": 1000}
+
+
+def test_sections_survive_a_restart(workdir):
+    StateStore('data/state.json').set_item('grids', 'EUR_USD', GRID)
+    # A new process writes another section before anything loads the checkpoint
+    restarted = StateStore('data/state.json')
+    restarted.set('screener', {'EUR_USD': [1704495600, 65.0, 0.1]})
+    assert StateStore('data/state.json').load() == {'grids': {'EUR_USD': GRID},
+                                                    'screener': {'EUR_USD': [1704495600, 65.0, 0.1]}}
+
+
+def test_remove_item(workdir):
+    store = StateStore('data/state.json')
+    store.set_item('grids', 'EUR_USD', GRID)
+    store.set_item('grids', 'GBP_USD', GRID)
+    store.remove_item('grids', 'EUR_USD')
+    store.remove_item('grids', 'USD_JPY')  # Not there, nothing written
+    assert list(StateStore('data/state.json').load()['grids']) == ['GBP_USD']
+
+
+def test_unusable_checkpoint_is_ignored(workdir):
+    (workdir / 'data' / 'state.json').write_text('{"version": 1, "sections": {"gri')
+    assert StateStore('data/state.json').load() == {}
+    (workdir / 'data' / 'state.json').write_text(json.dumps({"version": 0, "sections": {"grids": {}}}))
+    assert StateStore('data/state.json').load() == {}
+
+
+def test_load_returns_a_copy(workdir):
+    store = StateStore('data/state.json')
+    store.set_item('grids', 'EUR_USD', GRID)
+    store.load()['grids']['EUR_USD']['is_grid_active'] = False
+    assert store.load()['grids']['EUR_USD']['is_grid_active'] is True
+
+
+def test_screener_restore_keeps_newer_results():
+    screener = InstrumentScreener({"high": 61.8, "low": 38.2}, {"high": 0.8, "low": 0.2})
+    screener.update('EUR_USD', 200, 70.0, 0.5)  # Evaluated after the checkpoint was written
+    screener.restore({'EUR_USD': [100, 70.0, 0.1], 'GBP_USD': [100, 70.0, 0.3], 'USD_JPY': [100, 30.0, 0.2]})
+    assert screener.results['EUR_USD'] == (200, 70.0, 0.5)
+    assert screener.grid.ranked() == [('GBP_USD', 0.3), ('EUR_USD', 0.5)]
+    assert screener.trending.ranked() == [('USD_JPY', 0.2)]
+    assert InstrumentScreener(screener.chop_filters, screener.bb_filters).state() == {}
@@ -3,6 +3,10 @@ import oandapyV20.endpoints.accounts as accounts
 import oandapyV20.endpoints.instruments as instruments
 from datetime import datetime, timedelta
 from dateutil.parser import parse as parse_iso8601_date
+from contextlib import contextmanager
+import importlib
+import logging
+import time
 
 
 
@@ -59,11 +63,13 @@ def granularity_to_minutes(granularity):
     return granularity_map.get(granularity, 0)
 
 
-def get_historical_data(count=None, granularity='D', access_token=None, instrument=None, start_date=None, end_date=None):
+def get_historical_data(count=None, granularity='D', access_token=None, instrument=None, start_date=None, end_date=None,
+                        price='BAM'):
     client = API(access_token=access_token)
 
-    # Initialize params dictionary with granularity; count will be added if it's not None
-    params = {"granularity": granularity}
+    # Initialize params dictionary with granularity and the price components (bid, ask and mid in one request);
+    # count will be added if it's not None
+    params = {"granularity": granularity, "price": price}
 
     # If count is provided, add it to the params
     if count is not None:
@@ -86,10 +92,52 @@ def get_historical_data(count=None, granularity='D', access_token=None, instrume
     # Return the 'candles' part of the response which contains the historical data
     return resp.get('candles')
 
+class LazyModule:
+    """Stand-in for a heavy module (pandas_ta, backtrader...) that is only imported on first attribute access."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            start = time.perf_counter()
+            self._module = importlib.import_module(self._name)
+            logging.info(f"Lazily imported {self._name} in {time.perf_counter() - start:.3f}s")
+        return getattr(self._module, attribute)
+
+
+class PhaseTimer:
+    """Records the wall time of named phases, e.g. the cold start of MainBot."""
+
+    def __init__(self):
+        self.created = time.perf_counter()
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def total(self):
+        return time.perf_counter() - self.created
+
+    def report(self):
+        phases = ", ".join(f"{name}: {duration * 1000:.1f}ms" for name, duration in self.phases)
+        return f"total: {self.total() * 1000:.1f}ms ({phases})"
+
+
+pd = LazyModule('pandas')
+
+
 def compute_indicator(data, indicator_func, include_volume=False, **kwargs):
-    params = {'high': data['high'], 'low': data['low'], 'close': data['close']}
-    if include_volume:
-        params['volume'] = data['volume']
+    # data is a DataFrame or a CandleBatch, whose NumPy columns are wrapped (without copying) for pandas_ta
+    columns = ['high', 'low', 'close'] + (['volume'] if include_volume else [])
+    params = {column: data[column] if hasattr(data[column], 'index') else pd.Series(data[column])
+              for column in columns}
     return indicator_func(**params, **kwargs).to_numpy()
 
 